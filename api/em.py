@@ -13,12 +13,19 @@ from services.hcpcs.hcpcs import get_hcpcs
 from services.icd.icd import get_icd
 from services.mdm.mdm import get_mdm
 from api.gliner_pii import pii_ai_demo
+from utils.sections import segment
+from utils.usage_ledger import set_usage_context
+from utils.adaptive_limit import AIMDLimiter, is_overload
+from utils.pipeline_metrics import stamp_enqueue, observe_dequeue, stage_timer, register_worker
+from utils.structured_logging import configure_logging, Payload
+from concurrent.futures import ThreadPoolExecutor
 from opentelemetry import trace
+from opentelemetry.propagate import inject
 from utils.tracing import init_tracer, get_tracer, use_trace_dto_context, add_trace_dto_to_span
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+configure_logging()
 logger = logging.getLogger("em-worker")
 
 # Initialize tracing once per worker process
@@ -48,15 +55,42 @@ EM_LAST_ERROR = "EM_LAST_ERROR"
 
 SEND_URL = os.getenv("SEND")
 MAX_RETRIES = 3
+# processing attempts per task before it is stored as failed instead of requeued
+EM_MAX_ATTEMPTS = int(os.getenv("EM_MAX_ATTEMPTS", "3"))
 
+# EM tasks processed concurrently; the AIMD limiter moves between MIN and MAX (1/1/1 = the old one-at-a-time loop)
+EM_CONCURRENCY_INITIAL = int(os.getenv("EM_CONCURRENCY_INITIAL", "1"))
+EM_CONCURRENCY_MIN = int(os.getenv("EM_CONCURRENCY_MIN", "1"))
+EM_CONCURRENCY_MAX = int(os.getenv("EM_CONCURRENCY_MAX", "4"))
+
+em_limiter = AIMDLimiter("em_worker", EM_CONCURRENCY_INITIAL, EM_CONCURRENCY_MIN, EM_CONCURRENCY_MAX)
+# The limiter compares seconds per EM_LATENCY_UNIT_CHARS of chart text, so a large chart is not read as congestion;
+# charts below one unit count as one (fixed per-task overhead dominates there)
+EM_LATENCY_UNIT_CHARS = int(os.getenv("EM_LATENCY_UNIT_CHARS", "10000"))
+
+
+def normalized_task_latency(seconds: float, text_chars: int) -> float:
+    return seconds / max(text_chars / EM_LATENCY_UNIT_CHARS, 1.0)
+
+# each remote tags its LLM calls for the usage ledger before entering its event loop, and continues the
+# caller's trace (trace_context carries the W3C traceparent of em.process_one_em)
 @ray.remote
-def mdm_remote(text, trace):   return asyncio.run(get_mdm(text, trace))
+def mdm_remote(text, trace, patientId="", sections=None, profile=None, trace_context=None):
+    set_usage_context(patientId, trace)
+    with use_trace_dto_context(trace_context or {"traceId": trace}, "ray.mdm_remote"):
+        return asyncio.run(get_mdm(text, trace, patientId, sections, profile))
 
 @ray.remote
-def icd_remote(text, trace):   return asyncio.run(get_icd(text, trace))
+def icd_remote(text, trace, sections=None, patientId="", trace_context=None):
+    set_usage_context(patientId, trace)
+    with use_trace_dto_context(trace_context or {"traceId": trace}, "ray.icd_remote"):
+        return asyncio.run(get_icd(text, trace, sections))
 
 @ray.remote
-def demo_remote(text,patientId): return asyncio.run(pii_ai_demo(text, patientId))
+def demo_remote(text,patientId, sections=None, trace="", trace_context=None):
+    set_usage_context(patientId, trace)
+    with use_trace_dto_context(trace_context or {"traceId": trace}, "ray.demo_remote"):
+        return asyncio.run(pii_ai_demo(text, patientId, sections))
 
 #@ray.remote
 #def cpt_remote(text, trace, patientId):   return asyncio.run(get_cpt(text, trace, patientId))
@@ -67,7 +101,7 @@ def demo_remote(text,patientId): return asyncio.run(pii_ai_demo(text, patientId)
 
 def enqueue_em_task(task: dict):
     patient_id = task.get('patientId', 'UNKNOWN')
-    redis_client.rpush(EM_QUEUE, json.dumps(task))
+    redis_client.rpush(EM_QUEUE, stamp_enqueue(EM_QUEUE, task))
     logger.info(f"[EM-ENQUEUE] patient={patient_id} Task enqueued to EM queue")
 
 
@@ -145,6 +179,7 @@ def em_worker_status():
             "queueItemsCount": len(queue_info.get("items", [])),
             "lastSuccess": json.loads(last_success) if last_success else None,
             "lastError": json.loads(last_error) if last_error else None,
+            "concurrency": em_limiter.status(),
         }
     except Exception as e:
         return {
@@ -219,8 +254,8 @@ async def process_one_em_async(task: dict):
     trace_dto = task.get("traceDto", {})
     trace_id = trace_dto.get("traceId", "") if trace_dto else ""
 
-    logger.info(f"[EM-PROCESS-START] patient={pid} Starting medical extraction {task}")
-    logger.info(f"[EM-PROCESS-TEXT] patient={pid} text_length={len(text)} text_preview={text[:100]}")
+    logger.info("[EM-PROCESS-START] patient=%s Starting medical extraction task=%s", pid, Payload(task))
+    logger.info(f"[EM-PROCESS-TEXT] patient={pid} text_length={len(text)}")
     logger.info(f"[EM-PROCESS-RAY] patient={pid} trace={trace_id} Starting Ray remote tasks")
     
     # Add traceDto info to current span if available
@@ -234,10 +269,16 @@ async def process_one_em_async(task: dict):
     #    cpt_remote.remote(text, trace_id, pid),
     #    hcpcs_remote.remote(text, trace_id),
     #)
+    # one section map per chart, shared by every prompt
+    sections = segment(text)
+    logger.info(f"[EM-PROCESS-SECTIONS] patient={pid} sections={[s['name'] for s in sections]}")
+
+    trace_context = {}
+    inject(trace_context)
     mdm_f, icd_f,demo_f = await asyncio.gather(
-        mdm_remote.remote(text, trace_id),
-        icd_remote.remote(text, trace_id),
-        demo_remote.remote(text,pid)
+        mdm_remote.remote(text, trace_id, pid, sections, task.get("outputProfile"), trace_context),
+        icd_remote.remote(text, trace_id, sections, pid, trace_context),
+        demo_remote.remote(text,pid, sections, trace_id, trace_context)
 
     )
 
@@ -263,7 +304,7 @@ async def process_one_em_async(task: dict):
         "traceDto": task.get("traceDto", {}),
     }
     logger.info(f"[EM-PROCESS-DONE] patient={pid} Medical extraction completed")
-    logger.info(f"[EM-PROCESS-RESULT] patient={pid} result={json.dumps(final_payload, indent=2)}")
+    logger.info("[EM-PROCESS-RESULT] patient=%s result=%s", pid, Payload(final_payload))
     return final_payload
 
 
@@ -278,7 +319,8 @@ def process_one_em(task: dict):
             # Add patient ID and other task info to span
             span.set_attribute("patient.id", pid)
             span.set_attribute("task.type", "em_processing")
-            result = asyncio.run(process_one_em_async(task))
+            with stage_timer("em_process", pid):
+                result = asyncio.run(process_one_em_async(task))
     except Exception as e:
         logger.error(f"[EM-PROCESS-ERROR] patient={pid} Failed during processing: {e}")
 
@@ -292,14 +334,15 @@ def process_one_em(task: dict):
 
     try:
         logger.info(f"[EM-SEND-START] patient={pid} url={SEND_URL} Sending result to backend")
-        logger.info(f"[EM-Debug] patient={pid} result {result} header {header}")
-        resp = post_with_retry(
-            SEND_URL,
-            result,
-            headers=header,
-            retries=MAX_RETRIES,
-            patient_id=pid
-        )
+        logger.debug("[EM-Debug] patient=%s result=%s headers=%s", pid, Payload(result), Payload(header))
+        with stage_timer("callback_em", pid):
+            resp = post_with_retry(
+                SEND_URL,
+                result,
+                headers=header,
+                retries=MAX_RETRIES,
+                patient_id=pid
+            )
         logger.info(f"[EM-SEND-SUCCESS] patient={pid} status={resp.status_code} Result sent successfully")
 
     except Exception as e:
@@ -324,38 +367,70 @@ def process_one_em(task: dict):
     logger.info(f"[EM-STORE-SUCCESS] patient={pid} Result saved to Redis key={EM_RESULT_PREFIX}{pid}")
 
 
+def run_em_task(task: dict):
+    """Process one dequeued task, feed the outcome to the AIMD limiter and release its slot"""
+    patient_id = task.get("patientId", "UNKNOWN")
+    start = time.time()
+    try:
+        process_one_em(task)
+        em_limiter.on_success(normalized_task_latency(time.time() - start, len(task.get("text") or "")))
+        logger.info(f"[EM-WORKER-TASK-DONE] patient={patient_id} Task processing completed")
+
+    except Exception as err:
+        logger.error(f"[EM-WORKER-FAIL] patient={patient_id} Task processing failed: {err}")
+        if is_overload(err):
+            em_limiter.on_overload("llm_overload")
+
+        redis_client.set(EM_LAST_ERROR, json.dumps({
+            "patientId": patient_id,
+            "timestamp": time.time(),
+            "error": str(err)
+        }))
+
+        task["attempts"] = int(task.get("attempts", 0)) + 1
+        if task["attempts"] >= EM_MAX_ATTEMPTS:
+            redis_client.set(f"{EM_RESULT_PREFIX}{patient_id}", json.dumps({
+                "status": "failed",
+                "patientId": patient_id,
+                "error": str(err),
+                "attempts": task["attempts"],
+                "failedAt": time.time(),
+            }))
+            logger.error(f"[EM-WORKER-GIVEUP] patient={patient_id} attempts={task['attempts']} Task dropped after max attempts")
+            return
+
+        redis_client.rpush(EM_QUEUE, stamp_enqueue(EM_QUEUE, task, "requeue"))
+        logger.warning(f"[EM-WORKER-RETRY] patient={patient_id} attempts={task['attempts']}/{EM_MAX_ATTEMPTS} Task re-queued for retry")
+        time.sleep(2)
+    finally:
+        em_limiter.release()
+
+
 def em_worker_loop():
-    logger.info("[EM-WORKER-START] EM Worker Online — STRICT FIFO MODE")
+    logger.info(f"[EM-WORKER-START] EM Worker Online — FIFO dequeue, adaptive concurrency max={EM_CONCURRENCY_MAX}")
+    executor = ThreadPoolExecutor(max_workers=EM_CONCURRENCY_MAX, thread_name_prefix="em-task")
 
     while True:
+        acquired = False
         try:
+            # take a task only when the limiter has a free slot
+            em_limiter.acquire()
+            acquired = True
             entry = redis_client.blpop(EM_QUEUE, timeout=5)
             if not entry:
+                em_limiter.release()
                 continue
 
             _, raw = entry
             task = json.loads(raw)
+            observe_dequeue(EM_QUEUE, task)
             patient_id = task.get("patientId", "UNKNOWN")
-            logger.info(f"[EM-WORKER-TASK] patient={patient_id} Task received from queue")
-
-            try:
-                process_one_em(task)
-                logger.info(f"[EM-WORKER-TASK-DONE] patient={patient_id} Task processing completed")
-
-            except Exception as err:
-                logger.error(f"[EM-WORKER-FAIL] patient={patient_id} Task processing failed: {err}")
-
-                redis_client.set(EM_LAST_ERROR, json.dumps({
-                    "patientId": patient_id,
-                    "timestamp": time.time(),
-                    "error": str(err)
-                }))
-
-                redis_client.rpush(EM_QUEUE, json.dumps(task))
-                logger.warning(f"[EM-WORKER-RETRY] patient={patient_id} Task re-queued for retry")
-                time.sleep(2)
+            logger.info(f"[EM-WORKER-TASK] patient={patient_id} Task received from queue limit={em_limiter.status()['limit']}")
+            executor.submit(run_em_task, task)
 
         except Exception as crash:
+            if acquired:
+                em_limiter.release()
             logger.error(f"[EM-WORKER-CRASH] patient=UNKNOWN Worker crash: {crash}")
 
             redis_client.set(EM_LAST_ERROR, json.dumps({
@@ -375,6 +450,12 @@ if AUTO_FLUSH:
         redis_client.delete(key)
     logger.warning(f"[EM-FLUSH] EM Redis queue flushed on startup queue={EM_QUEUE} keys_deleted={len(keys)}")
 
+# false for API-only processes (and benchmarks) that must not consume em_queue
+EM_WORKER_ENABLED = os.getenv("EM_WORKER_ENABLED", "true").lower() == "true"
+
 import threading
-threading.Thread(target=em_worker_loop, daemon=True).start()
-logger.info("[EM-WORKER-THREAD] EM Worker thread started")
+if EM_WORKER_ENABLED:
+    em_worker_thread = threading.Thread(target=em_worker_loop, daemon=True)
+    em_worker_thread.start()
+    register_worker("em", em_worker_thread)
+    logger.info("[EM-WORKER-THREAD] EM Worker thread started")
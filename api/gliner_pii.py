@@ -2,12 +2,17 @@ import logging
 import os
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from utils.ai import ai_call_demo
+from utils.model_router import routed_call
+from api.pii_extract import (
+    PII_LLM_FALLBACK, extract_demographics, residual_fields, residual_prompt, normalize_date, log_field_sources
+)
+from utils.sections import select_sections
+from utils.structured_logging import configure_logging, Payload
 import json
 
 load_dotenv()
 DEMO_URL_BACKEND = os.getenv("DEMO_URL_BACKEND")
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+configure_logging()
 logger = logging.getLogger("pii")
 
 
@@ -230,7 +235,7 @@ def pii_detection_demo(blob_url: str, patient_id: str, traceDto: dict, returnHea
     text = download_blob_text(blob_url, patient_id)
     
     text = text.lower()
-    logger.info(f"[PII-DEMO-TEXT] patient={patient_id} text_length={len(text)} text_preview={text[:100]}")
+    logger.info(f"[PII-DEMO-TEXT] patient={patient_id} text_length={len(text)}")
 
     try:
         model_pp = get_gliner_model()  # Lazy load
@@ -322,7 +327,11 @@ Example Output Format:
 }
 """
 
-async def pii_ai_demo(text, patient_id):
+def _demo_check(raw):
+    """Escalation check for routed_call: the residual fields must come back as a JSON object"""
+    return None if isinstance(json_clean(raw), dict) else "schema"
+
+async def pii_ai_demo(text, patient_id, sections=None):
     logger.info(f"[PII-DEMO-START] patient={patient_id}")
 
     if not text:
@@ -342,30 +351,30 @@ async def pii_ai_demo(text, patient_id):
             "patientType": ""
         }
 
-    logger.info(
-        f"[PII-DEMO-TEXT] patient={patient_id} "
-        f"text_length={len(text)} text_preview={text[:100]}"
-    )
-
-    ai_response = ai_call_demo(text, prompt_demo_extraction)
-
-    result = json_clean(ai_response)
-
-    # Ensure all required keys exist
-    final_result = {
-        "name": result.get("name", ""),
-        "dateOfService": result.get("dateOfService", ""),
-        "dateOfBirth": result.get("dateOfBirth", ""),
-        "email": result.get("email", ""),
-        "accountNumber": result.get("accountNumber", ""),
-        "mrn": result.get("mrn", ""),
-        "insuranceName": result.get("insuranceName", ""),
-        "ssn": result.get("ssn", ""),
-        "age": result.get("age", ""),
-        "financialClass": result.get("financialClass", ""),
-        "gender": result.get("gender", ""),
-        "patientType": result.get("patientType", "").upper()
-    }
-
-    logger.info(f"[PII-DEMO-END] patient={patient_id} final_result {final_result}")
+    logger.info(f"[PII-DEMO-TEXT] patient={patient_id} text_length={len(text)}")
+
+    extracted = extract_demographics(text)
+    regex_fields = [k for k, v in extracted.items() if v]
+    missing = residual_fields(extracted) if PII_LLM_FALLBACK else []
+
+    result = {}
+    if missing:
+        ai_response = await routed_call(
+            "demo", select_sections(text, "demo", sections), residual_prompt(missing), check=_demo_check
+        )
+        result = json_clean(ai_response)
+        if not isinstance(result, dict):
+            logger.warning(f"[PII-DEMO-FALLBACK-PARSE-ERROR] patient={patient_id} fields={missing}")
+            result = {}
+
+    # Regex values win; the LLM only fills what the extractor could not
+    final_result = dict(extracted)
+    for field in missing:
+        final_result[field] = str(result.get(field, "") or "")
+    for field in ("dateOfService", "dateOfBirth"):
+        final_result[field] = normalize_date(final_result[field])
+    final_result["patientType"] = final_result["patientType"].upper()
+
+    log_field_sources(patient_id, regex_fields, missing, final_result)
+    logger.info("[PII-DEMO-END] patient=%s final_result=%s", patient_id, Payload(final_result))
     return final_result
@@ -8,13 +8,15 @@ import os
 import logging
 from dotenv import load_dotenv
 from utils.azureblob import generate_sas_from_connection_string
+from utils.pipeline_metrics import stamp_enqueue, observe_dequeue, stage_timer, register_worker
+from utils.structured_logging import configure_logging, Payload
 
 load_dotenv()
 
 # ---------------------------
 # Logging
 # ---------------------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+configure_logging()
 logger = logging.getLogger("miner-ocr-worker")
 
 # ---------------------------
@@ -83,14 +85,15 @@ def send_status_to_ocr_url(patient_id: str, status: dict, return_headers: dict =
 
         
         logger.info(f"[MINER-STATUS-START] patient={patient_id} Sending status to OCR URL")
-        response = post_request(
-            OCR_STATUS_URL,
-            status_payload,
-            headers=return_headers or {},
-            timeout=30,
-            retries=3,
-            patient_id=patient_id
-        )
+        with stage_timer("callback_miner_status", patient_id):
+            response = post_request(
+                OCR_STATUS_URL,
+                status_payload,
+                headers=return_headers or {},
+                timeout=30,
+                retries=3,
+                patient_id=patient_id
+            )
         
         if response:
             logger.info(f"[MINER-STATUS-SUCCESS] patient={patient_id} Status sent successfully")
@@ -105,16 +108,24 @@ def send_status_to_ocr_url(patient_id: str, status: dict, return_headers: dict =
 # ---------------------------
 from api.em import enqueue_em_task
 #from api.gliner_pii import pii_detection_demo
+from utils.sections import PAGE_BREAK
+from utils.normalize import normalize_for_enqueue
 from pypdf import PdfReader
 import io
+def extract_pdf_text(content: bytes) -> str:
+    """Page texts joined with PAGE_BREAK so page numbers survive into the EM task"""
+    reader = PdfReader(io.BytesIO(content))
+    return PAGE_BREAK.join(page.extract_text() or "" for page in reader.pages)
+
 def _download_blob_text(url: str, patient_id: str = None) -> str:
     pid_log = f"patient={patient_id} " if patient_id else ""
     logger.info(f"[MINER-DOWNLOAD-START] {pid_log}url={url}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        reader = PdfReader(io.BytesIO(resp.content))
-        text = "".join(page.extract_text() or "" for page in reader.pages)
+        with stage_timer("pdf_download", patient_id):
+            resp = requests.get(url, timeout=10)
+            resp.raise_for_status()
+        with stage_timer("pdf_extract", patient_id):
+            text = extract_pdf_text(resp.content)
         logger.info(f"[MINER-DOWNLOAD-SUCCESS] {pid_log}url={url} text_length={len(text)}")
         return text
     except Exception as e:
@@ -128,7 +139,7 @@ def process_request(task: dict):
         return
 
     logger.info(f"[MINER-PROCESS-START] patient={patient_id}")
-    logger.info(f"[MINER-TASK-PAYLOAD] patient={patient_id} payload={json.dumps(task, indent=2)}")
+    logger.info("[MINER-TASK-PAYLOAD] patient=%s payload=%s", patient_id, Payload(task))
     logger.info(f"[MINER-OCR-REQUEST] patient={patient_id} url={OCR_ENGINE_URL}")
 
     ocr_rust_payload = {
@@ -142,13 +153,14 @@ def process_request(task: dict):
         "traceDto": task.get("traceDto", {}),
     }
 
-    ocr_response = post_request(OCR_ENGINE_URL, ocr_rust_payload, patient_id=patient_id)
+    with stage_timer("ocr_engine", patient_id):
+        ocr_response = post_request(OCR_ENGINE_URL, ocr_rust_payload, patient_id=patient_id)
     if not ocr_response:
         logger.error(f"[MINER-OCR-ERROR] patient={patient_id} OCR request failed")
         return
 
     logger.info(f"[MINER-OCR-SUCCESS] patient={patient_id} OCR completed")
-    logger.info(f"[MINER-OCR-RESPONSE] patient={patient_id} response={json.dumps(ocr_response, indent=2)}")
+    logger.info("[MINER-OCR-RESPONSE] patient=%s response=%s", patient_id, Payload(ocr_response))
     ocr_response= {
         "demoFile": ocr_response.get("demoFile", False),
         "isAFile": ocr_response.get("isAFile", False),
@@ -176,7 +188,7 @@ def process_request(task: dict):
             "traceDto": ocr_response.get("traceDto", {}),
             "returnHeaders": ocr_response.get("returnHeaders", {}),
         }
-        logger.info(f"[MINER-DEMO-PAYLOAD] patient={patient_id} payload={json.dumps(backend_payload, indent=2)}")
+        logger.info("[MINER-DEMO-PAYLOAD] patient=%s payload=%s", patient_id, Payload(backend_payload))
         
         #result = pii_detection_demo(
         #    backend_payload.get("blobUlr", ""), 
@@ -195,14 +207,15 @@ def process_request(task: dict):
             "traceDto": ocr_response.get("traceDto", {}),
             "insurance": ocr_response.get("insurance")
         }
-        logger.info(f"[MINER-EM-PAYLOAD] patient={patient_id} payload={json.dumps(backend_payload, indent=2)}")
+        logger.info("[MINER-EM-PAYLOAD] patient=%s payload=%s", patient_id, Payload(backend_payload))
         
         #blob_path = backend_payload.get("afterOcrBlobPath", "")
         blob_path = ocr_response.get("afterOcrSasUrl", "")
         logger.info(f"[MINER-EM-BLOB-PATH] patient={patient_id} blobPath={blob_path}")
         
         text_content = _download_blob_text(blob_path, patient_id)
-        logger.info(f"[MINER-EM-TEXT] patient={patient_id} text_length={len(text_content)} text_preview={text_content[:100]}")
+        text_content = normalize_for_enqueue(text_content, patient_id)
+        logger.info(f"[MINER-EM-TEXT] patient={patient_id} text_length={len(text_content)}")
         
         insurance = backend_payload.get("insurance", "")
         enqueue_input = {
@@ -255,6 +268,7 @@ def processing_worker_loop():
                 continue
             _, raw_task = item
             task = json.loads(raw_task)
+            observe_dequeue(TASK_QUEUE, task)
             patient_id = task.get("patientId", "UNKNOWN")
             logger.info(f"[MINER-WORKER-TASK] patient={patient_id} Task received from queue")
             logger.debug(f"[MINER-WORKER-TASK-DEBUG] patient={patient_id} raw_task={raw_task}")
@@ -278,7 +292,7 @@ def processing_worker_loop():
 def enqueue_task_miner(task: dict):
     patient_id = task.get('patientId', 'UNKNOWN')
     logger.info(f"[MINER-ENQUEUE] patient={patient_id} Task enqueued to miner queue")
-    redis_client.rpush(TASK_QUEUE, json.dumps(task))
+    redis_client.rpush(TASK_QUEUE, stamp_enqueue(TASK_QUEUE, task))
     logger.info(f"[MINER-ENQUEUE-SUCCESS] patient={patient_id} Task added to queue")
 
 def get_result_miner(patient_id: str):
@@ -412,5 +426,7 @@ def flush_miner_redis():
 # ---------------------------
 # Auto-start worker thread
 # ---------------------------
-threading.Thread(target=processing_worker_loop, daemon=True).start()
+miner_worker_thread = threading.Thread(target=processing_worker_loop, daemon=True)
+miner_worker_thread.start()
+register_worker("miner", miner_worker_thread)
 logger.info("[MINER-WORKER-THREAD] MINER Worker Thread Started")
@@ -6,10 +6,12 @@ import time
 import json
 import os
 from dotenv import load_dotenv
+from utils.pipeline_metrics import stamp_enqueue, observe_dequeue, stage_timer, register_worker
+from utils.structured_logging import configure_logging, Payload
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+configure_logging()
 logger = logging.getLogger("ocr-worker")
 
 # Redis settings
@@ -52,7 +54,7 @@ def post_with_retry(url, payload, headers=None, retries=3, timeout=120, patient_
 
 def enqueue_task(task: dict):
     patient_id = task.get('patientId', 'UNKNOWN')
-    redis_client.rpush(QUEUE_NAME, json.dumps(task))
+    redis_client.rpush(QUEUE_NAME, stamp_enqueue(QUEUE_NAME, task))
     logger.info(f"[OCR-ENQUEUE] patient={patient_id} Task enqueued to OCR queue")
 
 def get_result(pid: str):
@@ -199,9 +201,10 @@ def process_one_task(task: dict):
         "traceDto": task.get("traceDto", {}),
     }
 
-    logger.info(f"[OCR-ENGINE-REQUEST] patient={pid} url={OCR_URL} Sending to OCR engine payload={json.dumps(ocr_payload)}")
+    logger.info("[OCR-ENGINE-REQUEST] patient=%s url=%s Sending to OCR engine payload=%s", pid, OCR_URL, Payload(ocr_payload))
     # OCR call
-    ocr_resp = post_with_retry(OCR_URL, ocr_payload, patient_id=pid)
+    with stage_timer("ocr_engine", pid):
+        ocr_resp = post_with_retry(OCR_URL, ocr_payload, patient_id=pid)
     ocr_data = ocr_resp.json()
     logger.info(f"[OCR-ENGINE-SUCCESS] patient={pid} OCR engine completed")
 
@@ -214,12 +217,13 @@ def process_one_task(task: dict):
     }
 
     logger.info(f"[OCR-BACKEND-REQUEST] patient={pid} url={BACKEND_URL} Sending to backend")
-    backend_resp = post_with_retry(
-        BACKEND_URL,
-        backend_payload,
-        headers=ocr_data.get("returnHeaders", {}),
-        patient_id=pid
-    )
+    with stage_timer("callback_ocr_backend", pid):
+        backend_resp = post_with_retry(
+            BACKEND_URL,
+            backend_payload,
+            headers=ocr_data.get("returnHeaders", {}),
+            patient_id=pid
+        )
     backend_resp.raise_for_status()
     logger.info(f"[OCR-BACKEND-SUCCESS] patient={pid} Backend processing completed")
 
@@ -246,6 +250,7 @@ def worker_loop():
 
             _, raw = task_entry
             task = json.loads(raw)
+            observe_dequeue(QUEUE_NAME, task)
             patient_id = task.get("patientId", "UNKNOWN")
             
             logger.info(f"[OCR-WORKER-TASK] patient={patient_id} Task received from queue")
@@ -255,7 +260,7 @@ def worker_loop():
                 logger.info(f"[OCR-WORKER-TASK-DONE] patient={patient_id} Task processing completed")
             except Exception as e:
                 logger.error(f"[OCR-WORKER-FAIL] patient={patient_id} Task processing failed: {e}")
-                redis_client.rpush(QUEUE_NAME, json.dumps(task))  # fallback
+                redis_client.rpush(QUEUE_NAME, stamp_enqueue(QUEUE_NAME, task, "requeue"))  # fallback
                 logger.warning(f"[OCR-WORKER-RETRY] patient={patient_id} Task re-queued for retry")
                 time.sleep(3)
         except Exception as exc:
@@ -266,5 +271,7 @@ def worker_loop():
 if os.getenv("FLUSH_OCR_ON_STARTUP", "false").lower() == "true":
     flush_ocr_redis()
 
-threading.Thread(target=worker_loop, daemon=True).start()
+ocr_worker_thread = threading.Thread(target=worker_loop, daemon=True)
+ocr_worker_thread.start()
+register_worker("ocr", ocr_worker_thread)
 logger.info("[OCR-WORKER-THREAD] OCR Worker thread started")
@@ -0,0 +1,220 @@
+import os
+import re
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services.mdm.visit_classifier import preclassify_patient_type
+from utils.metrics import pii_fields_total
+
+logger = logging.getLogger("pii")
+
+PII_LLM_FALLBACK = os.getenv("PII_LLM_FALLBACK", "true").lower() == "true"
+
+DEMO_FIELDS = [
+    "name", "dateOfService", "dateOfBirth", "email", "accountNumber", "mrn",
+    "insuranceName", "ssn", "age", "financialClass", "gender", "patientType",
+]
+
+# Fields with a rigid format: if the pattern does not match, the chart does not contain them
+PATTERN_ONLY_FIELDS = {"email", "ssn"}
+
+
+def _labeled(labels: str, strict: bool = True) -> "re.Pattern[str]":
+    # free-text fields need an explicit "Label:" at line start; dates and ids are validated
+    # by their cleaners, so they may also sit mid-line ("Name: DOE, JOHN  DOB: 03/22/1985")
+    if strict:
+        return re.compile(rf"(?im)^[ \t]*(?:{labels})\b[ \t]*[:#][ \t]*([^\n]+)")
+    return re.compile(rf"(?i)\b(?:{labels})(?![A-Za-z])[ \t]*[:#\-]?[ \t]*([^\n]+)")
+
+
+_LABELED_RE = {
+    "name": _labeled(r"patient[ \t]+name|patient|name"),
+    "dateOfService": _labeled(r"date[ \t]+of[ \t]+service|service[ \t]+date|dos|visit[ \t]+date|encounter[ \t]+date|date[ \t]+of[ \t]+visit", strict=False),
+    "dateOfBirth": _labeled(r"date[ \t]+of[ \t]+birth|birth[ \t]*date|d\.?o\.?b\.?", strict=False),
+    "accountNumber": _labeled(r"account[ \t]*(?:number|no\.?|num|#)?|acct\.?[ \t]*(?:number|no\.?|#)?"),
+    # "MRN:" / "Medical Record #:" as a form field (line start or after a column gap), never narrative
+    # like "per medical record 2019"
+    "mrn": re.compile(
+        r"(?im)(?:^|[ \t]{2,}|\t)[ \t]*(?:mrn|medical[ \t]+record[ \t]*(?:number|no\.?|#)?)[ \t]*[:#][ \t]*([^\n]+)"
+    ),
+    "insuranceName": _labeled(r"primary[ \t]+insurance(?:[ \t]+name)?|insurance[ \t]+name|insurance|payer"),
+    "financialClass": _labeled(r"financial[ \t]+class|fin[ \t]+class"),
+    "gender": _labeled(r"gender|sex"),
+    "age": _labeled(r"age"),
+}
+
+_SSN_RE = re.compile(r"(?i)(?:ssn|social[ \t]+security(?:[ \t]+(?:number|no\.?|#))?)[ \t]*[:#]?[ \t]*(\d{3}-?\d{2}-?\d{4})\b|\b(\d{3}-\d{2}-\d{4})\b")
+_EMAIL_RE = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
+_AGE_INLINE_RE = re.compile(r"(?i)\b(\d{1,3})[ \t]*(?:y/?o\b|y\.o\.|-?years?[ \t-]+old\b|-?year-old\b)")
+_PRIMARY_INSURANCE_RE = re.compile(r"(?i)\*+[ \t]*primary[ \t]+insurance[ \t]*\*+[ \t]*([A-Za-z][A-Za-z &]*?)(?=p\.?[ \t]*o\.?[ \t]*box|\d|insurance|relationship|insured[ \t]+party|\*|\n|$)")
+_ID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-]*\d[A-Za-z0-9\-]*")
+_MMDDYYYY_RE = re.compile(r"\d{2}/\d{2}/\d{4}")
+_YEAR_RE = re.compile(r"(?:19|20)\d{2}")
+_GENDER = {"m": "Male", "male": "Male", "f": "Female", "female": "Female"}
+
+_DATE_RE = re.compile(
+    r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4}|\d{2})\b"
+    r"|\b(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})\b"
+    r"|\b([A-Za-z]{3,9})\.?[ \t]+(\d{1,2})(?:st|nd|rd|th)?,?[ \t]+(\d{4})\b"
+    r"|\b(\d{1,2})[ \t]+([A-Za-z]{3,9})\.?,?[ \t]+(\d{4})\b"
+)
+
+
+def _month(name: str) -> Optional[int]:
+    for fmt in ("%B", "%b"):
+        try:
+            return datetime.strptime(name[:3] if fmt == "%b" else name, fmt).month
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_date(value: str) -> str:
+    """First date in `value` as MM/DD/YYYY; the input is returned unchanged when no date parses"""
+    if not value:
+        return ""
+    for m in _DATE_RE.finditer(value):
+        g = m.groups()
+        try:
+            if g[0]:
+                month, day, year = int(g[0]), int(g[1]), g[2]
+                if month > 12 >= day:
+                    # DD/MM/YYYY
+                    month, day = day, month
+                year = int(year) if len(year) == 4 else int(datetime.strptime(year, "%y").year)
+            elif g[3]:
+                year, month, day = int(g[3]), int(g[4]), int(g[5])
+            elif g[6]:
+                month, day, year = _month(g[6]), int(g[7]), int(g[8])
+            else:
+                day, month, year = int(g[9]), _month(g[10]), int(g[11])
+            if month is None:
+                continue
+            return datetime(year, month, day).strftime("%m/%d/%Y")
+        except ValueError:
+            continue
+    return value
+
+
+def _first_label(field: str, text: str) -> str:
+    m = _LABELED_RE[field].search(text)
+    return m.group(1).strip() if m else ""
+
+
+def _clean_name(value: str) -> str:
+    # labeled lines often carry the next field on the same line ("Name: DOE, JOHN  DOB: ...")
+    value = re.split(r"[ \t]{2,}|\t|\b(?:dob|mrn|age|sex|gender|acct|account|date)\b", value, flags=re.IGNORECASE)[0]
+    value = value.strip(" ,;:")
+    return value if re.fullmatch(r"[A-Za-z][A-Za-z ,.'\-]*", value) else ""
+
+
+def _clean_id(value: str) -> str:
+    m = _ID_RE.search(value)
+    return m.group(0) if m else ""
+
+
+def _clean_mrn(value: str) -> str:
+    # at least 5 characters with 4+ digits; years and dates are not record numbers
+    token = _clean_id(value)
+    if len(token) < 5 or len(re.sub(r"\D", "", token)) < 4:
+        return ""
+    if _YEAR_RE.fullmatch(token) or _DATE_RE.fullmatch(token):
+        return ""
+    return token
+
+
+def _clean_text(value: str) -> str:
+    return re.split(r"[ \t]{2,}|\t", value)[0].strip(" ,;:")
+
+
+def extract_demographics(text: str) -> Dict[str, str]:
+    """Fill the demo fields that have labels or rigid formats; missing fields are returned as ''"""
+    result = {field: "" for field in DEMO_FIELDS}
+
+    result["name"] = _clean_name(_first_label("name", text))
+    for field in ("dateOfService", "dateOfBirth"):
+        date = normalize_date(_first_label(field, text))
+        # only keep dates that actually parsed
+        result[field] = date if _MMDDYYYY_RE.fullmatch(date) else ""
+
+    result["accountNumber"] = _clean_id(_first_label("accountNumber", text))
+    result["mrn"] = _clean_mrn(_first_label("mrn", text))
+    result["financialClass"] = _clean_text(_first_label("financialClass", text))
+
+    m = _PRIMARY_INSURANCE_RE.search(text)
+    insurance = m.group(1) if m else _first_label("insuranceName", text)
+    result["insuranceName"] = _clean_text(insurance)
+
+    m = _SSN_RE.search(text)
+    if m:
+        digits = re.sub(r"\D", "", m.group(1) or m.group(2))
+        result["ssn"] = f"{digits[:3]}-{digits[3:5]}-{digits[5:]}"
+
+    m = _EMAIL_RE.search(text)
+    result["email"] = m.group(0) if m else ""
+
+    age = re.match(r"\d{1,3}\b", _first_label("age", text))
+    if not age:
+        age = _AGE_INLINE_RE.search(text)
+        result["age"] = age.group(1) if age else ""
+    else:
+        result["age"] = age.group(0)
+
+    gender = re.match(r"[A-Za-z]+", _first_label("gender", text))
+    result["gender"] = _GENDER.get(gender.group(0).lower(), "") if gender else ""
+
+    patient_type = preclassify_patient_type(text)
+    result["patientType"] = patient_type.upper() if patient_type else ""
+
+    return result
+
+
+_FIELD_RULES = {
+    "name": "name: the patient's full name",
+    "dateOfService": "dateOfService: the date of service / visit, formatted MM/DD/YYYY",
+    "dateOfBirth": "dateOfBirth: the patient's date of birth, formatted MM/DD/YYYY",
+    "email": "email: the patient's email address",
+    "accountNumber": "accountNumber: the patient account number",
+    "mrn": "mrn: the medical record number",
+    "insuranceName": "insuranceName: the primary insurance company name only",
+    "ssn": "ssn: the social security number",
+    "age": "age: the age exactly as stated (do not calculate from DOB)",
+    "financialClass": "financialClass: the financial class",
+    "gender": "gender: Male or Female",
+    "patientType": (
+        "patientType: ESTABLISHED if the CPT/procedure section has an EST PAT code (e.g. 99213, OFFICE VISIT EST PAT) "
+        "or an outpatient synonym, NEW if it has a NEW PAT code (e.g. 99202, OFFICE VISIT NEW PAT), else \"\""
+    ),
+}
+
+
+def residual_fields(result: Dict[str, str]) -> List[str]:
+    return [f for f in DEMO_FIELDS if not result.get(f) and f not in PATTERN_ONLY_FIELDS]
+
+
+def residual_prompt(fields: List[str]) -> str:
+    """Extraction prompt restricted to `fields`"""
+    rules = "\n".join(f"- {_FIELD_RULES[f]}" for f in fields)
+    keys = ", ".join(f'"{f}": ""' for f in fields)
+    return (
+        "Extract the following patient details from the clinical text.\n"
+        f"{rules}\n"
+        "Copy values exactly as they appear unless a format is given. Use \"\" for anything not present.\n"
+        f"Return ONLY a JSON object with these keys: {{{keys}}}"
+    )
+
+
+def log_field_sources(patient_id: str, regex_fields: List[str], llm_fields: List[str], result: Dict[str, str]) -> None:
+    for field in DEMO_FIELDS:
+        if field in regex_fields:
+            source = "regex"
+        elif field in llm_fields and result.get(field):
+            source = "llm"
+        else:
+            source = "missing"
+        pii_fields_total.labels(field=field, source=source).inc()
+    logger.info(
+        f"[PII-DEMO-SOURCES] patient={patient_id} regex={len(regex_fields)} "
+        f"llm_requested={len(llm_fields)} llm_fields={llm_fields}"
+    )
@@ -0,0 +1,289 @@
+"""
+Micro-benchmarks for CPU paths that run per chart or per status poll.
+
+    python -m benchmarks.micro_benchmarks                 # run, check thresholds, append to history
+    python -m benchmarks.micro_benchmarks -k json --no-record
+
+Each case is timed with timeit (auto-ranged iterations, --rounds repeats; the median round is reported).
+A case regresses when its median exceeds the baseline (median of the last `history_window` runs on the same
+machine) x its tolerance, or its absolute `max_us` ceiling, both from micro_thresholds.json.
+The process exits 1 on any regression so it can gate CI.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import timeit
+import tempfile
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+THRESHOLDS_PATH = os.path.join(HERE, "micro_thresholds.json")
+HISTORY_PATH = os.path.join(HERE, "results", "micro_history.jsonl")
+
+QUEUE_ITEMS = 200
+CHART_PAGES = 20
+ICD_FIXTURE_ROWS = 2000
+
+
+def _icd_fixture(directory: str) -> Dict[str, str]:
+    """
+    Small synonym and main ICD tables, used when the licensed databases are not checked out, so the lookups
+    time real queries instead of duckdb's missing-table error path.
+    """
+    import duckdb
+
+    rows = [(f"Z{i // 100:02d}.{i % 100:02d}", f"Fixture condition {i}") for i in range(ICD_FIXTURE_ROWS)]
+    paths = {"SYNONYM_DB": os.path.join(directory, "icd_synonym2026_1.duckdb"), "MAIN_DB": os.path.join(directory, "icd_2026.duckdb")}
+    for name, table, extra in (
+        ("SYNONYM_DB", "icd_synonym2026_1", ("I10", "Essential hypertension")),
+        ("MAIN_DB", "icd_2026", ("I10", "Essential (primary) hypertension")),
+    ):
+        with duckdb.connect(paths[name]) as conn:
+            conn.execute(f"CREATE TABLE {table} (ICD VARCHAR, DESCRIPTION VARCHAR)")
+            conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", rows + [extra])
+    return paths
+
+
+def _configure_environment(redis_spec: str) -> None:
+    """Point the repo modules at local stand-ins before they are imported (clients are created at import time)"""
+    if redis_spec == "memory":
+        import socket
+        from fakeredis import TcpFakeServer
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+        # handler threads must not keep the process alive on exit
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host = "127.0.0.1"
+    else:
+        host, _, port = redis_spec.partition(":")
+    os.environ.update({"REDIS_HOST": host, "REDIS_PORT": str(port or 6379), "REDIS_SSL": "false"})
+    os.environ["EM_WORKER_ENABLED"] = "false"
+    os.environ.setdefault("azure_endpoint", "http://127.0.0.1:9")
+    os.environ.setdefault("uuid", "benchmark")
+    os.environ.setdefault("OTEL_TRACES_EXPORTER", "none")
+    os.environ.setdefault("LLM_USAGE_LEDGER", "false")
+    icd_dir = os.path.join(ROOT, "services", "icd")
+    if not all(
+        os.getenv(name) or os.path.exists(os.path.join(icd_dir, filename))
+        for name, filename in (("SYNONYM_DB", "icd_synonym2026_1.duckdb"), ("MAIN_DB", "icd_2026.duckdb"))
+    ):
+        fixture_dir = tempfile.mkdtemp(prefix="em-micro-icd-")
+        atexit.register(shutil.rmtree, fixture_dir, ignore_errors=True)
+        os.environ.update(_icd_fixture(fixture_dir))
+
+
+def _drive(coro) -> Any:
+    """Run a coroutine that never awaits I/O to completion without an event loop"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("coroutine suspended; it is not CPU-only")
+
+
+def _llm_outputs() -> Dict[str, str]:
+    """Raw completions as the models return them: prose + fenced JSON, // comments, trailing commas, <think>"""
+    from benchmarks.mock_azure_openai import CANNED
+
+    tab_1 = json.loads(json.dumps(CANNED["tab_1"]))
+    tab_1["chronic"] = [dict(tab_1["chronic"][0], condition=f"Chronic condition {i}", PageNo=i % 5 + 1) for i in range(8)]
+    tab_1["acute"] = [dict(tab_1["chronic"][0], condition=f"Acute condition {i}") for i in range(3)]
+    tab_2 = json.loads(json.dumps(CANNED["tab_2"]))
+    tab_2["order_analysis"] = [dict(tab_2["order_analysis"][0], item=f"Lab {i}") for i in range(10)]
+    tab_3 = json.loads(json.dumps(CANNED["tab_3"]))
+    tab_3["risk_analysis"] = [dict(tab_3["risk_analysis"][0], drug=f"drug {i}") for i in range(6)]
+
+    def fenced(obj: dict) -> str:
+        body = json.dumps(obj, indent=2)
+        body = body.replace('"PageNo": 1\n', '"PageNo": 1, // first page\n').replace("\n  ]", ",\n  ]")
+        return "Reviewed the assessment and plan sections.\n```json\n" + body + "\n```"
+
+    return {
+        "tab_1": fenced(tab_1),
+        "tab_2": fenced(tab_2),
+        "tab_3": fenced(tab_3),
+        "visit": "```json\n" + json.dumps(CANNED["visit"]) + "\n```",
+        "icd": "<think>primary is hypertension</think>\n```json\n" + json.dumps(CANNED["icd"]) + "\n```",
+        "plain": json.dumps(tab_1),
+    }
+
+
+def build_cases() -> Dict[str, Callable[[], Any]]:
+    from benchmarks.pipeline_benchmark import synthetic_chart, synthetic_pdf
+    from utils.sections import PAGE_BREAK
+    from utils.metrics import normalize_path
+    from services.mdm.mdm import json_clean as mdm_json_clean, parse_json_block, answeroutput, final_return
+    from services.hcpcs.hcpcs import json_clean as hcpcs_json_clean
+    from services.cpt.cpt import json_clean as cpt_json_clean
+    from api.gliner_pii import json_clean as pii_json_clean
+    from services.icd.icd import parse_json_strict, find_icd_in_main_table, find_condition_in_synonym_table, map_condition_to_icd
+    from api.miner_viewer import extract_pdf_text
+    from api.em import EM_QUEUE, redis_client, get_em_queue_items
+
+    rng = random.Random(7)
+    outputs = _llm_outputs()
+    plain = outputs["plain"]
+    fenced_plain = "```json\n" + plain + "\n```"
+
+    tables = [parse_json_block(outputs[t])[0] for t in ("tab_1", "tab_2", "tab_3")]
+    visit = parse_json_block(outputs["visit"])[0]
+
+    def final_output():
+        answer = answeroutput(*tables)
+        return final_return(
+            answer["A"], answer["B"], answer["C"], answer["finallevel"],
+            answer["A_level"], answer["B_level"], answer["C_level"],
+            answer["table1_explain"], answer["table2_explain"], answer["table3_explain"],
+            tables[0], tables[1], tables[2], visit,
+        )
+
+    pdf = synthetic_pdf(synthetic_chart(0, 10, rng))
+    chart = "insurance: Medicare\n" + PAGE_BREAK.join(synthetic_chart(1, CHART_PAGES, rng))
+    redis_client.delete(EM_QUEUE)
+    redis_client.rpush(EM_QUEUE, *[
+        json.dumps({
+            "text": chart, "patientId": f"bench-{i:05d}", "afterOcrBlobPath": "https://blob/bench.pdf",
+            "traceDto": {"traceId": f"trace-{i}"}, "returnHeaders": {"Authorization": "Bearer x"}, "insurance": "Medicare",
+        })
+        for i in range(QUEUE_ITEMS)
+    ])
+
+    paths = [
+        "/health", "/metrics", "/miner_process_task", "/emStatus/3f2a9c1e-8b7d-4e6f-a1b2-c3d4e5f60718",
+        "/miner_task_result/1234567", "/emStatus/PAT-00042", "/usage/summary", "/allQueuesStatus",
+    ]
+
+    return {
+        "json_clean_mdm": lambda: _drive(mdm_json_clean(outputs["tab_1"])),
+        "json_clean_hcpcs": lambda: _drive(hcpcs_json_clean(fenced_plain)),
+        "json_clean_cpt": lambda: cpt_json_clean(fenced_plain),
+        "json_clean_pii": lambda: pii_json_clean(fenced_plain),
+        "parse_json_strict_icd": lambda: parse_json_strict(outputs["icd"]),
+        "answeroutput": lambda: answeroutput(*tables),
+        "final_return": final_output,
+        "get_em_queue_items": lambda: get_em_queue_items(limit=1000),
+        "normalize_path": lambda: [normalize_path(p) for p in paths],
+        "pdf_extract": lambda: extract_pdf_text(pdf),
+        "icd_main_lookup": lambda: _drive(find_icd_in_main_table("I10")),
+        "icd_synonym_lookup": lambda: _drive(find_condition_in_synonym_table("Essential hypertension")),
+        "icd_map_condition": lambda: _drive(map_condition_to_icd("Essential hypertension", "I10", "Essential (primary) hypertension")),
+    }
+
+
+def measure(fn: Callable[[], Any], rounds: int) -> Dict[str, float]:
+    fn()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    per_call = [t / number * 1e6 for t in timer.repeat(repeat=rounds, number=number)]
+    return {
+        "median_us": round(statistics.median(per_call), 3),
+        "min_us": round(min(per_call), 3),
+        "iterations": number * rounds,
+    }
+
+
+def machine_id() -> str:
+    return f"{platform.node()}|{platform.machine()}|py{platform.python_version()}"
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check(results: Dict[str, Dict[str, float]], history: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    window = int(thresholds.get("history_window", 5))
+    same_machine = [h for h in history if h.get("machine") == machine_id()][-window:]
+    verdicts = {}
+    for name, result in results.items():
+        limits = thresholds.get("cases", {}).get(name, {})
+        tolerance = float(limits.get("tolerance", thresholds.get("tolerance", 1.25)))
+        past = [h["results"][name]["median_us"] for h in same_machine if name in h.get("results", {})]
+        baseline = statistics.median(past) if past else None
+        reasons = []
+        if baseline is not None and result["median_us"] > baseline * tolerance:
+            reasons.append(f"{result['median_us'] / baseline:.2f}x baseline {baseline:.1f}us (tolerance {tolerance}x)")
+        if "max_us" in limits and result["median_us"] > limits["max_us"]:
+            reasons.append(f"above ceiling {limits['max_us']}us")
+        verdicts[name] = {"baseline_us": baseline, "ratio": round(result["median_us"] / baseline, 3) if baseline else None, "regressions": reasons}
+    return verdicts
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot CPU paths")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--redis", default="memory", help="'memory' (in-process fakeredis server) or host:port")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--no-record", action="store_true", help="do not append this run to the history file")
+    parser.add_argument("--no-check", action="store_true", help="report only; never exit non-zero")
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    _configure_environment(args.redis)
+    sys.path.insert(0, ROOT)
+    # the measured functions log at INFO; keep the formatting cost but not the output
+    logging.disable(logging.INFO)
+
+    cases = {name: fn for name, fn in build_cases().items() if args.filter in name}
+    results = {}
+    for name, fn in cases.items():
+        results[name] = measure(fn, args.rounds)
+        print(f"{name:<24} {results[name]['median_us']:>12.1f} us  (min {results[name]['min_us']:.1f}, n={results[name]['iterations']})", file=sys.stderr)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    verdicts = check(results, load_history(args.history), thresholds)
+    regressed = {name: v["regressions"] for name, v in verdicts.items() if v["regressions"]}
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "machine": machine_id(),
+        "results": results,
+        "checks": verdicts,
+        "regressions": regressed,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "a") as f:
+            f.write(json.dumps({k: report[k] for k in ("commit", "timestamp", "machine", "results")}) + "\n")
+
+    for name, reasons in regressed.items():
+        print(f"REGRESSION {name}: {'; '.join(reasons)}", file=sys.stderr)
+    return 1 if regressed and not args.no_check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
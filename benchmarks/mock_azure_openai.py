@@ -0,0 +1,295 @@
+"""
+Local Azure-OpenAI-compatible chat-completions mock for load and resilience testing.
+
+    python -m benchmarks.mock_azure_openai --port 8900
+    azure_endpoint=http://localhost:8900 uuid=mock  (or an LLM_DEPLOYMENTS entry pointing here)
+
+Responses are canned per prompt type (visit, tab_1/2/3, icd, demo, explain), latency is drawn from a
+configurable distribution, streaming is paced at a token rate, and 429/500/timeouts are injected at
+configurable rates. Every random draw is seeded from the request body, so a replayed load is identical.
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+import threading
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services.mdm.full_output_validater import Tab_1, Tab_2, Tab_3
+from services.mdm.visitprompt import prompt as visit_prompt
+from services.mdm.output_profile import EXPLAIN_PROMPT
+from services.icd.icd_prompt import prompt as icd_prompt
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+logger = logging.getLogger("mock-azure-openai")
+
+MOCK_SEED = int(os.getenv("MOCK_LLM_SEED", "7"))
+# Per prompt type (or "default"): "fixed:S", "uniform:A,B", "lognormal:MEDIAN,SIGMA" (seconds)
+MOCK_LATENCY = json.loads(os.getenv("MOCK_LLM_LATENCY", '{"default": "lognormal:1.5,0.4", "tab_1": "lognormal:6,0.5", "tab_2": "lognormal:5,0.5", "tab_3": "lognormal:5,0.5"}'))
+# Completion tokens per second, for streaming and for the generation part of non-streamed latency
+MOCK_TOKENS_PER_SECOND = float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "80"))
+# Fault probabilities: {"429": p, "500": p, "timeout": p}
+MOCK_FAULTS = json.loads(os.getenv("MOCK_LLM_FAULTS", "{}"))
+# Quota reported in x-ratelimit-* headers; exceeding it returns 429 (0 = unlimited)
+MOCK_RPM = int(os.getenv("MOCK_LLM_RPM", "0"))
+MOCK_TPM = int(os.getenv("MOCK_LLM_TPM", "0"))
+MOCK_HANG_SECONDS = float(os.getenv("MOCK_LLM_HANG_SECONDS", "900"))
+# Directory of <prompt_type>.json files overriding the built-in canned responses
+MOCK_FIXTURES = os.getenv("MOCK_LLM_FIXTURES", "")
+CHARS_PER_TOKEN = 4
+
+CANNED: Dict[str, Any] = {
+    "visit": {"visit_type": "Office", "age": "54", "cpt_code": ""},
+    "tab_1": {
+        "patientType": "Established",
+        "chronic": [{
+            "condition": "Essential hypertension",
+            "explain": "Listed under ASSESSMENT, chronic and actively managed.",
+            "exactSentence": "Hypertension",
+            "Worsening_condition": "No",
+            "Worsening_condition_explain": "",
+            "PageNo": 1,
+        }],
+        "acute": [],
+        "MDM_Complexity_Level": {"Level": "Low", "Explain": "One stable chronic illness."},
+    },
+    "tab_2": {
+        "order_analysis": [{
+            "item": "CBC", "type": "lab", "qualifies_for_mdm": "Yes",
+            "explain": "Ordered today.", "evidence_sentence": "CBC", "PageNo": 1,
+        }],
+        "qualifying_data_points": [{"item": "CBC", "fulfills_criterion": "Category 1"}],
+        "explain": "One unique test ordered.",
+        "explain_data_level": "Category 1 with one element.",
+        "data_level": "Low",
+        "exactSentence": "CBC",
+        "unique_laboratory_tests_count": 1,
+        "PageNo": 1,
+    },
+    "tab_3": {
+        "risk_analysis": [{
+            "drug": "lisinopril", "action": "continued", "explain": "Prescription drug management.",
+            "evidence_sentence": "lisinopril", "PageNo": 1,
+        }],
+        "explain": "Prescription drug management is moderate risk.",
+        "count": 1,
+        "risk_level": "Moderate",
+        "exactSentence": "lisinopril",
+        "PageNo": 1,
+    },
+    "icd": {
+        "primary_condition": {
+            "condition": "Essential hypertension",
+            "icd_code": "I10",
+            "icd_description": "Essential (primary) hypertension",
+            "hyperLink": {"pageNumber": 1, "supportingString": "Hypertension"},
+        },
+        "secondary_condition": [],
+    },
+    "explain": {
+        "Tab_1": "One stable chronic illness (hypertension, page 1): Low.",
+        "Tab_2": "One unique lab test ordered (CBC, page 1): Low.",
+        "Tab_3": "Prescription drug management (lisinopril, page 1): Moderate.",
+    },
+    "default": {},
+}
+
+# System prompt prefixes identifying each prompt type (compact mode appends to the table prompts)
+_PROMPT_PREFIXES = [
+    ("tab_1", Tab_1.strip()[:400]),
+    ("tab_2", Tab_2.strip()[:400]),
+    ("tab_3", Tab_3.strip()[:400]),
+    ("visit", visit_prompt.strip()[:400]),
+    ("icd", icd_prompt.strip()[:400]),
+    ("explain", EXPLAIN_PROMPT.strip()[:400]),
+]
+_DEMO_KEYS_RE = re.compile(r"Return ONLY a JSON object with these keys: \{(.*)\}\s*$", re.DOTALL)
+
+app = FastAPI(title="Mock Azure OpenAI")
+
+_stats: Counter = Counter()
+_seen: Counter = Counter()
+_window: deque = deque()
+_window_lock = threading.Lock()
+
+
+def classify(system_prompt: str) -> str:
+    stripped = system_prompt.strip()
+    for name, prefix in _PROMPT_PREFIXES:
+        if stripped.startswith(prefix):
+            return name
+    if _DEMO_KEYS_RE.search(stripped) or "patient details" in stripped.lower():
+        return "demo"
+    return "default"
+
+
+def canned(prompt_type: str, system_prompt: str) -> str:
+    if MOCK_FIXTURES:
+        path = os.path.join(MOCK_FIXTURES, f"{prompt_type}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read()
+    if prompt_type == "demo":
+        keys = re.findall(r'"(\w+)"', (_DEMO_KEYS_RE.search(system_prompt) or [None, ""])[1])
+        return json.dumps({k: "" for k in keys})
+    return json.dumps(CANNED.get(prompt_type, CANNED["default"]))
+
+
+def draw_latency(prompt_type: str, rng: random.Random) -> float:
+    spec = MOCK_LATENCY.get(prompt_type, MOCK_LATENCY.get("default", "fixed:0.5"))
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "uniform":
+        return rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return rng.lognormvariate(math.log(values[0]), values[1])
+    return values[0] if values else 0.0
+
+
+def _quota_headers(tokens: int) -> Dict[str, str]:
+    """Sliding one-minute request/token window; also decides whether the quota is exhausted"""
+    now = time.time()
+    with _window_lock:
+        while _window and _window[0][0] < now - 60:
+            _window.popleft()
+        used_requests = len(_window)
+        used_tokens = sum(t for _, t in _window)
+        _window.append((now, tokens))
+    headers = {}
+    if MOCK_RPM:
+        headers["x-ratelimit-limit-requests"] = str(MOCK_RPM)
+        headers["x-ratelimit-remaining-requests"] = str(max(MOCK_RPM - used_requests - 1, 0))
+    if MOCK_TPM:
+        headers["x-ratelimit-limit-tokens"] = str(MOCK_TPM)
+        headers["x-ratelimit-remaining-tokens"] = str(max(MOCK_TPM - used_tokens - tokens, 0))
+    exhausted = (MOCK_RPM and used_requests >= MOCK_RPM) or (MOCK_TPM and used_tokens + tokens > MOCK_TPM)
+    headers["x-mock-exhausted"] = "1" if exhausted else "0"
+    return headers
+
+
+def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"code": str(status), "message": message}}, headers=headers)
+
+
+def _completion(model: str, content: str, prompt_tokens: int, completion_tokens: int, seed: str) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-mock-{seed[:16]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+async def _stream(model: str, content: str, seed: str, headers: Dict[str, str]):
+    step = CHARS_PER_TOKEN
+    for i in range(0, len(content), step):
+        chunk = {
+            "id": f"chatcmpl-mock-{seed[:16]}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(1 / MOCK_TOKENS_PER_SECOND)
+    done = {"id": f"chatcmpl-mock-{seed[:16]}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    raw = await request.body()
+    body = json.loads(raw or b"{}")
+    messages = body.get("messages") or []
+    system_prompt = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    prompt_type = classify(system_prompt)
+
+    # deterministic per request content: the n-th identical request always draws the same numbers
+    digest = hashlib.sha256(raw).hexdigest()
+    _seen[digest] += 1
+    seed = f"{MOCK_SEED}:{digest}:{_seen[digest]}"
+    rng = random.Random(seed)
+
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // CHARS_PER_TOKEN
+    content = canned(prompt_type, system_prompt)
+    completion_tokens = max(len(content) // CHARS_PER_TOKEN, 1)
+    headers = _quota_headers(prompt_tokens + completion_tokens)
+    _stats[f"{prompt_type}:requests"] += 1
+
+    fault = rng.random()
+    cumulative = 0.0
+    for kind in ("429", "500", "timeout"):
+        cumulative += float(MOCK_FAULTS.get(kind, 0))
+        if fault < cumulative:
+            break
+    else:
+        kind = "429" if headers.pop("x-mock-exhausted") == "1" else None
+    headers.pop("x-mock-exhausted", None)
+
+    if kind == "429":
+        _stats[f"{prompt_type}:429"] += 1
+        headers["retry-after"] = str(rng.choice([1, 2, 5]))
+        return _error(429, "Rate limit is exceeded. Try again later.", headers)
+    if kind == "500":
+        _stats[f"{prompt_type}:500"] += 1
+        await asyncio.sleep(draw_latency(prompt_type, rng) / 4)
+        return _error(500, "The server had an error while processing your request.")
+    if kind == "timeout":
+        _stats[f"{prompt_type}:timeout"] += 1
+        await asyncio.sleep(MOCK_HANG_SECONDS)
+        return _error(504, "Gateway timeout")
+
+    model = body.get("model") or deployment
+    if body.get("stream"):
+        # time to first token, then the token-rate-limited body
+        await asyncio.sleep(draw_latency(prompt_type, rng) * 0.2)
+        _stats[f"{prompt_type}:ok"] += 1
+        return StreamingResponse(_stream(model, content, seed, headers), media_type="text/event-stream", headers=headers)
+
+    await asyncio.sleep(draw_latency(prompt_type, rng) + completion_tokens / MOCK_TOKENS_PER_SECOND)
+    _stats[f"{prompt_type}:ok"] += 1
+    return JSONResponse(_completion(model, content, prompt_tokens, completion_tokens, seed), headers=headers)
+
+
+@app.get("/mock/stats")
+def mock_stats():
+    return {"stats": dict(_stats), "uniqueRequests": len(_seen)}
+
+
+@app.post("/mock/config")
+async def mock_config(request: Request):
+    """Change latency/fault/quota settings of a running mock without restarting it"""
+    global MOCK_LATENCY, MOCK_FAULTS, MOCK_RPM, MOCK_TPM, MOCK_TOKENS_PER_SECOND
+    update = await request.json()
+    MOCK_LATENCY = {**MOCK_LATENCY, **update.get("latency", {})}
+    MOCK_FAULTS = update.get("faults", MOCK_FAULTS)
+    MOCK_RPM = int(update.get("rpm", MOCK_RPM))
+    MOCK_TPM = int(update.get("tpm", MOCK_TPM))
+    MOCK_TOKENS_PER_SECOND = float(update.get("tokensPerSecond", MOCK_TOKENS_PER_SECOND))
+    _stats.clear()
+    logger.info(f"[MOCK-CONFIG] latency={MOCK_LATENCY} faults={MOCK_FAULTS} rpm={MOCK_RPM} tpm={MOCK_TPM}")
+    return {"latency": MOCK_LATENCY, "faults": MOCK_FAULTS, "rpm": MOCK_RPM, "tpm": MOCK_TPM, "tokensPerSecond": MOCK_TOKENS_PER_SECOND}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Azure OpenAI chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
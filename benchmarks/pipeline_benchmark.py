@@ -0,0 +1,442 @@
+"""
+End-to-end throughput benchmark: /miner_process_task -> miner -> OCR -> EM -> callback.
+
+    python -m benchmarks.pipeline_benchmark --charts 50 --rate 2 --out bench.json
+
+Starts the real app (uvicorn main:app) against a local Redis (in-memory fakeredis server by default,
+or --redis host:port), the mock Azure OpenAI server and a harness server that plays the OCR engine,
+the blob store (synthetic PDFs) and the miner-status/EM callback receivers. Prints one JSON report:
+throughput, end-to-end latency percentiles, per-stage queue wait / processing time, queue depth
+and Redis memory, tagged with the git commit so runs can be compared. Queue waits and EM processing
+time are read from the app's own /metrics histograms, the same series production dashboards use.
+Everything the app persists (usage ledger, MDM extractions, metric files) goes to the run's workdir.
+"""
+import os
+import sys
+import json
+import asyncio
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+import redis
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_SECONDS = 0.1
+
+_SECTIONS = {
+    "CHIEF COMPLAINT": ["Follow-up for blood pressure and diabetes.", "Cough for five days."],
+    "HISTORY OF PRESENT ILLNESS": [
+        "Patient reports intermittent headaches, no chest pain or shortness of breath.",
+        "Home blood pressure readings around 150/90 over the last two weeks.",
+        "Blood sugars mostly 140-180 fasting, no hypoglycemic episodes.",
+        "Productive cough with low-grade fever, no sick contacts.",
+    ],
+    "MEDICATIONS": ["Lisinopril 20 mg daily.", "Metformin 1000 mg twice daily.", "Atorvastatin 40 mg nightly."],
+    "ASSESSMENT": [
+        "Hypertension, not at goal.", "Type 2 diabetes mellitus without complications.",
+        "Hyperlipidemia, stable.", "Acute bronchitis.",
+    ],
+    "PLAN": [
+        "Increase lisinopril to 40 mg daily.", "CBC and BMP ordered today.", "Hemoglobin A1c ordered.",
+        "Return in 4 weeks.", "Chest x-ray if cough persists.",
+    ],
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def synthetic_chart(index: int, pages: int, rng: random.Random) -> List[str]:
+    """Page texts of a clinic note; content varies per chart so LLM calls are not coalesced"""
+    result = []
+    for page in range(pages):
+        lines = [f"Patient: BENCH-{index:05d}  Page {page + 1} of {pages}", f"Date of service: 0{rng.randint(1, 9)}/1{rng.randint(0, 9)}/2025"]
+        for heading, sentences in _SECTIONS.items():
+            lines.append(f"{heading}:")
+            lines.extend(rng.sample(sentences, k=rng.randint(1, len(sentences))))
+        result.append("\n".join(lines))
+    return result
+
+
+def synthetic_pdf(pages: List[str]) -> bytes:
+    """Minimal text-only PDF (Helvetica, one content stream per page) readable by pypdf"""
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        body = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(f"({escape(l)}) Tj T*" for l in text.split("\n")) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class Harness:
+    """Mock OCR engine, blob store and callback receiver; records when each chart reaches each stage"""
+
+    def __init__(self, base_url: str, ocr_latency: float):
+        self.base_url = base_url
+        self.ocr_latency = ocr_latency
+        self.pdfs: Dict[str, bytes] = {}
+        self.submitted: Dict[str, float] = {}
+        self.ocr_started: Dict[str, float] = {}
+        self.miner_done: Dict[str, float] = {}
+        self.completed: Dict[str, float] = {}
+        self.invalid: List[str] = []
+        self.expected = 0
+        self.done = threading.Event()
+        self.app = self._build_app()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/ocr")
+        async def ocr(request: Request):
+            task = await request.json()
+            pid = task["patientId"]
+            self.ocr_started.setdefault(pid, time.time())
+            await asyncio.sleep(self.ocr_latency)
+            return {
+                "demoFile": False,
+                "isAFile": False,
+                "afterOcrBlobPath": task["afterOcrBlobPath"],
+                "afterOcrSasUrl": f"{self.base_url}/blob/{pid}.pdf",
+                "insurance": task.get("insurance", ""),
+                "returnHeaders": task.get("returnHeaders", {}),
+                "traceDto": task.get("traceDto", {}),
+            }
+
+        @app.get("/blob/{name}")
+        def blob(name: str):
+            return Response(self.pdfs[name[:-4]], media_type="application/pdf")
+
+        @app.post("/miner-status")
+        async def miner_status(request: Request):
+            pid = (await request.json())["patientId"]
+            self.miner_done.setdefault(pid, time.time())
+            return {"ok": True}
+
+        @app.post("/callback")
+        async def callback(request: Request):
+            payload = await request.json()
+            pid = payload["patientId"]
+            self.completed.setdefault(pid, time.time())
+            if not payload.get("medicalEvaluation"):
+                self.invalid.append(pid)
+            if len(self.completed) >= self.expected:
+                self.done.set()
+            return {"ok": True}
+
+        return app
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    arr = np.array(values)
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "max": round(float(arr.max()), 3),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _redis_memory(client: redis.Redis) -> Optional[int]:
+    """used_memory in bytes; None on servers without INFO (the in-memory stand-in)"""
+    try:
+        return int(client.info("memory")["used_memory"])
+    except (redis.ResponseError, KeyError):
+        return None
+
+
+def _histogram(metrics_text: str, name: str, **labels: str) -> Dict[str, Optional[float]]:
+    """count / mean and bucket-interpolated percentiles of one Prometheus histogram series"""
+    buckets, total, count = [], 0.0, 0
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if any(sample.labels.get(k) != v for k, v in labels.items()):
+                continue
+            if sample.name == f"{name}_bucket":
+                buckets.append((float(sample.labels["le"]), sample.value))
+            elif sample.name == f"{name}_sum":
+                total = sample.value
+            elif sample.name == f"{name}_count":
+                count = int(sample.value)
+    if not count:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+    buckets.sort()
+
+    def quantile(q: float) -> float:
+        rank, lower, below = q * count, 0.0, 0.0
+        for upper, cumulative in buckets:
+            if cumulative >= rank:
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - below) / max(cumulative - below, 1e-9)
+            lower, below = upper, cumulative
+        return lower
+
+    return {
+        "count": count,
+        "mean": round(total / count, 3),
+        "p50": round(quantile(0.50), 3),
+        "p95": round(quantile(0.95), 3),
+        "p99": round(quantile(0.99), 3),
+    }
+
+
+def _sampler(client: redis.Redis, samples: Dict[str, Any], stop: threading.Event) -> None:
+    """Queue depths and Redis memory"""
+    while not stop.is_set():
+        try:
+            pipe = client.pipeline()
+            pipe.llen("miner_processing_queue")
+            pipe.llen("em_queue")
+            miner_depth, em_depth = pipe.execute()
+            samples["minerQueueDepth"].append(miner_depth)
+            samples["emQueueDepth"].append(em_depth)
+            memory = _redis_memory(client)
+            if memory is not None:
+                samples["redisMemory"].append(memory)
+        except redis.RedisError:
+            pass
+        stop.wait(SAMPLE_SECONDS)
+
+
+def _start_redis(spec: str):
+    if spec != "memory":
+        host, _, port = spec.partition(":")
+        return host, int(port or 6379), None
+    from fakeredis import TcpFakeServer
+
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    # handler threads must not keep the process alive on exit
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "127.0.0.1", port, server
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="em-bench-")
+    redis_host, redis_port, fake_server = _start_redis(args.redis)
+    client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+
+    harness_port, llm_port, app_port = _free_port(), _free_port(), _free_port()
+    harness_url = f"http://127.0.0.1:{harness_port}"
+    harness = Harness(harness_url, args.ocr_latency)
+    harness_server = uvicorn.Server(uvicorn.Config(harness.app, host="127.0.0.1", port=harness_port, log_level="warning"))
+    threading.Thread(target=harness_server.run, daemon=True).start()
+
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT,
+        "REDIS_HOST": redis_host,
+        "REDIS_PORT": str(redis_port),
+        "REDIS_SSL": "false",
+        "OCR_ENGINE_URL": f"{harness_url}/ocr",
+        "OCR_STATUS_URL": f"{harness_url}/miner-status",
+        "SEND": f"{harness_url}/callback",
+        "azure_endpoint": f"http://127.0.0.1:{llm_port}",
+        "uuid": "benchmark",
+        "LLM_DEPLOYMENTS": "",
+        "LLM_USAGE_DIR": os.path.join(workdir, "llm_usage"),
+        "MDM_EXTRACTION_DIR": os.path.join(workdir, "mdm_extractions"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+        "OTEL_TRACES_EXPORTER": "none",
+        "MOCK_LLM_SEED": str(args.seed),
+    })
+    # duckdb.connect creates a missing database file; keep that out of services/icd
+    for name, filename in (("SYNONYM_DB", "icd_synonym2026_1.duckdb"), ("MAIN_DB", "icd_2026.duckdb")):
+        if name not in os.environ and not os.path.exists(os.path.join(ROOT, "services", "icd", filename)):
+            env[name] = os.path.join(workdir, filename)
+    if args.llm_latency:
+        env["MOCK_LLM_LATENCY"] = args.llm_latency
+    if args.llm_faults:
+        env["MOCK_LLM_FAULTS"] = args.llm_faults
+
+    logs = {name: open(os.path.join(workdir, f"{name}.log"), "w") for name in ("llm", "app")}
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_azure_openai", "--port", str(llm_port)],
+            cwd=ROOT, env=env, stdout=logs["llm"], stderr=subprocess.STDOUT,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=logs["app"], stderr=subprocess.STDOUT,
+        ),
+    ]
+    samples: Dict[str, list] = {"minerQueueDepth": [], "emQueueDepth": [], "redisMemory": []}
+    stop = threading.Event()
+    try:
+        _wait_http(f"{harness_url}/docs", 30)
+        _wait_http(f"http://127.0.0.1:{llm_port}/mock/stats", 60)
+        _wait_http(f"http://127.0.0.1:{app_port}/health", args.startup_timeout)
+
+        rng = random.Random(args.seed)
+        charts = []
+        for i in range(args.charts):
+            pid = f"bench-{i:05d}"
+            harness.pdfs[pid] = synthetic_pdf(synthetic_chart(i, args.pages, rng))
+            charts.append(pid)
+        harness.expected = len(charts)
+
+        memory_start = _redis_memory(client)
+        threading.Thread(target=_sampler, args=(client, samples, stop), daemon=True).start()
+
+        started = time.time()
+        with httpx.Client(base_url=f"http://127.0.0.1:{app_port}", timeout=30) as http:
+            for i, pid in enumerate(charts):
+                if args.rate > 0:
+                    time.sleep(max(started + i / args.rate - time.time(), 0))
+                harness.submitted[pid] = time.time()
+                http.post("/miner_process_task", json={
+                    "patientId": pid,
+                    "sasToken": "bench",
+                    "blobSasToken": "bench",
+                    "afterOcrBlobPath": f"bench/{pid}.pdf",
+                    "returnHeaders": {},
+                    "traceDto": {"traceId": f"bench-trace-{i:05d}"},
+                    "connectionString": "",
+                    "insurance": "Medicare",
+                }).raise_for_status()
+
+        harness.done.wait(args.timeout)
+        wall = time.time() - started
+        stop.set()
+        memory_end = _redis_memory(client)
+        metrics_text = httpx.get(f"http://127.0.0.1:{app_port}/metrics", timeout=10).text
+        llm_stats = httpx.get(f"http://127.0.0.1:{llm_port}/mock/stats", timeout=5).json()
+    finally:
+        stop.set()
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            try:
+                p.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        harness_server.should_exit = True
+        if fake_server is not None:
+            fake_server.shutdown()
+
+    done = [pid for pid in charts if pid in harness.completed]
+    miner_processing = [
+        harness.miner_done[pid] - harness.ocr_started[pid]
+        for pid in done if pid in harness.miner_done and pid in harness.ocr_started
+    ]
+    stages = {
+        "minerQueueWait": _histogram(metrics_text, "queue_wait_seconds", queue_name="miner_processing_queue"),
+        "minerProcessing": _percentiles(miner_processing),
+        "emQueueWait": _histogram(metrics_text, "queue_wait_seconds", queue_name="em_queue"),
+        "emProcessing": _histogram(metrics_text, "pipeline_stage_duration_seconds", stage="em_process"),
+    }
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "charts": args.charts, "pages": args.pages, "rate": args.rate, "redis": args.redis,
+            "ocrLatency": args.ocr_latency, "llmLatency": args.llm_latency, "llmFaults": args.llm_faults, "seed": args.seed,
+        },
+        "completed": len(done),
+        "timedOut": len(charts) - len(done),
+        "invalidPayloads": len(harness.invalid),
+        "wallSeconds": round(wall, 3),
+        "throughputPerMinute": round(len(done) / wall * 60, 2) if wall else None,
+        "endToEndSeconds": _percentiles([harness.completed[p] - harness.submitted[p] for p in done]),
+        "stagesSeconds": stages,
+        "queueDepth": {
+            "minerMax": max(samples["minerQueueDepth"], default=0),
+            "emMax": max(samples["emQueueDepth"], default=0),
+        },
+        "redisMemoryBytes": {
+            "start": memory_start,
+            "peak": max(samples["redisMemory"], default=None),
+            "end": memory_end,
+        },
+        "llm": llm_stats,
+        "logs": workdir,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end queue pipeline benchmark")
+    parser.add_argument("--charts", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3, help="pages per synthetic chart")
+    parser.add_argument("--rate", type=float, default=0, help="submissions per second (0 = all at once)")
+    parser.add_argument("--redis", default="memory", help="'memory' (in-process fakeredis server) or host:port")
+    parser.add_argument("--ocr-latency", type=float, default=0.2, help="seconds the mock OCR engine takes per chart")
+    parser.add_argument("--llm-latency", default="", help="MOCK_LLM_LATENCY JSON for the mock LLM")
+    parser.add_argument("--llm-faults", default="", help="MOCK_LLM_FAULTS JSON for the mock LLM")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for all callbacks")
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
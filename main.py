@@ -1,6 +1,7 @@
 import os
 import logging
 import time
+from typing import Any, Dict, List, Optional
 import requests
 import redis
 from dotenv import load_dotenv
@@ -15,22 +16,25 @@ from api.miner_viewer import (
     get_result_miner,
     worker_status as miner_worker_status,
     get_miner_queue_items,
+    extract_pdf_text,
 )
 
 
-from api.em import enqueue_em_task, get_em_result
+from api.em import enqueue_em_task, get_em_result, EM_QUEUE
+from api.ocr import QUEUE_NAME as OCR_QUEUE
+from api.miner_viewer import TASK_QUEUE as MINER_QUEUE
 from services.cpt.cpt import cpt_coder
 from services.cpt.cpt import get_cpt
 from fastapi import Depends
 from utils.health import get_health, get_liveness, get_readiness, get_startup
-from utils.metrics import metrics_middleware, get_metrics
+from utils.metrics import metrics_middleware, get_metrics, clear_stale_metric_files, MULTIPROC_DIR
+from utils.pipeline_metrics import stage_timer, start_queue_sampler
+from utils.timeline import patient_timeline
 from fastapi.responses import Response
 from utils.tracing import init_tracer, instrument_fastapi, get_tracer
+from utils.structured_logging import configure_logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-)
+configure_logging()
 class SuppressHealthAccessLogs(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         msg = record.getMessage()
@@ -165,17 +169,16 @@ class DemoRequest(BaseModel):
     traceDto: dict
     returnHeaders: dict
 
-from pypdf import PdfReader
-import io
 
 def download_blob_text(url: str, patient_id: str = None) -> str:
     pid_log = f"patient={patient_id} " if patient_id else ""
     logger.info(f"[API-DOWNLOAD-START] {pid_log}url={url} Downloading blob")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        reader = PdfReader(io.BytesIO(resp.content))
-        text = "".join(page.extract_text() or "" for page in reader.pages)
+        with stage_timer("pdf_download", patient_id):
+            resp = requests.get(url, timeout=10)
+            resp.raise_for_status()
+        with stage_timer("pdf_extract", patient_id):
+            text = extract_pdf_text(resp.content)
         logger.info(f"[API-DOWNLOAD-SUCCESS] {pid_log}url={url} text_length={len(text)}")
         return text
     except requests.RequestException as e:
@@ -345,6 +348,31 @@ def flush_ocr_redis_route():
         logger.error(f"[API-OCR-FLUSH-ERROR] Failed to flush OCR Redis: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to flush OCR Redis: {str(e)}")
 
+from utils.usage_ledger import usage_summary
+
+@app.get("/usage/summary")
+def usage_summary_route(hours: Optional[float] = None, patientId: Optional[str] = None):
+    """Per-prompt LLM call counts, tokens, cost and latency percentiles from the usage ledger"""
+    logger.info(f"[API-USAGE-SUMMARY] endpoint=/usage/summary hours={hours} patient={patientId}")
+    try:
+        since = time.time() - hours * 3600 if hours else None
+        prompts = usage_summary(since, patientId)
+        return {
+            "status": "ok",
+            "timestamp": time.time(),
+            "totalCostUsd": round(sum(p["costUsd"] for p in prompts), 6),
+            "prompts": prompts,
+        }
+    except Exception as e:
+        logger.error(f"[API-USAGE-SUMMARY-ERROR] Failed to summarise usage: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to summarise usage: {str(e)}")
+
+@app.get("/llmEndpointsStatus")
+def llm_endpoints_status_route():
+    """Health statistics of every configured LLM deployment as seen by the balancer"""
+    from utils.ai import balancer
+    return {"status": "ok", "timestamp": time.time(), "endpoints": balancer.status()}
+
 @app.get("/allQueuesStatus")
 def all_queues_status_route():
     """Get comprehensive status for all queues (EM, OCR, Miner) with full Redis details"""
@@ -650,6 +678,20 @@ def patient_status_comprehensive(patient_id: str):
         }
 
 
+@app.get("/patientTimeline/{patient_id}")
+def patient_timeline_route(patient_id: str):
+    """Waterfall of every stage a patient's chart went through (queue waits, OCR, extraction, LLM prompts, callbacks)"""
+    logger.info(f"[API-PATIENT-TIMELINE] patient={patient_id} endpoint=/patientTimeline/{patient_id} Fetching timeline")
+    try:
+        timeline = patient_timeline(redis_client, patient_id)
+    except redis.RedisError as e:
+        logger.error(f"[API-PATIENT-TIMELINE-ERROR] patient={patient_id} Failed to read timeline: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to read timeline: {str(e)}")
+    if not timeline["events"]:
+        raise HTTPException(status_code=404, detail=f"No timeline for patient {patient_id}")
+    return timeline
+
+
 @app.get("/loadGpu")
 async def load_gpu_endpoint():
     try:
@@ -673,10 +715,54 @@ from services.mdm.mdm import mdm_test
 
 class test_mdmdddd(BaseModel):
     chart:str
+    outputProfile: Optional[str] = None
 @app.post("/testMdm")
 async def medtest(chart_txt:test_mdmdddd):
     chart=chart_txt.chart
-    return await mdm_test(chart)
+    return await mdm_test(chart, chart_txt.outputProfile)
+
+from services.mdm.extraction_store import load_extraction
+from services.mdm.output_profile import explain_extraction, apply_explanations
+from services.mdm.rescore import rescore_extraction
+
+class MdmExplainRequest(BaseModel):
+    traceId: str
+
+@app.post("/mdm/explain")
+async def mdm_explain(payload: MdmExplainRequest):
+    """Lazily generate table explanations for a stored (compact) extraction and return the re-scored output"""
+    logger.info(f"[API-MDM-EXPLAIN] endpoint=/mdm/explain trace={payload.traceId}")
+    stored = load_extraction(payload.traceId)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="No stored extraction for traceId")
+    try:
+        extraction = stored["extraction"]
+        explanations = await explain_extraction(extraction, payload.traceId)
+        return {
+            "status": "ok",
+            "traceId": payload.traceId,
+            "explanations": explanations,
+            "result": rescore_extraction(apply_explanations(extraction, explanations)),
+        }
+    except Exception as e:
+        logger.error(f"[API-MDM-EXPLAIN-ERROR] trace={payload.traceId} error={e}")
+        raise HTTPException(status_code=500, detail=f"Failed to explain extraction: {str(e)}")
+
+from services.mdm.levels import compute_levels_batch
+
+class MdmLevelsBatchRequest(BaseModel):
+    encounters: List[Dict[str, Any]] = Field(..., min_length=1)
+
+@app.post("/mdm/levels/batch")
+def mdm_levels_batch(payload: MdmLevelsBatchRequest):
+    """Deterministic table levels, final level and E/M CPT code for structured extractions"""
+    logger.info(f"[API-MDM-LEVELS-BATCH] endpoint=/mdm/levels/batch encounters={len(payload.encounters)}")
+    try:
+        results = compute_levels_batch(payload.encounters)
+        return {"status": "ok", "count": len(results), "results": results}
+    except Exception as e:
+        logger.error(f"[API-MDM-LEVELS-BATCH-ERROR] Failed to compute levels: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compute levels: {str(e)}")
 #================================== CPT Engine ===========
 
 class CPT_rule_prompt(BaseModel):
@@ -699,5 +785,12 @@ import ray
 @app.on_event("startup")
 async def startup_event():
     redis_client.flushdb()
-    ray.init(ignore_reinit_error=True)
+    clear_stale_metric_files()
+    # Ray workers write their metrics next to ours so /metrics includes LLM/ICD/MDM timings from the remotes
+    runtime_env = {"env_vars": {"PROMETHEUS_MULTIPROC_DIR": MULTIPROC_DIR}} if MULTIPROC_DIR else {}
+    # remotes are pickled by value, so the workers never import api/*; install logging and tracing explicitly
+    runtime_env["worker_process_setup_hook"] = "utils.worker_setup.setup_ray_worker"
+    ray.init(ignore_reinit_error=True, runtime_env=runtime_env)
+    # depth / oldest-age gauges for the three worker queues
+    start_queue_sampler(redis_client, [EM_QUEUE, OCR_QUEUE, MINER_QUEUE])
 
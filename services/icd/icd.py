@@ -6,7 +6,10 @@ import aiohttp
 import asyncio
 import logging
 from services.icd.icd_prompt import prompt
-from utils.ai import ai_call
+from utils.model_router import routed_call
+from utils.sections import select_sections
+from utils.pipeline_metrics import stage_timer
+from utils.tracing import traced_span
 import logging
 
 logging.basicConfig(
@@ -34,13 +37,21 @@ def parse_json_strict(s: str):
             s = s[len("json"):].strip()
     return json.loads(s)
 
+def _icd_check(raw: str):
+    """Escalate when the ICD output is not a JSON object with a primary condition"""
+    try:
+        parsed = parse_json_strict(raw)
+    except Exception:
+        return "schema"
+    return None if isinstance(parsed, dict) and "primary_condition" in parsed else "schema"
+
 def remove_dots_from_icd(icd_code):
     return icd_code.replace(".", "") if icd_code else ""
 
 
 async def find_condition_in_synonym_table(condition):
     try:
-        with duckdb.connect(SYNONYM_DB) as conn:
+        with traced_span("duckdb icd_synonym", **{"db.system": "duckdb", "db.name": SYNONYM_DB}), duckdb.connect(SYNONYM_DB) as conn:
             query = "SELECT ICD FROM icd_synonym2026_1 WHERE LOWER(DESCRIPTION) = LOWER(?) LIMIT 1"
             result = conn.execute(query, [condition]).fetchone()
             if result:
@@ -58,7 +69,7 @@ async def find_condition_in_synonym_table(condition):
 async def find_icd_in_main_table(icd_code):
     try:
         search_code = remove_dots_from_icd(icd_code)
-        with duckdb.connect(MAIN_DB) as conn:
+        with traced_span("duckdb icd_main", **{"db.system": "duckdb", "db.name": MAIN_DB}), duckdb.connect(MAIN_DB) as conn:
             query = "SELECT ICD, DESCRIPTION FROM icd_2026 WHERE REPLACE(ICD, '.', '') = ? LIMIT 1"
             result = conn.execute(query, [search_code]).fetchone()
             if result:
@@ -69,6 +80,10 @@ async def find_icd_in_main_table(icd_code):
         return None
 
 async def map_condition_to_icd(condition, qwen_icd_code, qwen_icd_description):
+    with stage_timer("icd_mapping"):
+        return await _map_condition_to_icd(condition, qwen_icd_code, qwen_icd_description)
+
+async def _map_condition_to_icd(condition, qwen_icd_code, qwen_icd_description):
     if not condition:
         logging.warning("Empty condition provided to map_condition_to_icd")
         return {
@@ -101,10 +116,10 @@ async def map_condition_to_icd(condition, qwen_icd_code, qwen_icd_description):
         "source": "qwen"
     }
 
-async def get_icd(text, trace_id: str):
+async def get_icd(text, trace_id: str, sections=None):
     try:
         logging.info(f"ICD text for trace_id: {trace_id}")
-        llm_output = await ai_call(text, prompt)
+        llm_output = await routed_call("icd", select_sections(text, "icd", sections), prompt, check=_icd_check)
         qwen_output = parse_json_strict(llm_output)
         logging.info(f"ICD Qwen output for trace_id: {trace_id}: {qwen_output}")
         if not isinstance(qwen_output, dict):
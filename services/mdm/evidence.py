@@ -0,0 +1,343 @@
+import os
+import re
+import bisect
+import logging
+from collections import deque
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.mdm import rules
+from services.mdm.levels import CONDITION_MAP
+from services.mdm.visit_classifier import preclassify_patient_type
+from utils.metrics import evidence_checks_total
+from utils.sections import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+EVIDENCE_VERIFY = os.getenv("MDM_EVIDENCE_VERIFY", "true").lower() == "true"
+# minimum SequenceMatcher ratio for a fuzzy (OCR-noisy) evidence match
+FUZZY_THRESHOLD = float(os.getenv("MDM_EVIDENCE_FUZZY_THRESHOLD", "0.85"))
+FUZZY_MAX_CANDIDATES = 400
+
+_SENTENCE_KEYS = ("exactSentence", "evidence_sentence", "exact_sentence", "evidence_sentance")
+_PAGE_KEYS = ("PageNo", "page")
+# "[Page 3 | assessment]" prefixes from the retrieval window sometimes leak into answers
+_MARKER_RE = re.compile(r"^\s*\[page \d+[^\]]*\]\s*", re.IGNORECASE)
+_ICD_ONLY_RE = re.compile(r"^[A-TV-Z]\d{2}(?:\.\d{1,4})?$", re.IGNORECASE)
+_BOOLEAN_WORDS = {"yes", "no", "true", "false", "none", "null", "n/a"}
+_RX_ACTION_RE = re.compile(
+    r"(?i)\b(?:initiat\w*|start\w*|prescri\w*|discontinu\w*|stop\w*|refill\w*|increas\w*|decreas\w*|"
+    r"adjust\w*|chang\w*|titrat\w*|switch\w*|e-?prescri\w*|sent to pharmacy)\b"
+)
+
+
+def _normalize(text: str) -> Tuple[str, List[int]]:
+    """Lowercase alphanumeric text with single spaces, plus the original offset of every character"""
+    out: List[str] = []
+    offsets: List[int] = []
+    space = True
+    for i, ch in enumerate(text):
+        if ch.isalnum():
+            out.append(ch.lower())
+            offsets.append(i)
+            space = False
+        elif not space:
+            out.append(" ")
+            offsets.append(i)
+            space = True
+    if out and out[-1] == " ":
+        out.pop()
+        offsets.pop()
+    return "".join(out), offsets
+
+
+def _normalize_text(text: str) -> str:
+    return _normalize(text)[0]
+
+
+class _AhoCorasick:
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[str]] = [[]]
+        for pattern in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pattern)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if self.goto[f].get(ch, 0) != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def first_matches(self, text: str) -> Dict[str, int]:
+        """pattern -> start offset of its first occurrence"""
+        found: Dict[str, int] = {}
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for pattern in self.out[node]:
+                if pattern not in found:
+                    found[pattern] = i - len(pattern) + 1
+        return found
+
+
+class EvidenceIndex:
+    """Page-indexed normalized chart used to locate evidence sentences"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.norm, self.offsets = _normalize(text)
+        self.page_starts = [0] + [m.end() for m in re.finditer(PAGE_BREAK, text)]
+        # charts joined without PAGE_BREAK carry no page boundaries to check PageNo against
+        self.paged = len(self.page_starts) > 1
+        self.tokens = [(m.start(), m.group(0)) for m in re.finditer(r"\S+", self.norm)]
+        self.token_positions: Dict[str, List[int]] = {}
+        for idx, (_, tok) in enumerate(self.tokens):
+            self.token_positions.setdefault(tok, []).append(idx)
+
+    def page_of(self, norm_pos: int) -> int:
+        return bisect.bisect_right(self.page_starts, self.offsets[norm_pos]) if self.offsets else 1
+
+    def span(self, norm_start: int, norm_len: int) -> Tuple[int, int]:
+        """Original [start, end) character offsets of a normalized match, trailing punctuation included"""
+        end = self.offsets[norm_start + norm_len - 1] + 1
+        while end < len(self.text) and self.text[end] in ".!?;:,)%":
+            end += 1
+        return self.offsets[norm_start], end
+
+    def _fuzzy(self, needle: str) -> Optional[Tuple[int, int, float]]:
+        words = needle.split()
+        if len(words) < 2:
+            return None
+        candidates = sorted(set(self.token_positions.get(words[0], []) + self.token_positions.get(words[-1], [])))
+        best = None
+        for idx in candidates[:FUZZY_MAX_CANDIDATES]:
+            for start_idx in (idx, idx - len(words) + 1):
+                if start_idx < 0:
+                    continue
+                end_idx = min(start_idx + len(words), len(self.tokens)) - 1
+                start = self.tokens[start_idx][0]
+                end = self.tokens[end_idx][0] + len(self.tokens[end_idx][1])
+                ratio = SequenceMatcher(None, needle, self.norm[start:end], autojunk=False).ratio()
+                if ratio >= FUZZY_THRESHOLD and (best is None or ratio > best[2]):
+                    best = (start, end - start, ratio)
+        return best
+
+    def locate(self, sentences: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        sentence -> {"page", "text" (verbatim chart span), "span", "match": exact|fuzzy} for every sentence found.
+        Exact matches come from one Aho-Corasick pass; the rest are tried fuzzily.
+        """
+        needles = {}
+        for sentence in sentences:
+            needle = _normalize_text(_MARKER_RE.sub("", sentence or ""))
+            if needle:
+                needles[sentence] = needle
+        exact = _AhoCorasick(set(needles.values())).first_matches(self.norm) if needles else {}
+
+        located = {}
+        for sentence, needle in needles.items():
+            if needle in exact:
+                start, length, match = exact[needle], len(needle), "exact"
+            else:
+                fuzzy = self._fuzzy(needle)
+                if fuzzy is None:
+                    continue
+                start, length, match = fuzzy[0], fuzzy[1], "fuzzy"
+            begin, end = self.span(start, length)
+            located[sentence] = {"page": self.page_of(start), "text": self.text[begin:end], "span": [begin, end], "match": match}
+        return located
+
+
+def _evidence_nodes(node: Any) -> List[Dict]:
+    """Every dict in a parsed table output that carries an evidence sentence"""
+    found = []
+    if isinstance(node, dict):
+        if any(k in node for k in _SENTENCE_KEYS):
+            found.append(node)
+        for value in node.values():
+            found.extend(_evidence_nodes(value))
+    elif isinstance(node, list):
+        for value in node:
+            found.extend(_evidence_nodes(value))
+    return found
+
+
+def _is_valid_evidence(sentence: str) -> bool:
+    stripped = sentence.strip().strip(".")
+    return bool(stripped) and not _ICD_ONLY_RE.match(stripped) and stripped.lower() not in _BOOLEAN_WORDS
+
+
+def verify_evidence(text: str, *tables: Any, index: Optional[EvidenceIndex] = None) -> Dict[str, int]:
+    """
+    Check every exactSentence/evidence_sentence against the chart, in place:
+    found sentences get the chart's page number (when the chart has PAGE_BREAKs; otherwise the model's
+    PageNo is kept) and "evidenceOffset" [start, end) into the chart (fuzzy matches are replaced by the verbatim span),
+    missing or invalid ones are cleared together with their page. Answers are never changed.
+    """
+    stats = {"checked": 0, "exact": 0, "fuzzy": 0, "cleared": 0, "pageFixed": 0}
+    if not EVIDENCE_VERIFY:
+        return stats
+    nodes = [n for table in tables for n in _evidence_nodes(table)]
+    if not nodes:
+        return stats
+    index = index or EvidenceIndex(text)
+
+    sentence_of = {}
+    for node in nodes:
+        key = next(k for k in _SENTENCE_KEYS if k in node)
+        value = node.get(key)
+        sentence_of[id(node)] = (key, value if isinstance(value, str) else "")
+    located = index.locate(s for _, s in sentence_of.values() if _is_valid_evidence(s))
+
+    for node in nodes:
+        key, sentence = sentence_of[id(node)]
+        page_key = next((k for k in _PAGE_KEYS if k in node), "PageNo" if key != "exact_sentence" else "page")
+        if not sentence.strip():
+            node[page_key] = None
+            continue
+        stats["checked"] += 1
+        hit = located.get(sentence) if _is_valid_evidence(sentence) else None
+        if hit is None:
+            node[key] = ""
+            node[page_key] = None
+            stats["cleared"] += 1
+            continue
+        stats[hit["match"]] += 1
+        if hit["match"] == "fuzzy" or _MARKER_RE.match(sentence):
+            node[key] = hit["text"]
+        if index.paged:
+            if str(node.get(page_key)) != str(hit["page"]):
+                stats["pageFixed"] += 1
+            node[page_key] = hit["page"]
+        node["evidenceOffset"] = hit["span"]
+    for outcome in ("exact", "fuzzy", "cleared", "pageFixed"):
+        if stats[outcome]:
+            evidence_checks_total.labels(outcome=outcome).inc(stats[outcome])
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Rule enforcement for the conditions/risk/problems schema (mdm1.1 / mdm_validator_prompt)
+# ---------------------------------------------------------------------------
+
+def _yes(value: Any) -> bool:
+    return str(value).strip().lower() in ("yes", "true", "1")
+
+
+def _condition_severity(key: str) -> int:
+    atom = CONDITION_MAP.get(key.upper().replace("_", ""))
+    if atom is None:
+        return 0
+    return rules.RULES["risk_rank"].get(rules.risk_level(atom), 0)
+
+
+def _clear_link(links: Dict, key: str) -> None:
+    link = links.get(key)
+    if isinstance(link, dict):
+        for k in ("exact_sentence", "exactSentence"):
+            if k in link:
+                link[k] = ""
+        link["page"] = None
+
+
+def _find_key(mapping: Dict, name: str) -> Optional[str]:
+    target = name.upper().replace("_", "")
+    return next((k for k in mapping if k.upper().replace("_", "") == target), None)
+
+
+def _int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 1 if _yes(value) else 0
+
+
+def enforce_condition_rules(ai: Dict, text: str = "") -> Dict:
+    """
+    Deterministic version of the mdm_validator_prompt checks: single risk flag, rxMgmt rules,
+    NM override, evidence sanitization and the patient type lock. Mutates and returns `ai`.
+    """
+    conditions = ai.get("conditions") or ai.get("condition") or {}
+    risk = ai.get("risk") or {}
+    problems = ai.get("problems") or {}
+    cond_links = ai.get("conditions_hyperlink") or {}
+    risk_links = ai.get("risk_hyperlink") or {}
+    problem_links = ai.get("problems_hyperlink") or {}
+
+    rx_key = _find_key(conditions, "RX_MGMT")
+    low_key = _find_key(conditions, "LOW_RISK")
+    min_key = _find_key(conditions, "MIN_RISK")
+    has_problem = any(_int(v) > 0 for v in problems.values())
+
+    # rxMgmt needs at least one problem
+    if rx_key and _yes(conditions[rx_key]) and not has_problem:
+        conditions[rx_key] = "no"
+        _clear_link(cond_links, rx_key)
+
+    # single risk flag: keep the highest-severity "yes"; rxMgmt implies lowRisk below, so it is ranked on its own
+    flags = [k for k, v in conditions.items() if _yes(v) and k not in (low_key, min_key)]
+    if len(flags) > 1:
+        keep = max(flags, key=lambda k: (_condition_severity(k), -flags.index(k)))
+        for k in flags:
+            if k != keep:
+                conditions[k] = "no"
+                _clear_link(cond_links, k)
+
+    if rx_key and _yes(conditions[rx_key]):
+        if min_key:
+            conditions[min_key] = "no"
+            _clear_link(cond_links, min_key)
+        if low_key:
+            derived = not _yes(conditions[low_key])
+            conditions[low_key] = "yes"
+            if derived:
+                _clear_link(cond_links, low_key)
+        # evidence without an action verb is cleared but the flag stays
+        link = cond_links.get(rx_key) or {}
+        sentence = link.get("exact_sentence") or link.get("exactSentence") or ""
+        if sentence and not _RX_ACTION_RE.search(sentence):
+            _clear_link(cond_links, rx_key)
+    elif low_key and min_key and _yes(conditions.get(low_key)) and _yes(conditions.get(min_key)):
+        conditions[min_key] = "no"
+        _clear_link(cond_links, min_key)
+
+    # NM is "yes" if and only if no data element was documented; it never carries evidence
+    nm_key = _find_key(risk, "NM")
+    if nm_key:
+        no_data = all(
+            _int(risk.get(_find_key(risk, k) or k, 0)) == 0 for k in ("RENOTE", "RTEST", "OTEST", "IINTERP", "DMEXT")
+        )
+        risk[nm_key] = "yes" if no_data else "no"
+        _clear_link(risk_links, nm_key)
+
+    # evidence sanitization: ICD codes and boolean words are not evidence
+    for links in (cond_links, risk_links, problem_links):
+        for key, link in links.items():
+            if isinstance(link, dict):
+                sentence = link.get("exact_sentence") or link.get("exactSentence") or ""
+                if sentence and not _is_valid_evidence(sentence):
+                    _clear_link(links, key)
+
+    if text:
+        patient_type = preclassify_patient_type(text)
+        if patient_type:
+            ai["patientType"] = patient_type.lower()
+        verify_evidence(text, cond_links, risk_links, problem_links)
+    return ai
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from services.mdm.full_output_validater import Tab_1, Tab_2, Tab_3
+from services.mdm.output_profile import profile_prompt
+from services.mdm.visitprompt import prompt as visitprompt
+from utils.tracing import traced_span
+
+logger = logging.getLogger(__name__)
+
+# One Parquet file per extraction, partitioned by prompt hash: <dir>/prompt_hash=<hash>/<file>.parquet
+EXTRACTION_DIR = os.getenv("MDM_EXTRACTION_DIR", "data/mdm_extractions")
+PERSIST_EXTRACTIONS = os.getenv("MDM_PERSIST_EXTRACTIONS", "true").lower() == "true"
+
+
+def prompt_hash(*prompts: str) -> str:
+    """Stable short hash identifying the prompt set that produced an extraction"""
+    digest = hashlib.sha256()
+    for p in prompts:
+        digest.update(p.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+def run_prompt_hash(profile: str = "full", visit_preclassified: bool = False) -> str:
+    """
+    Hash of the prompt texts one run actually sent: table prompts with the profile's instructions, and
+    the visit prompt only when the visit type was not preclassified. Full-profile LLM runs keep PROMPT_HASH.
+    """
+    return prompt_hash(
+        "" if visit_preclassified else visitprompt,
+        *(profile_prompt(p, profile) for p in (Tab_1, Tab_2, Tab_3)),
+    )
+
+
+PROMPT_HASH = run_prompt_hash()
+
+
+def _partition_dir(hash_value: str) -> str:
+    return os.path.join(EXTRACTION_DIR, f"prompt_hash={hash_value}")
+
+
+def save_extraction(
+    extraction: Dict[str, Any],
+    trace_id: str = "",
+    patient_id: str = "",
+    hash_value: str = PROMPT_HASH,
+) -> Optional[str]:
+    """Write the parsed Tab_1/Tab_2/Tab_3/visitType JSON as a ZSTD-compressed Parquet file"""
+    if not PERSIST_EXTRACTIONS:
+        return None
+    try:
+        start = time.time()
+        part_dir = _partition_dir(hash_value)
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, f"{int(start * 1000)}-{uuid.uuid4().hex[:12]}.parquet")
+        with traced_span("duckdb extraction_save", **{"db.system": "duckdb", "db.name": path}), duckdb.connect() as conn:
+            conn.execute(
+                "CREATE TEMP TABLE extraction (patient_id VARCHAR, trace_id VARCHAR, created_at DOUBLE, extraction VARCHAR)"
+            )
+            conn.execute(
+                "INSERT INTO extraction VALUES (?, ?, ?, ?)",
+                [patient_id or "", trace_id or "", start, json.dumps(extraction, separators=(",", ":"))],
+            )
+            conn.execute(f"COPY extraction TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        logger.info(
+            f"[MDM-EXTRACTION-SAVED] patient={patient_id} trace={trace_id} prompt_hash={hash_value} "
+            f"duration_ms={(time.time() - start) * 1000:.1f}"
+        )
+        return path
+    except Exception as e:
+        logger.error(f"[MDM-EXTRACTION-SAVE-ERROR] patient={patient_id} trace={trace_id} error={e}")
+        return None
+
+
+def _glob(hash_value: Optional[str]) -> str:
+    return os.path.join(_partition_dir(hash_value) if hash_value else os.path.join(EXTRACTION_DIR, "*"), "*.parquet")
+
+
+def load_extractions(hash_value: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Read stored extractions, optionally for one prompt hash and/or newer than `since` (epoch seconds)"""
+    query = (
+        f"SELECT patient_id, trace_id, created_at, extraction, prompt_hash "
+        f"FROM read_parquet('{_glob(hash_value)}', hive_partitioning = true)"
+    )
+    params: List[Any] = []
+    if since is not None:
+        query += " WHERE created_at >= ?"
+        params.append(since)
+    query += " ORDER BY created_at"
+    try:
+        with duckdb.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+    except duckdb.IOException:
+        # no files written yet for this partition
+        return []
+    return [
+        {
+            "patientId": r[0],
+            "traceId": r[1],
+            "createdAt": r[2],
+            "extraction": json.loads(r[3]),
+            "promptHash": r[4],
+        }
+        for r in rows
+    ]
+
+
+def load_extraction(trace_id: str) -> Optional[Dict[str, Any]]:
+    """Most recent stored extraction for one trace id"""
+    try:
+        with duckdb.connect() as conn:
+            row = conn.execute(
+                f"SELECT patient_id, trace_id, created_at, extraction, prompt_hash "
+                f"FROM read_parquet('{_glob(None)}', hive_partitioning = true) "
+                f"WHERE trace_id = ? ORDER BY created_at DESC LIMIT 1",
+                [trace_id],
+            ).fetchone()
+    except duckdb.IOException:
+        return None
+    if row is None:
+        return None
+    return {"patientId": row[0], "traceId": row[1], "createdAt": row[2], "extraction": json.loads(row[3]), "promptHash": row[4]}
+
+
+def list_prompt_hashes() -> List[Dict[str, Any]]:
+    """Prompt hashes with stored extractions and their row counts"""
+    try:
+        with duckdb.connect() as conn:
+            rows = conn.execute(
+                f"SELECT prompt_hash, COUNT(*), MIN(created_at), MAX(created_at) "
+                f"FROM read_parquet('{_glob(None)}', hive_partitioning = true) GROUP BY prompt_hash ORDER BY 3"
+            ).fetchall()
+    except duckdb.IOException:
+        return []
+    return [{"promptHash": r[0], "count": r[1], "firstAt": r[2], "lastAt": r[3]} for r in rows]
+
+
+def compact_extractions(hash_value: str) -> Optional[str]:
+    """Merge the per-chart files of one prompt hash into a single Parquet file"""
+    part_dir = _partition_dir(hash_value)
+    files = [os.path.join(part_dir, f) for f in os.listdir(part_dir) if f.endswith(".parquet")] if os.path.isdir(part_dir) else []
+    if len(files) < 2:
+        return None
+    path = os.path.join(part_dir, f"{int(time.time() * 1000)}-compacted-{uuid.uuid4().hex[:12]}.parquet")
+    with duckdb.connect() as conn:
+        file_list = ", ".join(f"'{f}'" for f in files)
+        conn.execute(
+            f"COPY (SELECT * FROM read_parquet([{file_list}]) ORDER BY created_at) "
+            f"TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+        )
+    for f in files:
+        os.remove(f)
+    logger.info(f"[MDM-EXTRACTION-COMPACT] prompt_hash={hash_value} files={len(files)} output={path}")
+    return path
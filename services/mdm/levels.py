@@ -0,0 +1,309 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.mdm import rules
+
+logger = logging.getLogger(__name__)
+
+RANK_TO_LABEL = {1: "straightforward", 2: "low", 3: "moderate", 4: "high"}
+LABEL_TO_RANK = {v: k for k, v in RANK_TO_LABEL.items()}
+
+CPT_MAP = {
+    "new": {
+        "straightforward": "99202", "low": "99203", "moderate": "99204", "high": "99205"
+    },
+    "established": {
+        "straightforward": "99212", "low": "99213", "moderate": "99214", "high": "99215"
+    }
+}
+
+# Visit types whose CPT code comes from the visit classifier instead of the MDM level
+VISIT_TYPE_OVERRIDES = {"inpatient", "emergency", "consult", "preventive", "telehealth", "facility", "critical"}
+
+PROBLEM_MAP = {
+    "SLM": "self_limited_minor", "SCI": "stable_chronic", "AUI": "acute_uncomplicated",
+    "SAI": "stable_acute", "AUIO": "acute_uncomplicated_hospital", "CIE": "chronic_exacerbation",
+    "UNP": "undiagnosed_new", "AIS": "acute_systemic", "ACI": "acute_complicated_injury",
+    "CISE": "chronic_severe", "TLF": "threatening_illness"
+}
+
+CONDITION_MAP = {
+    "MINRISK": "minimal_risk_of_morbidity",
+    "LOWRISK": "low_risk_of_morbidity",
+    "RXMGMT": "prescription_drug_management",
+    "MINSURGRISK": "minor_surgery_with_risk_factors",
+    "MAJSURGNORISK": "elective_major_surgery_without_risk_factors",
+    "SDOHLIMIT": "sdh_limiting_diagnosis_or_treatment",
+    "TOXMONITOR": "drug_therapy_intensive_monitoring",
+    "MAJSURGWITHRISK": "elective_major_surgery_with_risk_factors",
+    "EMERGSURG": "emergency_major_surgery",
+    "HOSPESCALATE": "hospitalization_or_escalation",
+    "DNR": "do_not_resuscitate_due_to_poor_prognosis",
+    "IVCONTROLLED": "parenteral_controlled_substances"
+}
+
+# Table 2 data elements in a..g order (see re_table in mdm1.py)
+RISK_KEYS = ["NM", "RENOTE", "RTEST", "OTEST", "IHIST", "IINTERP", "DMEXT"]
+
+_PROBLEM_CODES = list(PROBLEM_MAP)
+_CONDITION_ATOMS = list(dict.fromkeys(CONDITION_MAP.values()))
+_YES = ("yes", "true", "1")
+
+
+def level_rank(label: Any) -> int:
+    """Rank of a level label (1-4), 0 when missing or unrecognised"""
+    if not label:
+        return 0
+    key = str(label).lower().replace(" ", "").replace("_", "")
+    return LABEL_TO_RANK.get(key, 0)
+
+
+def _risk_value(key: str, val: Any) -> int:
+    if key == "NM":
+        return 0 if str(val).lower() == "no" else 1
+    if key == "RENOTE":
+        if isinstance(val, str):
+            return 1 if val.lower() == "yes" else 0
+        return int(val)
+    if key == "RTEST":
+        try:
+            return int(val)
+        except Exception:
+            return 0
+    if key == "OTEST":
+        if isinstance(val, int):
+            return val
+        return 1 if str(val).lower() in _YES else 0
+    return 1 if str(val).lower() in _YES else 0
+
+
+def table1_ranks(counts: np.ndarray) -> np.ndarray:
+    """Vectorised highest_complexity_from_list over an (n, problem type) count matrix"""
+    n = counts.shape[0]
+    ranks = np.zeros(counts.shape, dtype=np.int8)
+    failed = np.zeros(n, dtype=bool)
+    level_ranks = rules.RULES["complexity_rank"]
+    for col, code in enumerate(_PROBLEM_CODES):
+        column = counts[:, col]
+        for value in np.unique(column[column > 0]):
+            level = rules.complexity(PROBLEM_MAP[code], int(value))
+            mask = column == value
+            if level is None:
+                failed |= mask
+            else:
+                ranks[mask, col] = level_ranks[level]
+    result = ranks.max(axis=1, initial=0)
+    result[(result == 0) | failed] = LABEL_TO_RANK["straightforward"]
+    return result
+
+
+def table2_ranks(data: np.ndarray) -> np.ndarray:
+    """Vectorised table2 over an (n, 7) matrix of a..g data element values"""
+    a, c, d, e, f = data[:, 0], data[:, 2], data[:, 3], data[:, 4], data[:, 5]
+    a_ = np.minimum(a, 3)
+    b_ = np.minimum(np.minimum(c, 2), 3)
+    c_ = np.minimum(np.minimum(d, 2), 3)
+    cat1 = a_ + b_ + c_ + (d > 0)
+    has_e = e > 0
+    has_f = f > 0
+    return np.select(
+        [
+            (a_ == 0) & (b_ == 0) & (c_ == 0) & (d == 1) & (e == 0) & (f == 0),
+            (cat1 == 0) & ~has_e & ~has_f,
+            (cat1 >= 3) & (has_e | has_f),
+            has_e & has_f,
+            (cat1 >= 3) | has_e | has_f,
+            cat1 == 2,
+        ],
+        [2, 1, 4, 4, 3, 2],
+        default=1,
+    ).astype(np.int8)
+
+
+def table3_ranks(flags: np.ndarray) -> np.ndarray:
+    """Vectorised max_risk over an (n, condition) boolean matrix"""
+    risk_ranks = rules.RULES["risk_rank"]
+    atom_ranks = np.array(
+        [risk_ranks[rules.risk_level(atom)] for atom in _CONDITION_ATOMS], dtype=np.int8
+    )
+    result = np.where(flags, atom_ranks, 0).max(axis=1, initial=0)
+    result[result == 0] = LABEL_TO_RANK["straightforward"]
+    return result
+
+
+def final_ranks(t1: np.ndarray, t2: np.ndarray, t3: np.ndarray) -> np.ndarray:
+    """Two-of-three rule: the middle rank of the three tables"""
+    return np.sort(np.stack([t1, t2, t3], axis=1), axis=1)[:, 1]
+
+
+def compute_levels_batch(encounters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Compute table levels, the final MDM level and the E/M CPT code for many encounters at once.
+
+    Each encounter carries the structured extraction used by get_cpt_code:
+    problems (code -> count), risk (NM..DMEXT -> value), conditions (code -> yes/no),
+    patientType and an optional visitType {"visit_type", "cpt_code"}. Explicit
+    problemsLevel / dataLevel / riskLevel values (e.g. from Tab_1/2/3) take precedence
+    over the computed table level.
+    """
+    n = len(encounters)
+    problems = np.zeros((n, len(_PROBLEM_CODES)), dtype=np.int32)
+    data = np.zeros((n, len(RISK_KEYS)), dtype=np.int32)
+    flags = np.zeros((n, len(_CONDITION_ATOMS)), dtype=bool)
+    given = np.zeros((n, 3), dtype=np.int8)
+    scalar_t1: Dict[int, int] = {}
+    errors: Dict[int, str] = {}
+
+    problem_index = {code: i for i, code in enumerate(_PROBLEM_CODES)}
+    atom_index = {atom: i for i, atom in enumerate(_CONDITION_ATOMS)}
+
+    for row, enc in enumerate(encounters):
+        try:
+            terms = []
+            for code, count in (enc.get("problems") or {}).items():
+                if int(count) > 0:
+                    terms.append((code.upper(), int(count)))
+            if any(code not in problem_index for code, _ in terms):
+                # unknown codes map to self_limited_minor as separate list entries
+                level = rules.highest_complexity_from_list(
+                    [(PROBLEM_MAP.get(code, "self_limited_minor"), count) for code, count in terms]
+                )
+                scalar_t1[row] = LABEL_TO_RANK.get(level or "straightforward")
+            else:
+                for code, count in terms:
+                    problems[row, problem_index[code]] = count
+
+            risk = {k.upper(): v for k, v in (enc.get("risk") or {}).items()}
+            for col, key in enumerate(RISK_KEYS):
+                if key in risk:
+                    data[row, col] = _risk_value(key, str(risk[key]).lower() if isinstance(risk[key], str) else risk[key])
+
+            for key, val in (enc.get("conditions") or {}).items():
+                if str(val).strip().lower() in _YES:
+                    atom = CONDITION_MAP.get(key.upper().replace("_", ""))
+                    if atom is None:
+                        raise KeyError(f"Unknown condition {key}")
+                    flags[row, atom_index[atom]] = True
+
+            given[row] = [
+                level_rank(enc.get("problemsLevel")),
+                level_rank(enc.get("dataLevel")),
+                level_rank(enc.get("riskLevel")),
+            ]
+        except Exception as e:
+            errors[row] = str(e)
+
+    t1 = table1_ranks(problems)
+    for row, rank in scalar_t1.items():
+        t1[row] = rank
+    t2 = table2_ranks(data)
+    t3 = table3_ranks(flags)
+
+    t1 = np.where(given[:, 0] > 0, given[:, 0], t1)
+    t2 = np.where(given[:, 1] > 0, given[:, 1], t2)
+    t3 = np.where(given[:, 2] > 0, given[:, 2], t3)
+    final = final_ranks(t1, t2, t3)
+
+    established = np.array(
+        [(enc.get("patientType") or "").strip().lower() == "established" for enc in encounters], dtype=bool
+    )
+    labels = np.array([RANK_TO_LABEL[r] for r in range(1, 5)])
+    est_codes = np.array([CPT_MAP["established"][l] for l in labels])
+    new_codes = np.array([CPT_MAP["new"][l] for l in labels])
+    cpt = np.where(established, est_codes[final - 1], new_codes[final - 1])
+
+    results = []
+    for row, enc in enumerate(encounters):
+        result: Dict[str, Optional[str]] = {"encounterId": enc.get("encounterId")}
+        if row in errors:
+            result["error"] = errors[row]
+            results.append(result)
+            continue
+        visit = enc.get("visitType") or {}
+        cpt_code = str(cpt[row])
+        if str(visit.get("visit_type", "")).lower() in VISIT_TYPE_OVERRIDES:
+            cpt_code = visit.get("cpt_code")
+        result.update({
+            "tab1_label": RANK_TO_LABEL[int(t1[row])],
+            "tab2_label": RANK_TO_LABEL[int(t2[row])],
+            "tab3_label": RANK_TO_LABEL[int(t3[row])],
+            "final_level": RANK_TO_LABEL[int(final[row])],
+            "cpt_code": cpt_code,
+        })
+        results.append(result)
+
+    logger.info(f"[MDM-LEVELS-BATCH] encounters={n} errors={len(errors)}")
+    return results
+
+
+def table2_level(values: List[int]) -> str:
+    """Scalar table2 (mo) over the a..g data element values, as in mdm1.table2"""
+    a, _, c, d, e, f, _ = values
+    a_, b_, c_ = min(a, 3), min(c, 2), min(d, 2)
+    cat1 = a_ + b_ + c_ + (1 if d > 0 else 0)
+    if a_ == 0 and b_ == 0 and c_ == 0 and d == 1 and e == 0 and f == 0:
+        return "low"
+    if cat1 == 0 and not e and not f:
+        return "straightforward"
+    if cat1 >= 3 and (e or f):
+        return "high"
+    if e and f:
+        return "high"
+    if cat1 >= 3 or e or f:
+        return "moderate"
+    if cat1 == 2:
+        return "low"
+    return "straightforward"
+
+
+def compute_levels(enc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One encounter through the scalar rule functions (rules.highest_complexity_from_list / max_risk,
+    table2_level); the reference compute_levels_batch is checked against.
+    """
+    result: Dict[str, Any] = {"encounterId": enc.get("encounterId")}
+    try:
+        terms = [
+            (PROBLEM_MAP.get(code.upper(), "self_limited_minor"), int(count))
+            for code, count in (enc.get("problems") or {}).items() if int(count) > 0
+        ]
+        t1 = rules.highest_complexity_from_list(terms) or "straightforward"
+
+        risk = {k.upper(): v for k, v in (enc.get("risk") or {}).items()}
+        t2 = table2_level([
+            _risk_value(key, str(risk[key]).lower() if isinstance(risk[key], str) else risk[key]) if key in risk else 0
+            for key in RISK_KEYS
+        ])
+
+        atoms = []
+        for key, val in (enc.get("conditions") or {}).items():
+            if str(val).strip().lower() in _YES:
+                atom = CONDITION_MAP.get(key.upper().replace("_", ""))
+                if atom is None:
+                    raise KeyError(f"Unknown condition {key}")
+                atoms.append(atom)
+        t3 = rules.max_risk(atoms) or "straightforward"
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    ranks = [
+        level_rank(enc.get(given)) or LABEL_TO_RANK[computed]
+        for given, computed in (("problemsLevel", t1), ("dataLevel", t2), ("riskLevel", t3))
+    ]
+    final = RANK_TO_LABEL[sorted(ranks)[1]]
+    patient_type = "established" if (enc.get("patientType") or "").strip().lower() == "established" else "new"
+    cpt_code = CPT_MAP[patient_type][final]
+    visit = enc.get("visitType") or {}
+    if str(visit.get("visit_type", "")).lower() in VISIT_TYPE_OVERRIDES:
+        cpt_code = visit.get("cpt_code")
+    result.update({
+        "tab1_label": RANK_TO_LABEL[ranks[0]],
+        "tab2_label": RANK_TO_LABEL[ranks[1]],
+        "tab3_label": RANK_TO_LABEL[ranks[2]],
+        "final_level": final,
+        "cpt_code": cpt_code,
+    })
+    return result
@@ -0,0 +1,232 @@
+import os
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from services.mdm.levels import level_rank
+from utils.sections import PAGE_BREAK, is_section_header
+
+logger = logging.getLogger(__name__)
+
+# Table inputs above this many (estimated) tokens are split and processed map-reduce style
+MAPREDUCE_THRESHOLD_TOKENS = int(os.getenv("MDM_MAPREDUCE_THRESHOLD_TOKENS", "24000"))
+# Token budget of a single chunk
+MAPREDUCE_CHUNK_TOKENS = int(os.getenv("MDM_MAPREDUCE_CHUNK_TOKENS", "12000"))
+MAPREDUCE_CONCURRENCY = int(os.getenv("MDM_MAPREDUCE_CONCURRENCY", "4"))
+
+CHARS_PER_TOKEN = 4
+
+LEVEL_LABELS = {1: "Straightforward", 2: "Low", 3: "Moderate", 4: "High"}
+
+_PAGE_MARKER_RE = re.compile(r"^\[Page (\d+)\]$")
+_BLANK_RE = re.compile(r"\n[ \t]*\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def should_map_reduce(text: str, threshold: int = MAPREDUCE_THRESHOLD_TOKENS) -> bool:
+    return threshold > 0 and estimate_tokens(text) > threshold
+
+
+def _mark_pages(text: str) -> str:
+    if PAGE_BREAK not in text:
+        return text
+    pages = text.split(PAGE_BREAK)
+    return "\n\n".join(f"[Page {i}]\n{page.strip()}" for i, page in enumerate(pages, start=1))
+
+
+def _blocks(text: str) -> List[str]:
+    """Paragraphs, with an extra cut before every page marker and section header"""
+    blocks: List[str] = []
+    for para in _BLANK_RE.split(text):
+        current: List[str] = []
+        for line in para.split("\n"):
+            only_marker = len(current) == 1 and _PAGE_MARKER_RE.match(current[0].strip())
+            if current and (_PAGE_MARKER_RE.match(line.strip()) or (is_section_header(line) and not only_marker)):
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append("\n".join(current))
+    return [b for b in blocks if b.strip()]
+
+
+def _fit(block: str, budget: int) -> List[str]:
+    """Split a block larger than the budget at line, then character boundaries"""
+    if len(block) <= budget:
+        return [block]
+    pieces: List[str] = []
+    current = ""
+    for line in block.split("\n"):
+        while len(line) > budget:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:budget])
+            line = line[budget:]
+        if current and len(current) + 1 + len(line) > budget:
+            pieces.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_chunks(text: str, budget_tokens: int = MAPREDUCE_CHUNK_TOKENS) -> List[str]:
+    """
+    Pack page/section/paragraph blocks into chunks of at most `budget_tokens`.
+    Every chunk starts with the [Page N] marker it begins on so PageNo evidence stays correct.
+    """
+    budget = max(budget_tokens * CHARS_PER_TOKEN, 1)
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    page: Optional[str] = None
+    chunk_page: Optional[str] = None
+
+    def flush():
+        nonlocal current, size
+        if current:
+            body = "\n\n".join(current)
+            if chunk_page and not body.startswith("[Page "):
+                body = f"[Page {chunk_page}]\n{body}"
+            chunks.append(body)
+        current, size = [], 0
+
+    for block in _blocks(_mark_pages(text)):
+        marker = _PAGE_MARKER_RE.match(block.split("\n", 1)[0].strip())
+        for piece in _fit(block, budget):
+            if current and size + len(piece) + 2 > budget:
+                flush()
+            if not current:
+                chunk_page = marker.group(1) if marker else page
+            current.append(piece)
+            size += len(piece) + 2
+        if marker:
+            page = marker.group(1)
+    flush()
+    return chunks
+
+
+def _key(value: Any) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", str(value or "").lower()).strip()
+
+
+def _is_yes(value: Any) -> bool:
+    return str(value).strip().lower() in ("yes", "true", "1")
+
+
+def _dedupe(items: List[Dict], field: str) -> List[Dict]:
+    """First occurrence wins; items without a usable key are kept as-is"""
+    seen = set()
+    out = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key = _key(item.get(field))
+        if key:
+            if key in seen:
+                continue
+            seen.add(key)
+        out.append(item)
+    return out
+
+
+def _max_level(levels: List[Any]) -> int:
+    return max((level_rank(l) for l in levels), default=0) or 1
+
+
+def _best_part(parts: List[Dict], level_of) -> Dict:
+    """Part with the highest level; ties go to the earliest chunk"""
+    return max(enumerate(parts), key=lambda p: (level_rank(level_of(p[1])), -p[0]))[1]
+
+
+def merge_tab_1(parts: List[Dict]) -> Dict:
+    """Union of acute/chronic conditions; the level never drops below any chunk's level"""
+    merged: Dict[str, Any] = {"chronic": [], "acute": []}
+    for kind in ("chronic", "acute"):
+        by_key: Dict[str, Dict] = {}
+        for part in parts:
+            for item in part.get(kind) or []:
+                if not isinstance(item, dict):
+                    continue
+                key = _key(item.get("condition")) or f"#{len(by_key)}"
+                if key in by_key:
+                    if _is_yes(item.get("Worsening_condition")) and not _is_yes(by_key[key].get("Worsening_condition")):
+                        by_key[key] = {**by_key[key], **{k: item.get(k) for k in ("Worsening_condition", "Worsening_condition_explain")}}
+                    continue
+                by_key[key] = item
+                merged[kind].append(key)
+        merged[kind] = [by_key[k] for k in merged[kind]]
+
+    level_of = lambda p: (p.get("MDM_Complexity_Level") or {}).get("Level")
+    rank = _max_level([level_of(p) for p in parts])
+    # problems split across chunks: two stable chronic illnesses or a worsening chronic one is Moderate
+    if len(merged["chronic"]) >= 2 or any(_is_yes(c.get("Worsening_condition")) for c in merged["chronic"]):
+        rank = max(rank, 3)
+    best = _best_part(parts, level_of)
+    merged["MDM_Complexity_Level"] = {**(best.get("MDM_Complexity_Level") or {}), "Level": LEVEL_LABELS[rank]}
+    merged["patientType"] = next((p.get("patientType") for p in parts if p.get("patientType")), "")
+    return merged
+
+
+def merge_tab_2(parts: List[Dict]) -> Dict:
+    """Union of data elements with duplicate tests removed; level from the merged counts or the highest chunk"""
+    orders = _dedupe([i for p in parts for i in (p.get("order_analysis") or [])], "item")
+    points = _dedupe([i for p in parts for i in (p.get("qualifying_data_points") or [])], "item")
+
+    categories = [str(p.get("fulfills_criterion", "")) for p in points]
+    cat1 = sum(1 for c in categories if "1" in c)
+    if cat1 >= 2 or any("3" in c or "4" in c for c in categories):
+        computed = 3
+    elif cat1 == 1 or any("2" in c for c in categories):
+        computed = 2
+    else:
+        computed = 1
+
+    level_of = lambda p: p.get("data_level")
+    rank = max(_max_level([level_of(p) for p in parts]), computed)
+    best = _best_part(parts, level_of)
+    lab_orders = sum(
+        1 for o in orders if "lab" in str(o.get("type", "")).lower() and _is_yes(o.get("qualifies_for_mdm"))
+    )
+    counts = [p.get("unique_laboratory_tests_count") for p in parts]
+    return {
+        "order_analysis": orders,
+        "qualifying_data_points": points,
+        "explain": best.get("explain", ""),
+        "explain_data_level": best.get("explain_data_level", ""),
+        "data_level": LEVEL_LABELS[rank],
+        "exactSentence": best.get("exactSentence", ""),
+        "unique_laboratory_tests_count": max([lab_orders] + [c for c in counts if isinstance(c, int)]),
+        "PageNo": best.get("PageNo"),
+    }
+
+
+def merge_tab_3(parts: List[Dict]) -> Dict:
+    """Union of medication actions (one per drug); risk is the maximum over chunks"""
+    drugs = _dedupe([i for p in parts for i in (p.get("risk_analysis") or [])], "drug")
+    level_of = lambda p: p.get("risk_level")
+    best = _best_part(parts, level_of)
+    return {
+        "risk_analysis": drugs,
+        "explain": best.get("explain", ""),
+        "count": len(drugs),
+        "risk_level": LEVEL_LABELS[_max_level([level_of(p) for p in parts])],
+        "exactSentence": best.get("exactSentence", ""),
+        "PageNo": best.get("PageNo"),
+    }
+
+
+MERGERS = {"tab_1": merge_tab_1, "tab_2": merge_tab_2, "tab_3": merge_tab_3}
+
+
+def merge_parts(prompt_name: str, parts: List[Any]) -> Dict:
+    parts = [p for p in parts if isinstance(p, dict)]
+    if not parts:
+        raise ValueError(f"No parsable chunk output for {prompt_name}")
+    return MERGERS[prompt_name](parts)
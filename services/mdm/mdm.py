@@ -2,11 +2,20 @@ import json
 import os
 import re
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 from dotenv import load_dotenv
 from services.mdm.full_output_validater import Tab_1, Tab_2, Tab_3
-from utils.ai import ai_call
+from utils.model_router import routed_call
 from services.mdm.visitprompt import  prompt as visitprompt
+from services.mdm.extraction_store import save_extraction, run_prompt_hash
+from services.mdm.visit_classifier import VISIT_PRECLASSIFIER, preclassify_visit, preclassify_patient_type
+from utils.sections import segment, select_sections
+from services.mdm.mapreduce import MAPREDUCE_CONCURRENCY, should_map_reduce, split_chunks, merge_parts
+from services.mdm.retrieval import MDM_RETRIEVAL, SentenceIndex, evidence_window
+from services.mdm.evidence import verify_evidence
+from services.mdm.output_profile import resolve_profile, profile_prompt, max_tokens_for
+from services.mdm import rules
+from utils.pipeline_metrics import stage_timer
 
 load_dotenv()
 
@@ -14,6 +23,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 async def json_clean(text):
+    return parse_json_block(text)
+
+
+def parse_json_block(text):
     if not isinstance(text, str):
         return text, None
 
@@ -44,18 +57,77 @@ async def json_clean(text):
     return parsed, explain
 
 
+# Table 1 / Table 3 levels from the in-process rule tables (services/mdm/rules.py) over the extracted items
+MDM_RULE_LEVELS = os.getenv("MDM_RULE_LEVELS", "true").lower() == "true"
+_RULE_RANK = rules.RULES["complexity_rank"]
+
+
+def _level_rank(level) -> int:
+    return _RULE_RANK.get(str(level or "").strip().lower().replace(" ", ""), 0)
+
+
 def finallevel_calculator(table1_level, table2_level, table3_level):
+    # two of three: the middle level by rank, not alphabetically
     levels = sorted([
         table1_level.lower(),
         table2_level.lower(),
         table3_level.lower()
-    ])
+    ], key=_level_rank)
     return levels[1]
 
+
+def _yes(value) -> bool:
+    return str(value).strip().lower() in ("yes", "true", "1")
+
+
+def table1_problems(table1: dict) -> List[Tuple[str, int]]:
+    """complexity/3 problem terms for the Tab_1 chronic/acute items; Worsening_condition marks exacerbation"""
+    terms = []
+    for key, stable, worse in (("chronic", "stable_chronic", "chronic_exacerbation"), ("acute", "acute_uncomplicated", "acute_systemic")):
+        items = [i for i in table1.get(key) or [] if isinstance(i, dict)]
+        worsening = sum(_yes(i.get("Worsening_condition")) for i in items)
+        if len(items) - worsening:
+            terms.append((stable, len(items) - worsening))
+        if worsening:
+            terms.append((worse, worsening))
+    return terms
+
+
+def table3_conditions(table3: dict) -> List[str]:
+    """risk_level/2 atoms for the Tab_3 drugs: a managed Rx is prescription drug management, OTC/supplements low risk"""
+    conditions = []
+    for item in table3.get("risk_analysis") or []:
+        if not isinstance(item, dict) or not _yes(item.get("qualifies_for_mdm", "yes")):
+            continue
+        otc = str(item.get("classification", "")).strip().lower() in ("otc", "supplement")
+        atom = "low_risk_of_morbidity" if otc else "prescription_drug_management"
+        if atom not in conditions:
+            conditions.append(atom)
+    return conditions
+
+
+def rule_level(model_level, rule_result) -> str:
+    """
+    The rule-table level, capitalised like the model output. The model's level is kept when the table has no
+    items to evaluate, or when it is "High": the severe exacerbation / toxicity monitoring elements that reach
+    High are not carried by the table schema.
+    """
+    if not MDM_RULE_LEVELS or not rule_result or _level_rank(model_level) == _RULE_RANK["high"]:
+        return model_level
+    return rule_result.capitalize()
+
 def answeroutput(table1, table2, table3):
-    logger.info(f"Table 1 Level : {table1['MDM_Complexity_Level']['Level']}")
+    problems, conditions = table1_problems(table1), table3_conditions(table3)
+    a_level = rule_level(table1["MDM_Complexity_Level"]["Level"], problems and rules.highest_complexity_from_list(problems))
+    c_level = rule_level(table3["risk_level"], conditions and rules.max_risk(conditions))
+    if a_level != table1["MDM_Complexity_Level"]["Level"] or c_level != table3["risk_level"]:
+        logger.info(
+            f"[MDM-RULE-LEVELS] tab_1 model={table1['MDM_Complexity_Level']['Level']} rules={a_level} "
+            f"tab_3 model={table3['risk_level']} rules={c_level}"
+        )
+    logger.info(f"Table 1 Level : {a_level}")
     logger.info(f"Table 2 Level : {table2['data_level']}")
-    logger.info(f"Table 3 Level : {table3['risk_level']}")
+    logger.info(f"Table 3 Level : {c_level}")
 
     acute = table1.get('acute', [])
     chronic = table1.get('chronic', [])
@@ -67,7 +139,7 @@ def answeroutput(table1, table2, table3):
         "patientType": table1.get("patientType", ""),
         "stable chronic illness": len(chronic) if chronic else None,
         "stable acute illness": len(acute) if acute else None,
-        "problemsLevel": table1["MDM_Complexity_Level"].get("Level", "Straightforward"),
+        "problemsLevel": a_level or "Straightforward",
         "stable chronic illness exactSentence": chronic_item.get("exactSentence", ""),
         "stable acute illness exactSentence": acute_item.get("exactSentence", ""),
         "acutepageno": acute_item.get("PageNo"),
@@ -84,7 +156,7 @@ def answeroutput(table1, table2, table3):
     }
 
     table3output = {
-        "riskLevel": table3.get("risk_level", "Straightforward"),
+        "riskLevel": c_level or "Straightforward",
         "Prescription drug management": "yes" if table3.get("risk_analysis") else "no",
         "exactSentence": table3.get("exactSentence", ""),
         "pageno": table3.get("PageNo"),
@@ -102,9 +174,9 @@ def answeroutput(table1, table2, table3):
         "B": table2output,
         "C": table3output,
         "finallevel": finallevel,
-        "A_level": table1["MDM_Complexity_Level"]["Level"],
+        "A_level": a_level,
         "B_level": table2["data_level"],
-        "C_level": table3["risk_level"],
+        "C_level": c_level,
         "table1_explain": table1output["explain"],
         "table2_explain": table2output["explain"],
         "table3_explain": table3output["explain"]
@@ -114,6 +186,7 @@ def tab_a_exact(table):
         "condition": i.get("condition", ""),
         "hyperLink": i.get("exactSentence", ""),
         "pageNumber": str(i.get("PageNo", 0)),
+        "evidenceOffset": i.get("evidenceOffset"),
         "explanation": i.get("explain", "")
     } for i in table]
 True
@@ -123,6 +196,7 @@ def tab_b_exact(table):
         "condition": i.get("item", ""),
         "hyperLink": i.get("evidence_sentence", ""),
         "pageNumber": str(i.get("PageNo", 0)),
+        "evidenceOffset": i.get("evidenceOffset"),
         "explanation": i.get("explain", "")
     } for i in table]
 
@@ -131,6 +205,7 @@ def tab_c_exact(table):
         "condition": i.get("drug", ""),
         "hyperLink": i.get("evidence_sentence", ""),
         "pageNumber": str(i.get("PageNo", 0)),
+        "evidenceOffset": i.get("evidenceOffset"),
         "explanation": i.get("explain", "")
     } for i in table.get("risk_analysis", [])]
 
@@ -249,24 +324,134 @@ def final_return(
     return output
 import asyncio
 
-async def safe_ai_call(text, prompt,timeout=600):
+# Table levels whose boundary cases are re-run on the strong deployment. A result escalates only when its
+# own evidence sits at the cutoff to the next level (see NEAR_CUTOFF); High has no level above it.
+BORDERLINE_LEVELS = {l.strip().lower() for l in os.getenv("MDM_BORDERLINE_LEVELS", "moderate").split(",") if l.strip()}
+
+# Table 3 High elements (intensive toxicity monitoring, hospitalization, DNR, major/emergency surgery, parenteral controlled substances)
+_HIGH_RISK_RE = re.compile(
+    r"(?i)toxicity|intensive\s+monitor|hospitali[sz]|admi(?:t|ssion)|escalat|dnr|do\s+not\s+resuscitate|"
+    r"major\s+surg|emergency\s+surg|parenteral|controlled\s+substance"
+)
+
+
+def _tab1_near_cutoff(table: dict) -> bool:
+    # Moderate -> High: a chronic illness with exacerbation/progression (severe exacerbation is High)
+    return any(str(c.get("Worsening_condition", "")).strip().lower() == "yes" for c in table.get("chronic") or [] if isinstance(c, dict))
+
+
+def _tab2_near_cutoff(table: dict) -> bool:
+    # Moderate -> High: elements already met in two distinct data categories (High needs two of three)
+    categories = {
+        str(p.get("fulfills_criterion", "")).strip().lower()
+        for p in table.get("qualifying_data_points") or [] if isinstance(p, dict) and p.get("fulfills_criterion")
+    }
+    return len(categories) >= 2
+
+
+def _tab3_near_cutoff(table: dict) -> bool:
+    evidence = [table.get("explain", "")] + [
+        f"{r.get('action', '')} {r.get('explain', '')}" for r in table.get("risk_analysis") or [] if isinstance(r, dict)
+    ]
+    return any(_HIGH_RISK_RE.search(str(e)) for e in evidence)
+
+
+NEAR_CUTOFF = {"tab_1": _tab1_near_cutoff, "tab_2": _tab2_near_cutoff, "tab_3": _tab3_near_cutoff}
+
+TABLE_LEVEL = {
+    "tab_1": lambda t: (t.get("MDM_Complexity_Level") or {}).get("Level"),
+    "tab_2": lambda t: t.get("data_level"),
+    "tab_3": lambda t: t.get("risk_level"),
+    "visit": lambda t: t.get("visit_type"),
+}
+
+def route_check(prompt_name: str):
+    """Escalation check for routed_call: schema failure, or a level whose evidence sits at the next cutoff"""
+    level_of = TABLE_LEVEL.get(prompt_name)
+
+    def check(raw):
+        try:
+            parsed, _ = parse_json_block(raw)
+        except ValueError:
+            return "schema"
+        if level_of is None:
+            return None
+        if not isinstance(parsed, dict) or not level_of(parsed):
+            return "schema"
+        near_cutoff = NEAR_CUTOFF.get(prompt_name)
+        if (
+            near_cutoff is not None
+            and str(level_of(parsed)).strip().lower() in BORDERLINE_LEVELS
+            and near_cutoff(parsed)
+        ):
+            return "borderline"
+        return None
+
+    return check
+
+async def safe_ai_call(text, prompt, max_tokens=None, prompt_name="mdm"):
+    # per-attempt timeouts are adaptive (rolling p99 per prompt, see utils/hedging.py)
     try:
-        return await asyncio.wait_for(
-            ai_call(text, prompt),timeout=timeout
-        )
+        return await routed_call(prompt_name, text, prompt, max_tokens, route_check(prompt_name))
     except asyncio.TimeoutError:
         logger.error("QWEN timeout")
         raise
 
-async def output(text: str, trace_id: str) -> dict:
-    logger.info(f"[QWEN]AI for send -> to ai MDM{trace_id}")
-
-    visitType, tab_1_raw, tab_2_raw, tab_3_raw = await asyncio.gather(
-    safe_ai_call(text,visitprompt),
-    safe_ai_call(text, Tab_1),
-    safe_ai_call(text, Tab_2),
-    safe_ai_call(text, Tab_3),
-)
+async def table_call(
+    text: str, sections, prompt_name: str, prompt: str, trace_id: str = "", index=None, profile: str = "full"
+):
+    """
+    One table extraction: a BM25 evidence window when retrieval is confident, otherwise the
+    selected sections, chunked and merged when above the map-reduce threshold
+    """
+    prompt = profile_prompt(prompt, profile)
+    max_tokens = max_tokens_for(prompt_name, profile)
+    window = evidence_window(index, prompt_name) if index is not None else None
+    if window is not None:
+        return await safe_ai_call(window, prompt, max_tokens=max_tokens, prompt_name=prompt_name)
+
+    table_text = select_sections(text, prompt_name, sections)
+    if not should_map_reduce(table_text):
+        return await safe_ai_call(table_text, prompt, max_tokens=max_tokens, prompt_name=prompt_name)
+
+    chunks = split_chunks(table_text)
+    logger.info(f"[MDM-MAPREDUCE] trace={trace_id} prompt={prompt_name} chars={len(table_text)} chunks={len(chunks)}")
+    semaphore = asyncio.Semaphore(MAPREDUCE_CONCURRENCY)
+
+    async def run(chunk):
+        async with semaphore:
+            raw = await safe_ai_call(chunk, prompt, max_tokens=max_tokens, prompt_name=prompt_name)
+        parsed, _ = await json_clean(raw)
+        return parsed
+
+    parts = await asyncio.gather(*(run(chunk) for chunk in chunks))
+    return merge_parts(prompt_name, parts)
+
+async def output(text: str, trace_id: str, patient_id: str = "", sections=None, profile=None) -> dict:
+    profile = resolve_profile(profile)
+    logger.info(f"[QWEN]AI for send -> to ai MDM{trace_id} profile={profile}")
+    sections = sections if sections is not None else segment(text)
+    # one sentence index per chart, shared by the three tables
+    index = SentenceIndex(text, sections) if MDM_RETRIEVAL else None
+
+    visit_pre = preclassify_visit(text) if VISIT_PRECLASSIFIER else None
+    patient_type_pre = preclassify_patient_type(text, sections) if VISIT_PRECLASSIFIER else None
+
+    if visit_pre is None:
+        visitType, tab_1_raw, tab_2_raw, tab_3_raw = await asyncio.gather(
+            safe_ai_call(select_sections(text, "visit", sections), visitprompt, prompt_name="visit"),
+            table_call(text, sections, "tab_1", Tab_1, trace_id, index, profile),
+            table_call(text, sections, "tab_2", Tab_2, trace_id, index, profile),
+            table_call(text, sections, "tab_3", Tab_3, trace_id, index, profile),
+        )
+    else:
+        logger.info(f"[MDM-VISIT-PRECLASSIFIED] trace={trace_id} visit_type={visit_pre['visit_type']}")
+        visitType = visit_pre
+        tab_1_raw, tab_2_raw, tab_3_raw = await asyncio.gather(
+            table_call(text, sections, "tab_1", Tab_1, trace_id, index, profile),
+            table_call(text, sections, "tab_2", Tab_2, trace_id, index, profile),
+            table_call(text, sections, "tab_3", Tab_3, trace_id, index, profile),
+        )
     logger.info(f"[QWEN]AI for Income{trace_id}")
 
     try:
@@ -289,33 +474,53 @@ async def output(text: str, trace_id: str) -> dict:
     except Exception as e:
         logger.exception("visitType JSON parsing failed")
         raise
-    
 
-    intermediate = answeroutput(tab_1_json, tab_2_json, tab_3_json)
-
-    final_output = final_return(
-        intermediate["A"],
-        intermediate["B"],
-        intermediate["C"],
-        intermediate["finallevel"],
-        intermediate["A_level"],
-        intermediate["B_level"],
-        intermediate["C_level"],
-        intermediate["table1_explain"],
-        intermediate["table2_explain"],
-        intermediate["table3_explain"],
-        tab_1_json,
-        tab_2_json,
-        tab_3_json,
-        visitType_json
+    if patient_type_pre and isinstance(tab_1_json, dict):
+        if str(tab_1_json.get("patientType", "")).lower() != patient_type_pre.lower():
+            logger.info(
+                f"[MDM-PATIENT-TYPE-OVERRIDE] trace={trace_id} "
+                f"llm={tab_1_json.get('patientType')} rules={patient_type_pre}"
+            )
+        tab_1_json["patientType"] = patient_type_pre
+
+    with stage_timer("evidence"):
+        evidence_stats = verify_evidence(text, tab_1_json, tab_2_json, tab_3_json)
+    logger.info(f"[MDM-EVIDENCE] trace={trace_id} {evidence_stats}")
+
+    save_extraction(
+        {"visitType": visitType_json, "Tab_1": tab_1_json, "Tab_2": tab_2_json, "Tab_3": tab_3_json, "outputProfile": profile},
+        trace_id=trace_id,
+        patient_id=patient_id,
+        hash_value=run_prompt_hash(profile, visit_pre is not None),
     )
 
+    # deterministic level rules (table levels -> final level -> CPT)
+    with stage_timer("rules"):
+        intermediate = answeroutput(tab_1_json, tab_2_json, tab_3_json)
+
+        final_output = final_return(
+            intermediate["A"],
+            intermediate["B"],
+            intermediate["C"],
+            intermediate["finallevel"],
+            intermediate["A_level"],
+            intermediate["B_level"],
+            intermediate["C_level"],
+            intermediate["table1_explain"],
+            intermediate["table2_explain"],
+            intermediate["table3_explain"],
+            tab_1_json,
+            tab_2_json,
+            tab_3_json,
+            visitType_json
+        )
+
     logger.info(f"MDM full final output for trace_id {trace_id}")
     return final_output
 
-async def get_mdm(text, trace_id: str):
-    return await output(text, trace_id)
+async def get_mdm(text, trace_id: str, patient_id: str = "", sections=None, profile=None):
+    return await output(text, trace_id, patient_id, sections, profile)
 
 
-async def mdm_test(text):
-    return await output(text, trace_id="testing")
+async def mdm_test(text, profile=None):
+    return await output(text, trace_id="testing", profile=profile)
@@ -7,6 +7,8 @@ from dotenv import load_dotenv
 from typing import Dict, List, Tuple, Union, Any
 from services.mdm.mdm_promptfinal import mdm_prompt
 from utils.ai import ai_call_qwen
+from services.mdm import rules
+from services.mdm.rules import PROLOG_MODE
 import logging
 
 load_dotenv()
@@ -209,11 +211,18 @@ async def run_remote_prolog(command: Union[str, Tuple[str, str]]) -> Tuple[bool,
 
 async def table1(problems: List[Tuple[str, int]], file_path: str = FILE_TAB1) -> str:
     print(problems,"massss")
-    with open(file_path, "r") as f:
-        prolog_program = f.read()
     if not problems:
         return "straightforward"
     try:
+        if PROLOG_MODE != "remote":
+            terms = [(PROLOG_PROBLEM_MAP.get(code.upper(), "self_limited_minor"), count) for code, count in problems]
+            out = rules.highest_complexity_from_list(terms)
+            if not out:
+                logger.info("table1 fallback to 'straightforward' (no matching rule). problems=%s", problems)
+                return "straightforward"
+            return out
+        with open(file_path, "r") as f:
+            prolog_program = f.read()
         prolog_terms = []
         for code, count in problems:
             prolog_atom = PROLOG_PROBLEM_MAP.get(code.upper(), "self_limited_minor")
@@ -288,12 +297,18 @@ table_3={
     "IVCONTROLLED": "parenteral_controlled_substances"
 }
 async def table3(conditions: List[str], file_path: str = FILE_TAB3) -> str:
-    with open(file_path, "r") as f:
-        prolog_program = f.read()
     if not conditions:
         return "straightforward"
     conditions = [table_3[key] for key in conditions]
     try:
+        if PROLOG_MODE != "remote":
+            out = rules.max_risk(conditions)
+            if not out:
+                logger.info("table3 fallback to 'straightforward' (no matching rule). conditions=%s", conditions)
+                return "straightforward"
+            return out
+        with open(file_path, "r") as f:
+            prolog_program = f.read()
         prolog_list = "[" + ", ".join(conditions) + "]"
         query = f"max_risk({prolog_list}, Max)."
         command = f"consult('{file_path}'), {query}"
@@ -418,22 +433,18 @@ async def mdm_r(data: Any, trace_id: str) -> Dict[str, Any]:
     result = await get_cpt_code(data, trace_id)
     logger.info(f"MDM mdm_r output for trace_id: {trace_id}: {result}")
     return result
-from services.mdm.mdm_validater import mdm_validator_prompt
+from services.mdm.evidence import enforce_condition_rules, verify_evidence
 
 async def validate_with_ai(chart_text: str, ai_json: dict) -> dict:
-    payload = {
-        "chart": chart_text,
-        "ai_output": ai_json
-    }
-    raw = await ai_call_qwen(str(payload), mdm_validator_prompt)
-    cleaned = await json_clean(raw)
-    return cleaned if isinstance(cleaned, dict) else ai_json
+    # mdm_validator_prompt rules are enforced in code; no second LLM round trip
+    return enforce_condition_rules(ai_json, chart_text)
 from services.mdm.full_output_validater import prompt as full_output_validator_prompt
 
 async def full_output(text: str, trace_id: str) -> dict:
     ai_valid= await ai_call_qwen(text, full_output_validator_prompt)
     ai_valid= await json_clean(ai_valid)
     if isinstance(ai_valid, dict):
+        verify_evidence(text, ai_valid)
         logger.info(f"MDM Full Validated AI output for trace_id: {trace_id}: {ai_valid}")
         return ai_valid
 
@@ -784,9 +795,9 @@ def final_return(output: dict, sec_output: dict) -> str:
 async def output(text: str, trace_id: str) -> dict:
     raw_ai = await ai_call_qwen(text, mdm_prompt)
     raw_ai = await json_clean(raw_ai)
-    #if isinstance(raw_ai, dict):
-        #logger.info(f"MDM Validated AI output for trace_id: {trace_id}: {raw_ai}")
-        #raw_ai = await validate_with_ai(text, raw_ai)
+    if isinstance(raw_ai, dict):
+        raw_ai = await validate_with_ai(text, raw_ai)
+        logger.info(f"MDM Validated AI output for trace_id: {trace_id}: {raw_ai}")
 
     ai = {}
     if isinstance(raw_ai, dict):
@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 from typing import Dict, List, Tuple, Union, Any
 from services.mdm.mdm_promptfinal import mdm_prompt
 from utils.ai import ai_call_qwen
+from services.mdm import rules
+from services.mdm.rules import PROLOG_MODE
 import logging
 
 load_dotenv()
@@ -196,11 +198,18 @@ async def run_remote_prolog(command: Union[str, Tuple[str, str]]) -> Tuple[bool,
 
 async def table1(problems: List[Tuple[str, int]], file_path: str = FILE_TAB1) -> str:
     print(problems,"massss")
-    with open(file_path, "r") as f:
-        prolog_program = f.read()
     if not problems:
         return "straightforward"
     try:
+        if PROLOG_MODE != "remote":
+            terms = [(PROLOG_PROBLEM_MAP.get(code.upper(), "self_limited_minor"), count) for code, count in problems]
+            out = rules.highest_complexity_from_list(terms)
+            if not out:
+                logger.info("table1 fallback to 'straightforward' (no matching rule). problems=%s", problems)
+                return "straightforward"
+            return out
+        with open(file_path, "r") as f:
+            prolog_program = f.read()
         prolog_terms = []
         for code, count in problems:
             prolog_atom = PROLOG_PROBLEM_MAP.get(code.upper(), "self_limited_minor")
@@ -264,12 +273,18 @@ table_3={
     "IVCONTROLLED": "parenteral_controlled_substances"
 }
 async def table3(conditions: List[str], file_path: str = FILE_TAB3) -> str:
-    with open(file_path, "r") as f:
-        prolog_program = f.read()
     if not conditions:
         return "straightforward"
     conditions = [table_3[key] for key in conditions]
     try:
+        if PROLOG_MODE != "remote":
+            out = rules.max_risk(conditions)
+            if not out:
+                logger.info("table3 fallback to 'straightforward' (no matching rule). conditions=%s", conditions)
+                return "straightforward"
+            return out
+        with open(file_path, "r") as f:
+            prolog_program = f.read()
         prolog_list = "[" + ", ".join(conditions) + "]"
         query = f"max_risk({prolog_list}, Max)."
         command = f"consult('{file_path}'), {query}"
@@ -0,0 +1,89 @@
+import os
+import json
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Default output profile for MDM table prompts: "full" (explanations + copied sentences) or "compact"
+MDM_OUTPUT_PROFILE = os.getenv("MDM_OUTPUT_PROFILE", "full").lower()
+PROFILES = ("full", "compact")
+
+# Generation caps for compact responses; "full" leaves max_tokens to the deployment default
+COMPACT_MAX_TOKENS = {
+    "tab_1": int(os.getenv("MDM_COMPACT_MAX_TOKENS_TAB_1", "900")),
+    "tab_2": int(os.getenv("MDM_COMPACT_MAX_TOKENS_TAB_2", "900")),
+    "tab_3": int(os.getenv("MDM_COMPACT_MAX_TOKENS_TAB_3", "700")),
+}
+EXPLAIN_MAX_TOKENS = int(os.getenv("MDM_EXPLAIN_MAX_TOKENS", "1200"))
+
+COMPACT_INSTRUCTIONS = """
+
+COMPACT OUTPUT MODE (overrides the output notes above):
+- Return exactly the same JSON keys and structure, nothing outside the JSON.
+- Every "explain", "Explain", "explain_data_level" and "*_explain" value must be "" (empty string).
+- "exactSentence" / "evidence_sentence" must be the SHORTEST verbatim phrase from the chart (at most 8 words)
+  that locates the evidence; it is expanded to chart offsets after the call. Keep PageNo as instructed.
+- Levels, counts, codes, condition/item/drug names and yes/no flags are unchanged.
+"""
+
+EXPLAIN_PROMPT = """
+You are an E/M MDM auditor. The user message is a JSON extraction of the three MDM tables
+(Tab_1 = problems, Tab_2 = data, Tab_3 = risk) with verbatim evidence phrases and page numbers.
+Write a concise explanation for each table of why its level was assigned, citing the evidence phrases and pages.
+Do not change any level, count or item. Return only JSON:
+{"Tab_1": "", "Tab_2": "", "Tab_3": ""}
+"""
+
+_EXPLAIN_KEYS = {"explain", "explain_data_level", "Explain"}
+
+
+def resolve_profile(profile: Optional[str]) -> str:
+    """Requested profile, falling back to MDM_OUTPUT_PROFILE for unknown/empty values"""
+    profile = (profile or MDM_OUTPUT_PROFILE).lower()
+    return profile if profile in PROFILES else "full"
+
+
+def profile_prompt(prompt: str, profile: str) -> str:
+    return prompt + COMPACT_INSTRUCTIONS if profile == "compact" else prompt
+
+
+def max_tokens_for(prompt_name: str, profile: str) -> Optional[int]:
+    return COMPACT_MAX_TOKENS.get(prompt_name) if profile == "compact" else None
+
+
+def _strip_explains(node: Any) -> Any:
+    if isinstance(node, dict):
+        return {
+            k: _strip_explains(v)
+            for k, v in node.items()
+            if k not in _EXPLAIN_KEYS and not k.endswith("_explain")
+        }
+    if isinstance(node, list):
+        return [_strip_explains(v) for v in node]
+    return node
+
+
+def apply_explanations(extraction: Dict[str, Any], explanations: Dict[str, Any]) -> Dict[str, Any]:
+    """Write lazily generated table explanations into the fields final_return reads"""
+    tab_1 = extraction.get("Tab_1") or {}
+    tab_1.setdefault("MDM_Complexity_Level", {})["Explain"] = explanations.get("Tab_1", "")
+    (extraction.get("Tab_2") or {})["explain"] = explanations.get("Tab_2", "")
+    (extraction.get("Tab_3") or {})["explain"] = explanations.get("Tab_3", "")
+    return extraction
+
+
+async def explain_extraction(extraction: Dict[str, Any], trace_id: str = "") -> Dict[str, Any]:
+    """One small LLM call explaining the three table levels of a (compact) extraction"""
+    from services.mdm.mdm import json_clean, safe_ai_call
+
+    payload = json.dumps(
+        {k: _strip_explains(extraction.get(k) or {}) for k in ("Tab_1", "Tab_2", "Tab_3")},
+        separators=(",", ":"),
+    )
+    raw = await safe_ai_call(payload, EXPLAIN_PROMPT, max_tokens=EXPLAIN_MAX_TOKENS, prompt_name="explain")
+    explanations, _ = await json_clean(raw)
+    if not isinstance(explanations, dict):
+        raise ValueError("Explanation output is not a JSON object")
+    logger.info(f"[MDM-EXPLAIN] trace={trace_id} input_chars={len(payload)}")
+    return explanations
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from services.mdm.extraction_store import load_extractions, list_prompt_hashes
+
+logger = logging.getLogger(__name__)
+
+RESCORE_DIR = os.getenv("MDM_RESCORE_DIR", "data/mdm_rescore")
+
+
+def rescore_extraction(extraction: Dict[str, Any]) -> Dict[str, Any]:
+    """Replay the deterministic stages of mdm.output (answeroutput + final_return) on a stored extraction"""
+    from services.mdm.mdm import answeroutput, final_return
+
+    tab_1_json = extraction["Tab_1"]
+    tab_2_json = extraction["Tab_2"]
+    tab_3_json = extraction["Tab_3"]
+    intermediate = answeroutput(tab_1_json, tab_2_json, tab_3_json)
+    return final_return(
+        intermediate["A"],
+        intermediate["B"],
+        intermediate["C"],
+        intermediate["finallevel"],
+        intermediate["A_level"],
+        intermediate["B_level"],
+        intermediate["C_level"],
+        intermediate["table1_explain"],
+        intermediate["table2_explain"],
+        intermediate["table3_explain"],
+        tab_1_json,
+        tab_2_json,
+        tab_3_json,
+        extraction.get("visitType") or {},
+    )
+
+
+def _rescore_chunk(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # the per-chart INFO logs of answeroutput/final_return would dominate a backfill
+    logging.getLogger("services.mdm.mdm").setLevel(logging.WARNING)
+    out = []
+    for row in rows:
+        try:
+            result = rescore_extraction(row["extraction"])
+            out.append({
+                "patientId": row["patientId"],
+                "traceId": row["traceId"],
+                "promptHash": row["promptHash"],
+                "finalLevel": result.get("finalLevel"),
+                "cptCode": result.get("cptCode"),
+                "patientType": result.get("patientType"),
+                "result": result,
+                "error": None,
+            })
+        except Exception as e:
+            out.append({
+                "patientId": row["patientId"],
+                "traceId": row["traceId"],
+                "promptHash": row["promptHash"],
+                "finalLevel": None,
+                "cptCode": None,
+                "patientType": None,
+                "result": None,
+                "error": str(e),
+            })
+    return out
+
+
+def _write_results(results: List[Dict[str, Any]], path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with duckdb.connect() as conn:
+        conn.execute(
+            "CREATE TEMP TABLE rescore (patient_id VARCHAR, trace_id VARCHAR, prompt_hash VARCHAR, "
+            "final_level VARCHAR, cpt_code VARCHAR, patient_type VARCHAR, result VARCHAR, error VARCHAR)"
+        )
+        conn.executemany(
+            "INSERT INTO rescore VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                [r["patientId"], r["traceId"], r["promptHash"], r["finalLevel"], r["cptCode"],
+                 r["patientType"], json.dumps(r["result"]) if r["result"] is not None else None, r["error"]]
+                for r in results
+            ],
+        )
+        conn.execute(f"COPY rescore TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+
+
+def rescore(
+    hash_value: Optional[str] = None,
+    since: Optional[float] = None,
+    workers: int = 0,
+    chunk_size: int = 500,
+    output: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Re-score stored extractions without any LLM call.
+
+    workers=0 runs inline; larger backfills fan the rows out over a process pool
+    in chunks of `chunk_size`. Results are written to `output` (Parquet) when given.
+    """
+    start = time.time()
+    rows = load_extractions(hash_value, since)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+    results: List[Dict[str, Any]] = []
+    if workers and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk_result in pool.map(_rescore_chunk, chunks):
+                results.extend(chunk_result)
+    else:
+        for chunk in chunks:
+            results.extend(_rescore_chunk(chunk))
+
+    if output:
+        _write_results(results, output)
+
+    summary = {
+        "promptHash": hash_value,
+        "rows": len(rows),
+        "errors": sum(1 for r in results if r["error"]),
+        "durationSeconds": round(time.time() - start, 3),
+        "output": output,
+    }
+    logger.info(f"[MDM-RESCORE-DONE] {summary}")
+    return {"summary": summary, "results": results}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    parser = argparse.ArgumentParser(description="Re-score stored MDM extractions without LLM calls")
+    parser.add_argument("--prompt-hash", help="only rescore extractions produced by this prompt hash")
+    parser.add_argument("--since", type=float, help="only rescore extractions created after this epoch time")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="process pool size (0 = inline)")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--output", default=os.path.join(RESCORE_DIR, f"rescore-{int(time.time())}.parquet"))
+    parser.add_argument("--list", action="store_true", help="list stored prompt hashes and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print(json.dumps(list_prompt_hashes(), indent=2))
+    else:
+        res = rescore(args.prompt_hash, args.since, args.workers, args.chunk_size, args.output)
+        print(json.dumps(res["summary"], indent=2))
@@ -0,0 +1,179 @@
+import os
+import re
+import math
+import bisect
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.sections import PAGE_BREAK, segment, record_section_bytes
+
+logger = logging.getLogger(__name__)
+
+MDM_RETRIEVAL = os.getenv("MDM_RETRIEVAL", "true").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("MDM_RETRIEVAL_TOP_K", "40"))
+# sentences kept on each side of a hit
+RETRIEVAL_CONTEXT = int(os.getenv("MDM_RETRIEVAL_CONTEXT", "1"))
+# charts shorter than this are cheap enough to send whole
+RETRIEVAL_MIN_CHARS = int(os.getenv("MDM_RETRIEVAL_MIN_CHARS", "6000"))
+# a window larger than this share of the chart saves too little to risk recall; send the chart instead
+RETRIEVAL_MAX_RATIO = float(os.getenv("MDM_RETRIEVAL_MAX_RATIO", "0.6"))
+# hits scoring below this share of the best hit are treated as noise
+RETRIEVAL_MIN_SCORE_RATIO = float(os.getenv("MDM_RETRIEVAL_MIN_SCORE_RATIO", "0.25"))
+HEADER_CHARS = 800
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Query vocabulary per MDM table
+TABLE_QUERIES = {
+    "tab_1": [
+        "assessment", "impression", "diagnosis", "diagnoses", "acute", "chronic", "stable", "worsening",
+        "exacerbation", "uncontrolled", "controlled", "progression", "flare", "severe", "complicated",
+        "pain", "infection", "hypertension", "diabetes", "disorder", "disease", "syndrome", "injury",
+        "follow", "problem", "condition",
+    ],
+    "tab_2": [
+        "order", "ordered", "orders", "lab", "labs", "laboratory", "test", "tests", "result", "results",
+        "reviewed", "review", "cbc", "cmp", "bmp", "a1c", "hba1c", "lipid", "tsh", "urinalysis", "ua",
+        "xray", "x", "ray", "mri", "ct", "ultrasound", "ekg", "ecg", "echo", "culture", "panel", "inr",
+        "psa", "imaging", "radiology", "external", "records", "notes", "interpretation", "historian",
+        "discussed", "consult", "referral",
+    ],
+    "tab_3": [
+        "medication", "medications", "mg", "mcg", "tablet", "tab", "capsule", "prescribed", "prescription",
+        "rx", "refill", "start", "started", "increase", "increased", "decrease", "decreased", "discontinue",
+        "discontinued", "stop", "dose", "daily", "bid", "tid", "prn", "injection", "iv", "surgery",
+        "procedure", "hospital", "admit", "admission", "monitoring", "otc", "therapy",
+    ],
+}
+
+# Sentences matching these (or inside these sections) are always kept: the recall safety net
+TABLE_ANCHORS = {
+    # ICD-10 codes, plus the E/M CPT lines patientType is read from
+    "tab_1": (
+        re.compile(r"\b[A-TV-Z]\d{2}(?:\.\d{1,4})?\b|\b99\d{3}\b|(?i:\bcpt\b|\bprocedure)"),
+        {"assessment", "procedures"},
+    ),
+    "tab_2": (
+        re.compile(
+            r"(?i)\b(?:cbc|cmp|bmp|a1c|hba1c|lipid|tsh|urinalysis|x-?ray|mri|ct|ultrasound|ekg|ecg|echo|culture|inr|psa)\b"
+        ),
+        {"orders", "results"},
+    ),
+    "tab_3": (
+        re.compile(r"(?i)\b\d+(?:\.\d+)?\s*(?:mg|mcg|ml|units?|iu)\b|\b(?:rx|prescri\w*|refill\w*)\b"),
+        {"medications"},
+    ),
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# sentence ends after a word, not after list numbering ("1. Hypertension")
+_SENTENCE_RE = re.compile(r"(?<=[A-Za-z)][.!?])\s+(?=[A-Z0-9])")
+
+
+class SentenceIndex:
+    """In-memory BM25 index over the sentences of one chart"""
+
+    def __init__(self, text: str, sections: Optional[List[Dict]] = None):
+        self.text = text
+        self.sections = sections if sections is not None else segment(text)
+        self.sentences: List[Dict] = []
+        self._split()
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for i, sentence in enumerate(self.sentences):
+            counts = Counter(_TOKEN_RE.findall(sentence["text"].lower()))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        self.doc_len = np.array(lengths, dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if len(lengths) else 0.0
+        self.postings = {t: (np.array(ids), np.array(tfs, dtype=np.float32)) for t, (ids, tfs) in postings.items()}
+
+    def _split(self) -> None:
+        starts = [s["start"] for s in self.sections]
+        cursor = 0
+        for page_no, page in enumerate(self.text.split(PAGE_BREAK), start=1):
+            for line in page.split("\n"):
+                for piece in _SENTENCE_RE.split(line):
+                    stripped = piece.strip()
+                    if not stripped:
+                        continue
+                    pos = self.text.find(stripped, cursor)
+                    cursor = pos + len(stripped)
+                    section = self.sections[bisect.bisect_right(starts, pos) - 1]["name"] if starts else ""
+                    self.sentences.append({"text": stripped, "page": page_no, "section": section, "start": pos})
+
+    def search(self, terms: List[str]) -> np.ndarray:
+        """BM25 score of every sentence for the query terms"""
+        n = len(self.sentences)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / max(self.avg_len, 1e-6))
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            idf = math.log((n - len(ids) + 0.5) / (len(ids) + 0.5) + 1)
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[ids])
+        return scores
+
+
+def evidence_window(index: SentenceIndex, prompt_name: str) -> Optional[str]:
+    """
+    Header + top-k sentences (with neighbours and anchor sentences) for one table,
+    or None when the full-chart path should be used instead.
+    """
+    text = index.text
+    if not MDM_RETRIEVAL or prompt_name not in TABLE_QUERIES or len(text) < RETRIEVAL_MIN_CHARS:
+        return None
+
+    scores = index.search(TABLE_QUERIES[prompt_name])
+    floor = max(float(scores.max(initial=0)) * RETRIEVAL_MIN_SCORE_RATIO, 1e-6)
+    hits = [int(i) for i in np.argsort(-scores, kind="stable")[:RETRIEVAL_TOP_K] if scores[i] >= floor]
+    if not hits:
+        logger.info(f"[MDM-RETRIEVAL-FALLBACK] prompt={prompt_name} reason=no_hits")
+        return None
+
+    keep = set()
+    for i in hits:
+        keep.update(range(max(i - RETRIEVAL_CONTEXT, 0), min(i + RETRIEVAL_CONTEXT + 1, len(index.sentences))))
+    anchor_re, anchor_sections = TABLE_ANCHORS[prompt_name]
+    for i, sentence in enumerate(index.sentences):
+        if sentence["section"] in anchor_sections or anchor_re.search(sentence["text"]):
+            keep.add(i)
+
+    lines = []
+    previous = None
+    for i in sorted(keep):
+        if previous is not None and i != previous + 1:
+            lines.append("...")
+        sentence = index.sentences[i]
+        lines.append(f"[Page {sentence['page']} | {sentence['section']}] {sentence['text']}")
+        previous = i
+
+    preamble = next((s for s in index.sections if s["name"] == "preamble"), None)
+    header = text[:preamble["end"]][:HEADER_CHARS].replace(PAGE_BREAK, "\n").strip() if preamble else ""
+    window = (
+        f"CHART HEADER:\n{header}\n\n"
+        "RETRIEVED EVIDENCE (verbatim chart sentences in document order, prefixed with page and section; "
+        "\"...\" marks omitted text):\n" + "\n".join(lines)
+    )
+
+    if len(window) > RETRIEVAL_MAX_RATIO * len(text):
+        logger.info(f"[MDM-RETRIEVAL-FALLBACK] prompt={prompt_name} reason=window_too_large chars={len(window)}/{len(text)}")
+        return None
+
+    record_section_bytes(f"{prompt_name}_bm25", len(text.encode("utf-8")), len(window.encode("utf-8")))
+    logger.info(
+        f"[MDM-RETRIEVAL] prompt={prompt_name} sentences={len(keep)}/{len(index.sentences)} "
+        f"chars={len(window)}/{len(text)}"
+    )
+    return window
@@ -0,0 +1,370 @@
+import os
+import re
+import sys
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FILE_TAB1 = os.getenv("FILE_TAB1", os.path.join(BASE_DIR, "tables", "table1.pl"))
+FILE_TAB2 = os.getenv("FILE_TAB2", os.path.join(BASE_DIR, "tables", "table2.pl"))
+FILE_TAB3 = os.getenv("FILE_TAB3", os.path.join(BASE_DIR, "tables", "table3.pl"))
+
+# "local" evaluates the compiled tables in-process, "remote" keeps the PROLOG_API_URL round trip
+PROLOG_MODE = os.getenv("PROLOG_MODE", "local").lower()
+
+_COMPARISONS = {
+    "=:=": lambda a, b: a == b,
+    "=\\=": lambda a, b: a != b,
+    "=<": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+}
+_COMPARISON_RE = re.compile(r"^(.+?)\s*(=:=|=\\=|=<|>=|<|>)\s*(.+)$")
+_IS_RE = re.compile(r"^([A-Z_][A-Za-z0-9_]*)\s+is\s+(.+)$")
+_HEAD_RE = re.compile(r"^([a-z][A-Za-z0-9_]*)\s*\((.*)\)$", re.DOTALL)
+
+
+# ---------------------------
+# Prolog source parsing
+# ---------------------------
+def _strip_comments(source: str) -> str:
+    lines = []
+    for line in source.splitlines():
+        in_str = False
+        for i, ch in enumerate(line):
+            if ch in "\"'":
+                in_str = not in_str
+            elif ch == "%" and not in_str:
+                line = line[:i]
+                break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _split_top(text: str, sep: str) -> List[str]:
+    """Split on `sep` outside of parentheses, brackets and quotes"""
+    parts, depth, in_str, buf = [], 0, None, []
+    for ch in text:
+        if in_str:
+            buf.append(ch)
+            if ch == in_str:
+                in_str = None
+            continue
+        if ch in "\"'":
+            in_str = ch
+        elif ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append("".join(buf).strip())
+            buf = []
+            continue
+        buf.append(ch)
+    if "".join(buf).strip():
+        parts.append("".join(buf).strip())
+    return parts
+
+
+def _split_clauses(source: str) -> List[str]:
+    clauses, depth, in_str, buf = [], 0, None, []
+    text = _strip_comments(source)
+    for i, ch in enumerate(text):
+        buf.append(ch)
+        if in_str:
+            if ch == in_str:
+                in_str = None
+            continue
+        if ch in "\"'":
+            in_str = ch
+        elif ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        elif ch == "." and depth == 0 and (i + 1 == len(text) or text[i + 1].isspace()):
+            clause = "".join(buf)[:-1].strip()
+            if clause:
+                clauses.append(clause)
+            buf = []
+    return clauses
+
+
+def _parse_term(token: str) -> Tuple[str, Any]:
+    token = token.strip()
+    if re.fullmatch(r"-?\d+", token):
+        return ("num", int(token))
+    if len(token) >= 2 and token[0] == token[-1] and token[0] in "\"'":
+        # quoted atoms and strings compare by their text, like the service answers
+        return ("atom", token[1:-1])
+    if re.fullmatch(r"[A-Z_][A-Za-z0-9_]*", token):
+        return ("var", token)
+    return ("atom", token)
+
+
+def _compile_expr(expr: str) -> Callable[[Dict[str, int]], int]:
+    """Compile an integer expression made of +, -, *, numbers and bound variables"""
+    tokens = re.findall(r"\d+|[A-Za-z_][A-Za-z0-9_]*|[-+*()]", expr)
+
+    def parse_sum(pos):
+        node, pos = parse_product(pos)
+        while pos < len(tokens) and tokens[pos] in "+-":
+            op = tokens[pos]
+            rhs, pos = parse_product(pos + 1)
+            node = (lambda l, r: lambda env: l(env) + r(env))(node, rhs) if op == "+" \
+                else (lambda l, r: lambda env: l(env) - r(env))(node, rhs)
+        return node, pos
+
+    def parse_product(pos):
+        node, pos = parse_atom(pos)
+        while pos < len(tokens) and tokens[pos] == "*":
+            rhs, pos = parse_atom(pos + 1)
+            node = (lambda l, r: lambda env: l(env) * r(env))(node, rhs)
+        return node, pos
+
+    def parse_atom(pos):
+        tok = tokens[pos]
+        if tok == "(":
+            node, pos = parse_sum(pos + 1)
+            return node, pos + 1
+        if tok.isdigit():
+            return (lambda v: lambda env: v)(int(tok)), pos + 1
+        return (lambda name: lambda env: env[name])(tok), pos + 1
+
+    node, pos = parse_sum(0)
+    if pos != len(tokens):
+        raise ValueError(f"Unsupported arithmetic expression: {expr}")
+    return node
+
+
+def _compile_goal(goal: str) -> Callable[[Dict[str, int]], bool]:
+    goal = goal.strip()
+    if goal.startswith("(") and goal.endswith(")"):
+        branches = [_compile_conjunction(b) for b in _split_top(goal[1:-1], ";")]
+        return lambda env: any(branch(dict(env)) for branch in branches)
+
+    is_match = _IS_RE.match(goal)
+    if is_match:
+        name, expr = is_match.group(1), _compile_expr(is_match.group(2))
+
+        def bind(env):
+            env[name] = expr(env)
+            return True
+        return bind
+
+    cmp_match = _COMPARISON_RE.match(goal)
+    if cmp_match:
+        lhs, op, rhs = _compile_expr(cmp_match.group(1)), cmp_match.group(2), _compile_expr(cmp_match.group(3))
+        compare = _COMPARISONS[op]
+        return lambda env: compare(lhs(env), rhs(env))
+
+    raise ValueError(f"Unsupported goal in rule table: {goal}")
+
+
+def _compile_conjunction(body: str) -> Callable[[Dict[str, int]], bool]:
+    goals = [_compile_goal(g) for g in _split_top(body, ",")]
+    return lambda env: all(goal(env) for goal in goals)
+
+
+def parse_program(source: str, predicates: Tuple[str, ...]) -> Dict[str, List[Tuple[List[Tuple[str, Any]], Optional[Callable]]]]:
+    """Compile the facts and guarded clauses of the requested predicates"""
+    compiled: Dict[str, List] = {}
+    for clause in _split_clauses(source):
+        head, _, body = clause.partition(":-")
+        match = _HEAD_RE.match(head.strip())
+        if not match:
+            continue
+        args = _split_top(match.group(2), ",")
+        key = f"{match.group(1)}/{len(args)}"
+        if key not in predicates:
+            continue
+        guard = _compile_conjunction(body) if body.strip() else None
+        compiled.setdefault(key, []).append(([_parse_term(a) for a in args], guard))
+    return compiled
+
+
+def solve(clauses, *args) -> Optional[Dict[str, Any]]:
+    """First solution of a compiled predicate; pass None for output arguments"""
+    for head, guard in clauses:
+        env: Dict[str, Any] = {}
+        outputs: Dict[int, Tuple[str, Any]] = {}
+        ok = True
+        for pos, ((kind, value), arg) in enumerate(zip(head, args)):
+            if kind == "var":
+                if arg is None:
+                    outputs[pos] = (kind, value)
+                elif value in env and env[value] != arg:
+                    ok = False
+                    break
+                else:
+                    env[value] = arg
+            elif arg is None:
+                outputs[pos] = (kind, value)
+            elif arg != value:
+                ok = False
+                break
+        if not ok or (guard is not None and not guard(env)):
+            continue
+        return {pos: env.get(value) if kind == "var" else value for pos, (kind, value) in outputs.items()}
+    return None
+
+
+# ---------------------------
+# Compiled tables
+# ---------------------------
+def load_rules(tab1: str = FILE_TAB1, tab2: str = FILE_TAB2, tab3: str = FILE_TAB3) -> Dict[str, Any]:
+    with open(tab1, "r") as f:
+        t1 = parse_program(f.read(), ("complexity/3", "complexity_rank/2"))
+    with open(tab2, "r") as f:
+        t2 = parse_program(f.read(), ("mo/7",))
+    with open(tab3, "r") as f:
+        t3 = parse_program(f.read(), ("risk_level/2", "risk_rank/2"))
+
+    complexity: Dict[str, List] = {}
+    for head, guard in t1.get("complexity/3", []):
+        complexity.setdefault(head[0][1], []).append((head, guard))
+
+    return {
+        "complexity": complexity,
+        "complexity_rank": {h[0][1]: h[1][1] for h, _ in t1.get("complexity_rank/2", [])},
+        "mo": t2.get("mo/7", []),
+        "risk_level": {h[0][1]: h[1][1] for h, _ in t3.get("risk_level/2", [])},
+        "risk_rank": {h[0][1]: h[1][1] for h, _ in t3.get("risk_rank/2", [])},
+    }
+
+
+RULES = load_rules()
+logger.info(
+    f"[MDM-RULES-LOADED] problem_types={len(RULES['complexity'])} "
+    f"risk_atoms={len(RULES['risk_level'])} mo_clauses={len(RULES['mo'])}"
+)
+
+
+def complexity(problem_type: str, count: int) -> Optional[str]:
+    """complexity/3 — level for `count` problems of one type, None when no clause applies"""
+    clauses = RULES["complexity"].get(problem_type)
+    if not clauses:
+        return None
+    solution = solve(clauses, problem_type, count, None)
+    return solution[2] if solution else None
+
+
+def highest_complexity_from_list(problems: List[Tuple[str, int]]) -> Optional[str]:
+    """highest_complexity_from_list/2 — None mirrors a failed Prolog query"""
+    if not problems:
+        return "straightforward"
+    ranks = RULES["complexity_rank"]
+    best = None
+    for problem_type, count in problems:
+        level = complexity(problem_type, count)
+        if level is None:
+            return None
+        # max_complexity/2 keeps the earlier level on ties
+        if best is None or ranks[level] > ranks[best]:
+            best = level
+    return best
+
+
+def risk_level(condition: str) -> Optional[str]:
+    """risk_level/2"""
+    return RULES["risk_level"].get(condition)
+
+
+def max_risk(conditions: List[str]) -> Optional[str]:
+    """max_risk/2 — None mirrors a failed Prolog query"""
+    ranks = RULES["risk_rank"]
+    best = "straightforward"
+    for condition in reversed(conditions):
+        level = risk_level(condition)
+        if level is None:
+            return None
+        if ranks[level] >= ranks[best]:
+            best = level
+    return best
+
+
+def mo(a: int, b: int, c: int, d: int, e: int, f: int) -> Optional[str]:
+    """mo/7 from table2.pl — result string of the first matching clause"""
+    solution = solve(RULES["mo"], a, b, c, d, e, f, None)
+    return solution[6] if solution else None
+
+
+# ---------------------------
+# Differential check against the Prolog service
+# ---------------------------
+def _remote_query(url: str, program: str, query: str) -> Optional[str]:
+    import requests
+
+    r = requests.post(url, json={"program": program, "query": query}, timeout=60)
+    r.raise_for_status()
+    results = r.json().get("results") or []
+    if not results:
+        return None
+    first = results[0]
+    if isinstance(first, dict):
+        first = next(iter(first.values()), None)
+    return str(first).strip().lower() if first is not None else None
+
+
+def verify_against_remote(url: Optional[str] = None) -> List[dict]:
+    """Run the local tables and PROLOG_API_URL over the same queries and return mismatches"""
+    url = url or os.getenv("PROLOG_API_URL")
+    if not url:
+        raise ValueError("PROLOG_API_URL is not configured")
+
+    with open(FILE_TAB1, "r") as f:
+        program1 = f.read()
+    with open(FILE_TAB2, "r") as f:
+        program2 = f.read()
+    with open(FILE_TAB3, "r") as f:
+        program3 = f.read()
+
+    cases = []
+    types = sorted(RULES["complexity"])
+    for t in types:
+        for n in (1, 2, 3):
+            cases.append(("table1", [(t, n)]))
+    for i, t1 in enumerate(types):
+        for t2 in types[i + 1:]:
+            cases.append(("table1", [(t1, 1), (t2, 2)]))
+
+    atoms = sorted(RULES["risk_level"])
+    cases.append(("table3", []))
+    for a in atoms:
+        cases.append(("table3", [a]))
+    for i, a1 in enumerate(atoms):
+        for a2 in atoms[i + 1:]:
+            cases.append(("table3", [a1, a2]))
+
+    for values in ((0, 0, 0, 0, 0, 0), (1, 0, 0, 0, 0, 0), (1, 1, 0, 0, 0, 0), (1, 1, 1, 0, 0, 0),
+                   (0, 0, 0, 1, 0, 0), (0, 0, 0, 0, 1, 0), (1, 1, 1, 0, 1, 0), (0, 0, 0, 0, 1, 1),
+                   (1, 1, 0, 0, 1, 1), (2, 0, 0, 1, 0, 1)):
+        cases.append(("mo", values))
+
+    mismatches = []
+    for table, arg in cases:
+        if table == "table1":
+            terms = ", ".join(f"('{t}', {n})" for t, n in arg)
+            remote = _remote_query(url, program1, f"highest_complexity_from_list([{terms}], Max).")
+            local = highest_complexity_from_list(arg)
+        elif table == "table3":
+            remote = _remote_query(url, program3, f"max_risk([{', '.join(arg)}], Max).")
+            local = max_risk(arg)
+        else:
+            remote = _remote_query(url, program2, f"mo({', '.join(map(str, arg))}, Result).")
+            local = mo(*arg)
+        local = local.lower() if local else None
+        if local != remote:
+            mismatches.append({"table": table, "args": arg, "local": local, "remote": remote})
+    logger.info(f"[MDM-RULES-VERIFY] cases={len(cases)} mismatches={len(mismatches)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    diff = verify_against_remote(sys.argv[1] if len(sys.argv) > 1 else None)
+    for m in diff:
+        logger.error(f"[MDM-RULES-MISMATCH] {m}")
+    sys.exit(1 if diff else 0)
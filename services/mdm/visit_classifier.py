@@ -0,0 +1,111 @@
+import os
+import re
+import logging
+from typing import Dict, List, Optional, Set
+
+from utils.metrics import preclassifier_decisions_total
+from utils.sections import segment
+
+logger = logging.getLogger(__name__)
+
+VISIT_PRECLASSIFIER = os.getenv("VISIT_PRECLASSIFIER", "true").lower() == "true"
+
+OFFICE_NEW = {str(c) for c in range(99202, 99206)}
+OFFICE_EST = {str(c) for c in range(99211, 99216)}
+PREVENTIVE_NEW = {str(c) for c in range(99381, 99388)}
+PREVENTIVE_EST = {str(c) for c in range(99391, 99398)}
+
+# 99xxx codes, skipping ZIP codes ("WA 99208", "99208-1234")
+_CPT_RE = re.compile(r"(?<![^A-Za-z][A-Z]{2} )(?<!\d)(99\d{3})(?![\d-])")
+# a code only counts as a CPT when its line reads like a procedure/visit entry
+_CPT_CONTEXT_RE = re.compile(
+    r"CPT|PROCEDURE|OFFICE|VISIT|\bEST\b|\bNEW\b|ESTABLISHED|PATIENT|PREVENT|E\s*[/&]\s*M|EVAL|EXAM|PHYSICAL|LEVEL|\bPAT\b",
+    re.IGNORECASE,
+)
+_Z00_RE = re.compile(r"\bZ00(?:\.\d{1,3})?\b", re.IGNORECASE)
+_Z23_RE = re.compile(r"\bZ23\b", re.IGNORECASE)
+_EST_PAT_RE = re.compile(r"\bEST(?:ABLISHED)?\.?\s+PAT(?:IENT)?\b", re.IGNORECASE)
+_NEW_PAT_RE = re.compile(r"\bNEW\s+PAT(?:IENT)?\b", re.IGNORECASE)
+_AGE_RE = re.compile(
+    r"\bAge\s*[:\-]?\s*(\d{1,3})\b|\b(\d{1,3})\s*(?:y/?o\b|y\.o\.|-?years?[\s-]old\b|-?year-old\b)",
+    re.IGNORECASE,
+)
+
+
+def _cpt_codes(text: str) -> Set[str]:
+    codes = set()
+    for line in text.splitlines():
+        if "99" not in line or not _CPT_CONTEXT_RE.search(line):
+            continue
+        codes.update(_CPT_RE.findall(line))
+    return codes
+
+
+def _age(text: str) -> str:
+    match = _AGE_RE.search(text)
+    if not match:
+        return ""
+    return match.group(1) or match.group(2) or ""
+
+
+def preclassify_visit(text: str) -> Optional[Dict[str, str]]:
+    """
+    Visit type from unambiguous CPT/ICD evidence, following the visitprompt hierarchy.
+    Returns the visitprompt JSON shape, or None when the LLM has to decide.
+    """
+    codes = _cpt_codes(text)
+    preventive = codes & (PREVENTIVE_NEW | PREVENTIVE_EST)
+    office = codes & (OFFICE_NEW | OFFICE_EST)
+    has_z00 = bool(_Z00_RE.search(text))
+    has_z23 = bool(_Z23_RE.search(text))
+
+    result = None
+    if preventive:
+        if len(preventive) == 1:
+            result = {"visit_type": "Preventive", "cpt_code": next(iter(preventive))}
+    elif has_z00:
+        # Z00 + Z23 without any E&M code may be a vaccine-only (Facility) visit
+        if not office and not has_z23:
+            result = {"visit_type": "Preventive", "cpt_code": ""}
+    elif office and not has_z23 and len(office) == 1:
+        result = {"visit_type": "Office", "cpt_code": next(iter(office))}
+
+    preclassifier_decisions_total.labels(
+        classifier="visit_type", outcome="decided" if result else "undecided"
+    ).inc()
+    if result is None:
+        logger.info(
+            f"[VISIT-PRECLASSIFY-UNDECIDED] preventive={sorted(preventive)} office={sorted(office)} "
+            f"z00={has_z00} z23={has_z23}"
+        )
+        return None
+
+    result["age"] = _age(text)
+    logger.info(f"[VISIT-PRECLASSIFY-DECIDED] visit_type={result['visit_type']} cpt_code={result['cpt_code']}")
+    return {"visit_type": result["visit_type"], "age": result["age"], "cpt_code": result["cpt_code"]}
+
+
+def _procedures_text(text: str, sections: Optional[List[Dict]] = None) -> str:
+    sections = sections if sections is not None else segment(text)
+    return "\n".join(text[s["start"]:s["end"]] for s in sections if s["name"] == "procedures")
+
+
+def preclassify_patient_type(text: str, sections: Optional[List[Dict]] = None) -> Optional[str]:
+    """
+    "Established" / "New" from the procedures/CPT section only, when it holds exactly one E/M code (or, with
+    no code, exactly one EST PAT / NEW PAT label) and nothing there points the other way; else None.
+    History and boilerplate elsewhere in the chart never decide the patient type.
+    """
+    procedures = _procedures_text(text, sections)
+    codes = set(_CPT_RE.findall(procedures)) & (OFFICE_EST | OFFICE_NEW | PREVENTIVE_EST | PREVENTIVE_NEW)
+    labels = ["Established"] * len(_EST_PAT_RE.findall(procedures)) + ["New"] * len(_NEW_PAT_RE.findall(procedures))
+    hits = ["Established" if c in OFFICE_EST | PREVENTIVE_EST else "New" for c in codes] + labels
+
+    result = None
+    if len(set(hits)) == 1 and (len(codes) == 1 or (not codes and len(labels) == 1)):
+        result = hits[0]
+
+    preclassifier_decisions_total.labels(
+        classifier="patient_type", outcome="decided" if result else "undecided"
+    ).inc()
+    return result
@@ -0,0 +1,56 @@
+import random
+
+from services.mdm.levels import (
+    CONDITION_MAP,
+    PROBLEM_MAP,
+    RISK_KEYS,
+    compute_levels,
+    compute_levels_batch,
+)
+
+LEVELS = ["Straightforward", "Low", "Moderate", "High", None, ""]
+VISIT_TYPES = ["Office", "Preventive", "Emergency", "Telehealth", ""]
+
+
+def _random_encounter(rng: random.Random, i: int) -> dict:
+    codes = list(PROBLEM_MAP) + ["XYZ"]
+    conditions = list(CONDITION_MAP) + (["BOGUS"] if rng.random() < 0.02 else [])
+    return {
+        "encounterId": f"enc-{i}",
+        "problems": {c: rng.choice([0, 0, 1, 2, 3]) for c in rng.sample(codes, rng.randint(0, 4))},
+        "risk": {
+            k: rng.choice(["yes", "no", 0, 1, 2, 3, "2"]) if k not in ("NM",) else rng.choice(["yes", "no"])
+            for k in rng.sample(RISK_KEYS, rng.randint(0, len(RISK_KEYS)))
+        },
+        "conditions": {c: rng.choice(["yes", "no", "no"]) for c in rng.sample(conditions, rng.randint(0, 3))},
+        "patientType": rng.choice(["Established", "New", ""]),
+        "problemsLevel": rng.choice(LEVELS + [None] * 6),
+        "dataLevel": rng.choice(LEVELS + [None] * 6),
+        "riskLevel": rng.choice(LEVELS + [None] * 6),
+        "visitType": {"visit_type": rng.choice(VISIT_TYPES), "cpt_code": "99395"},
+    }
+
+
+def test_batch_matches_scalar_reference():
+    rng = random.Random(27)
+    encounters = [_random_encounter(rng, i) for i in range(3000)]
+    assert compute_levels_batch(encounters) == [compute_levels(enc) for enc in encounters]
+
+
+def test_two_stable_chronic_with_rx_is_moderate():
+    [result] = compute_levels_batch([{
+        "problems": {"SCI": 2},
+        "risk": {"RTEST": 1},
+        "conditions": {"RX_MGMT": "yes"},
+        "patientType": "Established",
+    }])
+    assert result["tab1_label"] == "moderate"
+    assert result["tab3_label"] == "moderate"
+    assert result["final_level"] == "moderate"
+    assert result["cpt_code"] == "99214"
+
+
+def test_unknown_condition_is_reported_per_encounter():
+    results = compute_levels_batch([{"conditions": {"BOGUS": "yes"}}, {"problems": {"SLM": 1}}])
+    assert "error" in results[0]
+    assert results[1]["final_level"] == "straightforward"
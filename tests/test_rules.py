@@ -0,0 +1,126 @@
+import itertools
+
+import pytest
+
+from services.mdm import rules
+from services.mdm.mdm import answeroutput, finallevel_calculator
+
+# Expected answers read off services/mdm/tables/table1.pl and table3.pl
+COMPLEXITY = [
+    ("self_limited_minor", 1, "straightforward"),
+    ("self_limited_minor", 2, "low"),
+    ("stable_chronic", 1, "low"),
+    ("stable_chronic", 2, "moderate"),
+    ("acute_uncomplicated", 1, "low"),
+    ("stable_acute", 1, "moderate"),
+    ("acute_uncomplicated_hospital", 1, "moderate"),
+    ("chronic_exacerbation", 3, "moderate"),
+    ("undiagnosed_new", 1, "moderate"),
+    ("acute_systemic", 1, "moderate"),
+    ("acute_complicated_injury", 1, "moderate"),
+    ("chronic_severe", 1, "high"),
+    ("threatening_illness", 2, "high"),
+]
+
+RISK_LEVEL = {
+    "minimal_risk_of_morbidity": "straightforward",
+    "low_risk_of_morbidity": "low",
+    "prescription_drug_management": "moderate",
+    "minor_surgery_with_risk_factors": "moderate",
+    "elective_major_surgery_without_risk_factors": "moderate",
+    "sdh_limiting_diagnosis_or_treatment": "moderate",
+    "drug_therapy_intensive_monitoring": "high",
+    "elective_major_surgery_with_risk_factors": "high",
+    "emergency_major_surgery": "high",
+    "hospitalization_or_escalation": "high",
+    "do_not_resuscitate_due_to_poor_prognosis": "high",
+    "parenteral_controlled_substances": "high",
+}
+
+
+def _mo_reference(a, b, c, d, e, f):
+    """The mo/7 clauses of table2.pl in order, first solution wins"""
+    g1, g2, g3 = a + b + c, d, e + f
+    if g3 == 0 and g1 <= 1 and g2 == 0:
+        return "Straight Forward"
+    if g3 == 0 and g1 <= 2 and g2 == 0 and g1 > 1:
+        return "Low"
+    if g3 == 0 and (g1 > 2 or g2 != 0):
+        return "Moderate"
+    if g3 == 1 and g1 <= 2 and g2 == 0:
+        return "Moderate"
+    if g3 == 1 and (g1 > 2 or g2 != 0):
+        return "High"
+    if g3 == 2 and g1 <= 1:
+        return "Moderate"
+    if g3 == 2 and g1 > 1:
+        return "High"
+    return None
+
+
+def test_tables_parse():
+    assert set(rules.RULES["complexity"]) == {t for t, _, _ in COMPLEXITY}
+    assert rules.RULES["risk_level"] == RISK_LEVEL
+    assert len(rules.RULES["mo"]) == 7
+
+
+@pytest.mark.parametrize("problem_type,count,expected", COMPLEXITY)
+def test_complexity(problem_type, count, expected):
+    assert rules.complexity(problem_type, count) == expected
+
+
+def test_highest_complexity_from_list():
+    assert rules.highest_complexity_from_list([]) == "straightforward"
+    assert rules.highest_complexity_from_list([("stable_chronic", 1), ("acute_systemic", 1)]) == "moderate"
+    assert rules.highest_complexity_from_list([("chronic_severe", 1), ("stable_chronic", 2)]) == "high"
+    # count 0 has no acute_uncomplicated clause, so the whole query fails
+    assert rules.highest_complexity_from_list([("acute_uncomplicated", 0)]) is None
+    assert rules.highest_complexity_from_list([("unknown_type", 1)]) is None
+
+
+def test_max_risk():
+    assert rules.max_risk([]) == "straightforward"
+    for atom, level in RISK_LEVEL.items():
+        assert rules.max_risk([atom]) == level
+    assert rules.max_risk(["low_risk_of_morbidity", "emergency_major_surgery", "prescription_drug_management"]) == "high"
+    assert rules.max_risk(["not_an_atom"]) is None
+
+
+def test_mo_grid():
+    for values in itertools.product(range(4), repeat=6):
+        assert rules.mo(*values) == _mo_reference(*values), values
+
+
+def _tables():
+    tab_1 = {
+        "patientType": "Established",
+        "chronic": [{"condition": "Hypertension", "Worsening_condition": "No"}],
+        "acute": [],
+        "MDM_Complexity_Level": {"Level": "Low", "Explain": ""},
+    }
+    tab_2 = {"data_level": "Low", "unique_laboratory_tests_count": 1}
+    tab_3 = {"risk_analysis": [{"drug": "lisinopril", "classification": "Rx"}], "risk_level": "Low"}
+    return tab_1, tab_2, tab_3
+
+
+def test_answeroutput_takes_levels_from_rules():
+    tab_1, tab_2, tab_3 = _tables()
+    tab_1["chronic"].append({"condition": "Type 2 diabetes", "Worsening_condition": "No"})
+    result = answeroutput(tab_1, tab_2, tab_3)
+    assert result["A_level"] == "Moderate"
+    assert result["C_level"] == "Moderate"
+    assert result["finallevel"] == "moderate"
+
+
+def test_answeroutput_keeps_model_high_and_empty_tables():
+    tab_1, tab_2, tab_3 = _tables()
+    tab_1["MDM_Complexity_Level"]["Level"] = "High"
+    tab_3 = {"risk_analysis": [], "risk_level": "Low"}
+    result = answeroutput(tab_1, tab_2, tab_3)
+    assert result["A_level"] == "High"
+    assert result["C_level"] == "Low"
+
+
+def test_final_level_is_middle_rank():
+    assert finallevel_calculator("Low", "Moderate", "High") == "moderate"
+    assert finallevel_calculator("High", "Straightforward", "Low") == "low"
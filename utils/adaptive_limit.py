@@ -0,0 +1,151 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from utils.metrics import adaptive_concurrency_limit, adaptive_concurrency_inflight
+
+logger = logging.getLogger("adaptive_limit")
+
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+# Multiplicative decrease factor on 429 / timeout / latency rise
+AIMD_DECREASE = float(os.getenv("AIMD_DECREASE", "0.5"))
+# A success slower than baseline x tolerance counts as a latency rise
+AIMD_LATENCY_TOLERANCE = float(os.getenv("AIMD_LATENCY_TOLERANCE", "2.0"))
+# At most one decrease per this many seconds, so one burst of 429s is one signal
+AIMD_DECREASE_INTERVAL = float(os.getenv("AIMD_DECREASE_INTERVAL", "2.0"))
+# Weight of a new sample in the latency baseline (slow on purpose: the baseline is the "flat" reference)
+BASELINE_ALPHA = 0.05
+POLL_SECONDS = 0.05
+
+_HTTP_429_RE = re.compile(r"\b429\b")
+
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+    +1 after `limit` consecutive on-baseline successes; x AIMD_DECREASE on overload; admissions paused for Retry-After.
+    """
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int):
+        self.name = name
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._publish()
+
+    def _publish(self) -> None:
+        adaptive_concurrency_limit.labels(limiter=self.name).set(int(self.limit))
+        adaptive_concurrency_inflight.labels(limiter=self.name).set(self.inflight)
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if not ADAPTIVE_CONCURRENCY:
+                self.inflight += 1
+                return True
+            if time.time() < self._paused_until or self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            self._publish()
+            return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Block until a slot is free (worker threads)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self.try_acquire():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                wait = max(self._paused_until - time.time(), POLL_SECONDS)
+                self._cond.wait(wait if remaining is None else min(wait, remaining))
+        return True
+
+    async def acquire_async(self) -> None:
+        """Wait for a slot without holding a thread (event-loop callers)"""
+        while not self.try_acquire():
+            await asyncio.sleep(max(min(self._paused_until - time.time(), 1.0), POLL_SECONDS))
+
+    def release(self) -> None:
+        with self._cond:
+            self.inflight = max(self.inflight - 1, 0)
+            self._publish()
+            self._cond.notify()
+
+    def on_success(self, latency: float) -> None:
+        """`latency` may be normalised (e.g. elapsed / prompt p50) when calls differ a lot in size"""
+        with self._cond:
+            if self.baseline is None:
+                self.baseline = latency
+            elif latency > self.baseline * AIMD_LATENCY_TOLERANCE:
+                self._decrease("latency", None)
+                return
+            else:
+                self.baseline = BASELINE_ALPHA * latency + (1 - BASELINE_ALPHA) * self.baseline
+            self._successes += 1
+            if self._successes >= int(self.limit) and self.limit < self.maximum:
+                self._successes = 0
+                self.limit = min(self.limit + 1, self.maximum)
+                self._publish()
+                self._cond.notify()
+
+    def on_overload(self, reason: str, retry_after: Optional[float] = None) -> None:
+        with self._cond:
+            self._decrease(reason, retry_after)
+
+    def _decrease(self, reason: str, retry_after: Optional[float]) -> None:
+        now = time.time()
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        self._successes = 0
+        if now - self._last_decrease < AIMD_DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        previous = int(self.limit)
+        self.limit = max(self.limit * AIMD_DECREASE, self.minimum)
+        self._publish()
+        logger.warning(
+            f"[AIMD-DECREASE] limiter={self.name} reason={reason} limit={previous}->{int(self.limit)} "
+            f"retry_after={retry_after}"
+        )
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "baselineLatency": round(self.baseline, 3) if self.baseline is not None else None,
+                "pausedFor": round(max(self._paused_until - time.time(), 0), 1),
+            }
+
+
+def is_overload(error: BaseException) -> bool:
+    """429 / timeout errors, also when wrapped (Ray task errors, chained exceptions)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        name = type(error).__name__
+        if name in ("RateLimitError", "TimeoutError", "APITimeoutError") or isinstance(error, asyncio.TimeoutError):
+            return True
+        if "RateLimitError" in str(error) or _HTTP_429_RE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Process-wide limiter for outbound LLM calls
+llm_limiter = AIMDLimiter(
+    "llm",
+    initial=int(os.getenv("LLM_CONCURRENCY_INITIAL", "8")),
+    minimum=int(os.getenv("LLM_CONCURRENCY_MIN", "1")),
+    maximum=int(os.getenv("LLM_CONCURRENCY_MAX", "64")),
+)
@@ -1,34 +1,130 @@
 import os
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv
-from openai import AzureOpenAI
 
 load_dotenv()
 
-client = AzureOpenAI(
-    api_key=os.getenv("uuid"),
-    api_version="2024-12-01-preview",
-    azure_endpoint=os.getenv("azure_endpoint"),
-)
-
-async def ai_call(text, prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.0,
-    )
-    return response.choices[0].message.content
+from utils.llm_balancer import LLMBalancer, endpoints_from_config
+from utils.hedging import hedged_call, tracker
+from utils.adaptive_limit import llm_limiter, is_overload
+from utils.singleflight import coalesced, request_key
+from utils.usage_ledger import record_usage
+from utils.pipeline_metrics import observe_stage
+from utils.tracing import traced_span, set_llm_response_attributes
+from openai.types.chat import ChatCompletion
+
+# every call goes through the balancer; with one deployment configured it is a plain client
+balancer = LLMBalancer(endpoints_from_config())
+
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+class _BilledCall:
+    """
+    balancer.create run in a worker thread. Cancelling the awaiting attempt (a hedge loser, or a timeout)
+    does not stop the thread and the provider still bills the call, so its usage is recorded when it ends.
+    """
+
+    def __init__(self, prompt_name, model):
+        self.prompt_name = prompt_name
+        self.model = model
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._abandoned = False
+        self._response = None
+
+    def run(self, **kwargs):
+        response = balancer.create(model=self.model, **kwargs)
+        with self._lock:
+            self._response = response
+            abandoned = self._abandoned
+        if abandoned:
+            record_usage(self.prompt_name, self.model, response, time.perf_counter() - self.start)
+        return response
+
+    def abandon(self):
+        with self._lock:
+            self._abandoned = True
+            response = self._response
+        # finished just before the cancellation reached the attempt
+        if response is not None:
+            record_usage(self.prompt_name, self.model, response, time.perf_counter() - self.start)
+
+
+def _span_attributes(prompt_name, model, text, prompt, max_tokens=None):
+    return {
+        "gen_ai.operation.name": "chat",
+        "gen_ai.request.model": model or DEFAULT_MODEL,
+        "gen_ai.request.max_tokens": max_tokens,
+        "llm.prompt_name": prompt_name,
+        "llm.request.chars": len(prompt) + len(text),
+    }
+
+async def complete(text, prompt, model=None, max_tokens=None, prompt_name="default"):
+    """Raw chat completion (content + usage) for one system/user prompt pair, hedged with an adaptive timeout"""
+    extra = {"max_tokens": max_tokens} if max_tokens else {}
+
+    async def attempt(timeout):
+        await llm_limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            # one span per attempt, so hedged duplicates show up next to the original
+            with traced_span("llm.attempt", **{"llm.prompt_name": prompt_name, "llm.timeout_s": timeout}):
+                # the client is synchronous; run it off the event loop so gathered calls overlap
+                call = _BilledCall(prompt_name, model or DEFAULT_MODEL)
+                try:
+                    response = await asyncio.to_thread(
+                        call.run,
+                        messages=[
+                            {"role": "system", "content": prompt},
+                            {"role": "user", "content": text}
+                        ],
+                        temperature=0.0,
+                        timeout=timeout,
+                        **extra,
+                    )
+                except asyncio.CancelledError:
+                    call.abandon()
+                    raise
+        except Exception as e:
+            if is_overload(e):
+                llm_limiter.on_overload(type(e).__name__)
+            raise
+        finally:
+            llm_limiter.release()
+        # prompts differ in size, so latency is compared to this prompt's median
+        elapsed = time.perf_counter() - start
+        llm_limiter.on_success(elapsed / (tracker.percentile(prompt_name, 50) or elapsed or 1.0))
+        return response
+
+    def follower_copy(r):
+        # followers spent no tokens; usage stays with the leader's call
+        followed.append(True)
+        return r.model_copy(update={"usage": None})
+
+    def discarded(r, seconds):
+        # the other hedged attempt finished in the same wakeup; it was billed too
+        record_usage(prompt_name, model or DEFAULT_MODEL, r, seconds)
 
+    followed = []
+    key = request_key(model or DEFAULT_MODEL, max_tokens, prompt, text)
+    start = time.perf_counter()
+    with traced_span(f"llm {prompt_name}", **_span_attributes(prompt_name, model, text, prompt, max_tokens)) as span:
+        response = await coalesced(
+            key,
+            prompt_name,
+            lambda: hedged_call(prompt_name, attempt, discarded),
+            dumps=lambda r: r.model_dump_json(),
+            loads=ChatCompletion.model_validate_json,
+            shared=follower_copy,
+        )
+        set_llm_response_attributes(span, response)
+    elapsed = time.perf_counter() - start
+    record_usage(prompt_name, model or DEFAULT_MODEL, response, elapsed, coalesced=bool(followed))
+    observe_stage(f"llm_{prompt_name}", elapsed)
+    return response
 
-def ai_call_demo(text, prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.0,
-    )
+async def ai_call(text, prompt, max_tokens=None, model=None, prompt_name="default"):
+    response = await complete(text, prompt, model, max_tokens, prompt_name)
     return response.choices[0].message.content
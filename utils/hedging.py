@@ -0,0 +1,153 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import numpy as np
+
+from utils.metrics import llm_hedges_total, llm_hedge_wins_total, llm_timeouts_total, llm_adaptive_timeout_seconds
+
+logger = logging.getLogger("hedging")
+
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"
+# Rolling window of successful call latencies kept per prompt type
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Percentiles are trusted only after this many samples; before that the fixed timeout applies and nothing is hedged
+LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "20"))
+# Timeout = p99 x multiplier, clamped to [MIN, MAX] seconds
+TIMEOUT_MULTIPLIER = float(os.getenv("LLM_TIMEOUT_P99_MULTIPLIER", "2.0"))
+TIMEOUT_MIN_SECONDS = float(os.getenv("LLM_TIMEOUT_MIN_SECONDS", "30"))
+TIMEOUT_MAX_SECONDS = float(os.getenv("LLM_TIMEOUT_MAX_SECONDS", "600"))
+# Duplicate work allowed: each call earns this many hedge tokens, a hedge spends one
+HEDGE_BUDGET_RATIO = float(os.getenv("LLM_HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.getenv("LLM_HEDGE_BUDGET_BURST", "5"))
+
+
+class LatencyTracker:
+    """Rolling latency samples per prompt type with p95/p99 lookups"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, prompt_name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(prompt_name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, prompt_name: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(prompt_name, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, q))
+
+    def timeout(self, prompt_name: str) -> float:
+        p99 = self.percentile(prompt_name, 99)
+        if p99 is None:
+            return TIMEOUT_MAX_SECONDS
+        return min(max(p99 * TIMEOUT_MULTIPLIER, TIMEOUT_MIN_SECONDS), TIMEOUT_MAX_SECONDS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            names = list(self._samples)
+        return {
+            n: {"samples": len(self._samples[n]), "p95": self.percentile(n, 95), "p99": self.percentile(n, 99), "timeout": self.timeout(n)}
+            for n in names
+        }
+
+
+class HedgeBudget:
+    """Token bucket capping hedged (duplicate) calls at HEDGE_BUDGET_RATIO of all calls"""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, burst: float = HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.burst)
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+tracker = LatencyTracker()
+budget = HedgeBudget()
+
+
+async def _attempt(factory: Callable[[float], Awaitable[Any]], timeout: float):
+    start = time.perf_counter()
+    result = await factory(timeout)
+    return result, time.perf_counter() - start
+
+
+async def hedged_call(
+    prompt_name: str,
+    factory: Callable[[float], Awaitable[Any]],
+    on_discard: Optional[Callable[[Any, float], None]] = None,
+) -> Any:
+    """
+    Run factory(timeout) under the adaptive timeout of `prompt_name`; if it is still running after the
+    rolling p95 and the budget allows, start a duplicate and return whichever finishes first.
+    The factory receives the per-attempt timeout so the SDK call itself is bounded too.
+    on_discard(result, seconds) gets a finished attempt whose result is not returned (both finished together);
+    attempts still running are cancelled and must account for themselves.
+    """
+    timeout = tracker.timeout(prompt_name)
+    llm_adaptive_timeout_seconds.labels(prompt=prompt_name).set(timeout)
+    budget.earn()
+    hedge_after = tracker.percentile(prompt_name, 95) if LLM_HEDGING else None
+
+    primary = asyncio.ensure_future(_attempt(factory, timeout))
+    tasks = {primary}
+    deadline = time.monotonic() + timeout
+    try:
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and budget.spend():
+                llm_hedges_total.labels(prompt=prompt_name).inc()
+                logger.info(f"[LLM-HEDGE] prompt={prompt_name} after_s={hedge_after:.1f}")
+                tasks.add(asyncio.ensure_future(_attempt(factory, max(deadline - time.monotonic(), 1.0))))
+
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, timeout=max(deadline - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            winner = None
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+                elif on_discard is not None:
+                    on_discard(*task.result())
+            if winner is not None:
+                result, elapsed = winner.result()
+                tracker.record(prompt_name, elapsed)
+                if winner is not primary:
+                    llm_hedge_wins_total.labels(prompt=prompt_name).inc()
+                return result
+        if error is not None:
+            raise error
+        llm_timeouts_total.labels(prompt=prompt_name).inc()
+        # a timed-out call still tells us the latency is at least this long
+        tracker.record(prompt_name, timeout)
+        raise asyncio.TimeoutError(f"LLM call for {prompt_name} exceeded adaptive timeout {timeout:.1f}s")
+    finally:
+        # the loser (or everything, on timeout) is cancelled; its worker thread is bounded by the SDK timeout
+        # and the attempt records the usage of a call that still completes
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import openai
+from openai import AzureOpenAI
+
+from utils.metrics import llm_endpoint_requests_total, llm_endpoint_latency_ewma, llm_endpoint_ejected
+from utils.adaptive_limit import llm_limiter
+
+logger = logging.getLogger("llm_balancer")
+
+# JSON list of deployments: [{"name", "endpoint", "api_key", "api_version", "models": {"gpt-4o-mini": "<deployment>"}}]
+# When unset, the single uuid/azure_endpoint deployment is used.
+LLM_DEPLOYMENTS = os.getenv("LLM_DEPLOYMENTS", "")
+API_VERSION = "2024-12-01-preview"
+EWMA_ALPHA = float(os.getenv("LLM_BALANCER_EWMA_ALPHA", "0.3"))
+# First ejection lasts this long; consecutive failures double it up to EJECT_MAX_SECONDS
+EJECT_SECONDS = float(os.getenv("LLM_BALANCER_EJECT_SECONDS", "10"))
+EJECT_MAX_SECONDS = float(os.getenv("LLM_BALANCER_EJECT_MAX_SECONDS", "120"))
+# Below this share of the request/token quota an endpoint is deprioritised
+QUOTA_LOW_RATIO = float(os.getenv("LLM_BALANCER_QUOTA_LOW_RATIO", "0.1"))
+# Share of calls sent to a random healthy endpoint so stale latency estimates get refreshed
+EXPLORE_RATIO = float(os.getenv("LLM_BALANCER_EXPLORE_RATIO", "0.05"))
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class Endpoint:
+    """One Azure OpenAI deployment and its health statistics"""
+
+    def __init__(self, name: str, client: Any, models: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.client = client
+        self.models = models or {}
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.remaining_requests: Optional[int] = None
+        self.limit_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.limit_tokens: Optional[int] = None
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def score(self) -> float:
+        """Expected cost of routing one more call here; lower is better (unmeasured endpoints first)"""
+        if self.latency is None:
+            return float(self.inflight)
+        score = self.latency * (1 + self.inflight) * (1 + 4 * self.error_rate)
+        for remaining, limit in ((self.remaining_requests, self.limit_requests), (self.remaining_tokens, self.limit_tokens)):
+            if remaining is not None and limit and remaining / limit < QUOTA_LOW_RATIO:
+                score *= 4
+        return score
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "latencyEwma": round(self.latency, 3) if self.latency is not None else None,
+            "errorRate": round(self.error_rate, 3),
+            "inflight": self.inflight,
+            "ejectedFor": round(max(self.ejected_until - now, 0), 1),
+            "remainingRequests": self.remaining_requests,
+            "remainingTokens": self.remaining_tokens,
+        }
+
+
+def _int_header(headers: Any, name: str) -> Optional[int]:
+    try:
+        value = headers.get(name)
+        return int(float(value)) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name.endswith("-ms") else seconds
+    return None
+
+
+class LLMBalancer:
+    """Client-side balancer over N deployments: least expected latency first, unhealthy endpoints ejected"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("LLMBalancer needs at least one endpoint")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def _pick(self, tried: set) -> Endpoint:
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.name not in tried]
+            healthy = [e for e in candidates if e.available(now)]
+            if healthy and random.random() < EXPLORE_RATIO:
+                chosen = random.choice(healthy)
+            elif healthy:
+                # random tie-break keeps equal endpoints evenly loaded
+                chosen = min(healthy, key=lambda e: (e.score(), random.random()))
+            else:
+                # everything ejected: use the endpoint that recovers first rather than failing outright
+                chosen = min(candidates, key=lambda e: e.ejected_until)
+            chosen.inflight += 1
+        return chosen
+
+    def _success(self, endpoint: Endpoint, elapsed: float, headers: Any) -> None:
+        with self._lock:
+            endpoint.inflight -= 1
+            endpoint.latency = elapsed if endpoint.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * endpoint.latency
+            endpoint.error_rate *= 1 - EWMA_ALPHA
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+            endpoint.remaining_requests = _int_header(headers, "x-ratelimit-remaining-requests")
+            endpoint.limit_requests = _int_header(headers, "x-ratelimit-limit-requests")
+            endpoint.remaining_tokens = _int_header(headers, "x-ratelimit-remaining-tokens")
+            endpoint.limit_tokens = _int_header(headers, "x-ratelimit-limit-tokens")
+        llm_endpoint_requests_total.labels(endpoint=endpoint.name, outcome="success").inc()
+        llm_endpoint_latency_ewma.labels(endpoint=endpoint.name).set(endpoint.latency)
+        llm_endpoint_ejected.labels(endpoint=endpoint.name).set(0)
+
+    def _failure(self, endpoint: Endpoint, error: Exception) -> None:
+        with self._lock:
+            endpoint.inflight -= 1
+            endpoint.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * endpoint.error_rate
+            endpoint.failures += 1
+            cool_down = _retry_after(error) or min(EJECT_SECONDS * 2 ** (endpoint.failures - 1), EJECT_MAX_SECONDS)
+            endpoint.ejected_until = time.time() + cool_down
+        outcome = "throttled" if isinstance(error, openai.RateLimitError) else "error"
+        if outcome == "throttled":
+            # throttling is a capacity signal even when another endpoint takes the retry
+            llm_limiter.on_overload("throttled", _retry_after(error))
+        llm_endpoint_requests_total.labels(endpoint=endpoint.name, outcome=outcome).inc()
+        llm_endpoint_ejected.labels(endpoint=endpoint.name).set(1)
+        logger.warning(f"[LLM-ENDPOINT-EJECT] endpoint={endpoint.name} outcome={outcome} cool_down_s={cool_down:.1f} error={error}")
+
+    def create(self, model: str, **kwargs):
+        """chat.completions.create on the best endpoint, failing over on 429/5xx/connection errors"""
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.endpoints):
+            endpoint = self._pick(tried)
+            tried.add(endpoint.name)
+            start = time.perf_counter()
+            try:
+                raw = endpoint.client.chat.completions.with_raw_response.create(
+                    model=endpoint.models.get(model, model), **kwargs
+                )
+            except _RETRYABLE as e:
+                self._failure(endpoint, e)
+                last_error = e
+                continue
+            except Exception:
+                with self._lock:
+                    endpoint.inflight -= 1
+                raise
+            self._success(endpoint, time.perf_counter() - start, raw.headers)
+            return raw.parse()
+        raise last_error
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            return [e.snapshot(now) for e in self.endpoints]
+
+
+def endpoints_from_config(config: str = LLM_DEPLOYMENTS) -> List[Endpoint]:
+    if not config:
+        client = AzureOpenAI(api_key=os.getenv("uuid"), api_version=API_VERSION, azure_endpoint=os.getenv("azure_endpoint"))
+        return [Endpoint("default", client)]
+    endpoints = []
+    for i, item in enumerate(json.loads(config)):
+        client = AzureOpenAI(
+            api_key=item.get("api_key") or os.getenv(item.get("api_key_env", "uuid")),
+            api_version=item.get("api_version", API_VERSION),
+            azure_endpoint=item["endpoint"],
+            # failover is handled here; the SDK's own retries would hold a throttled endpoint
+            max_retries=0,
+        )
+        endpoints.append(Endpoint(item.get("name") or f"deployment-{i}", client, item.get("models")))
+    return endpoints
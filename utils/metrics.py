@@ -1,12 +1,26 @@
+import os
+import sys
 import time
+import tempfile
 from typing import Callable
 from fastapi import Request, Response
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from prometheus_client import REGISTRY
 import logging
 
 logger = logging.getLogger("metrics")
 
+# Multiprocess mode: every process (API, Ray workers) writes samples to mmap files in one directory and
+# /metrics aggregates them. prometheus_client picks its value class when first imported, so this runs first.
+METRICS_MULTIPROCESS = os.getenv("METRICS_MULTIPROCESS", "true").lower() == "true"
+if METRICS_MULTIPROCESS:
+    if "prometheus_client" in sys.modules and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        logger.warning("[METRICS-MULTIPROC] prometheus_client imported before utils.metrics; this process stays single-process")
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "em_prometheus_multiproc"))
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "") if METRICS_MULTIPROCESS else ""
+
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
 # HTTP Metrics
 http_requests_total = Counter(
     "http_requests_total",
@@ -50,7 +64,8 @@ duckdb_operation_duration_seconds = Histogram(
 queue_size = Gauge(
     "queue_size",
     "Current size of the queue",
-    ["queue_name"]
+    ["queue_name"],
+    multiprocess_mode="livemax"
 )
 
 queue_operations_total = Counter(
@@ -59,18 +74,209 @@ queue_operations_total = Counter(
     ["queue_name", "operation"]
 )
 
+queue_wait_seconds = Histogram(
+    "queue_wait_seconds",
+    "Time a task spent in a Redis queue before a worker took it",
+    ["queue_name"],
+    buckets=[0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0]
+)
+
+queue_oldest_age_seconds = Gauge(
+    "queue_oldest_age_seconds",
+    "Age of the task at the head of the queue (0 when empty)",
+    ["queue_name"],
+    multiprocess_mode="livemax"
+)
+
+# MDM pre-classifier outcomes (decided = LLM call skipped)
+preclassifier_decisions_total = Counter(
+    "mdm_preclassifier_decisions_total",
+    "Deterministic visit/patient type pre-classifier outcomes",
+    ["classifier", "outcome"]
+)
+
+# Demographic extraction field sources (regex / llm / missing)
+pii_fields_total = Counter(
+    "pii_demo_fields_total",
+    "Demographic fields by the extractor that filled them",
+    ["field", "source"]
+)
+
+# Chart bytes sent to / trimmed from each prompt by section selection
+section_bytes_total = Counter(
+    "llm_section_input_bytes_total",
+    "Chart bytes per prompt after section selection (kind = sent | saved)",
+    ["prompt", "kind"]
+)
+
+# Chart normalization before enqueue
+chart_compression_ratio = Histogram(
+    "chart_normalize_compression_ratio",
+    "Normalized / original chart length",
+    buckets=[0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 1.0]
+)
+
+chart_bytes_removed_total = Counter(
+    "chart_normalize_chars_removed_total",
+    "Characters removed from charts by normalization"
+)
+
+# Deterministic evidence verification (outcome = exact | fuzzy | cleared | pageFixed)
+evidence_checks_total = Counter(
+    "mdm_evidence_checks_total",
+    "Evidence sentences checked against the chart by outcome",
+    ["outcome"]
+)
+
+# LLM model routing (route = first | escalated)
+llm_route_calls_total = Counter(
+    "llm_route_calls_total",
+    "LLM calls per prompt, deployment and route",
+    ["prompt", "model", "route"]
+)
+
+llm_route_tokens_total = Counter(
+    "llm_route_tokens_total",
+    "LLM tokens per prompt, deployment and route (kind = prompt | completion)",
+    ["prompt", "model", "route", "kind"]
+)
+
+llm_route_cost_usd_total = Counter(
+    "llm_route_cost_usd_total",
+    "Estimated LLM cost in USD per prompt, deployment and route",
+    ["prompt", "model", "route"]
+)
+
+llm_route_escalations_total = Counter(
+    "llm_route_escalations_total",
+    "Calls sent to the strong deployment, by reason (size | schema | borderline)",
+    ["prompt", "reason"]
+)
+
+llm_route_latency_seconds = Histogram(
+    "llm_route_latency_seconds",
+    "LLM call latency per prompt and deployment",
+    ["prompt", "model"],
+    buckets=[0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0]
+)
+
+# LLM usage ledger (every completion, routed or not)
+llm_usage_calls_total = Counter(
+    "llm_usage_calls_total",
+    "LLM completions per prompt and model",
+    ["prompt", "model"]
+)
+
+llm_usage_tokens_total = Counter(
+    "llm_usage_tokens_total",
+    "LLM tokens per prompt and model (kind = prompt | completion)",
+    ["prompt", "model", "kind"]
+)
+
+llm_usage_cost_usd_total = Counter(
+    "llm_usage_cost_usd_total",
+    "Estimated LLM cost in USD per prompt and model",
+    ["prompt", "model"]
+)
+
+# LLM deployment balancer (outcome = success | throttled | error)
+llm_endpoint_requests_total = Counter(
+    "llm_endpoint_requests_total",
+    "LLM calls per deployment endpoint and outcome",
+    ["endpoint", "outcome"]
+)
+
+llm_endpoint_latency_ewma = Gauge(
+    "llm_endpoint_latency_ewma_seconds",
+    "EWMA latency per deployment endpoint",
+    ["endpoint"],
+    multiprocess_mode="livemax"
+)
+
+llm_endpoint_ejected = Gauge(
+    "llm_endpoint_ejected",
+    "Deployment endpoint ejected after 429/5xx (1 = ejected)",
+    ["endpoint"],
+    multiprocess_mode="livemax"
+)
+
+# Hedged requests and adaptive timeouts
+llm_hedges_total = Counter(
+    "llm_hedges_total",
+    "Duplicate (hedged) LLM calls started after the rolling p95",
+    ["prompt"]
+)
+
+llm_hedge_wins_total = Counter(
+    "llm_hedge_wins_total",
+    "Hedged LLM calls that finished before the original",
+    ["prompt"]
+)
+
+llm_timeouts_total = Counter(
+    "llm_timeouts_total",
+    "LLM calls that exceeded the adaptive timeout",
+    ["prompt"]
+)
+
+llm_adaptive_timeout_seconds = Gauge(
+    "llm_adaptive_timeout_seconds",
+    "Current adaptive timeout per prompt type (p99 x multiplier, clamped)",
+    ["prompt"],
+    multiprocess_mode="livemax"
+)
+
+# Single-flight coalescing (scope = process | redis)
+llm_coalesced_total = Counter(
+    "llm_coalesced_total",
+    "LLM calls answered by an identical in-flight call instead of a new request",
+    ["prompt", "scope"]
+)
+
+# Adaptive (AIMD) concurrency limits
+adaptive_concurrency_limit = Gauge(
+    "adaptive_concurrency_limit",
+    "Current AIMD concurrency limit",
+    ["limiter"],
+    multiprocess_mode="livesum"
+)
+
+adaptive_concurrency_inflight = Gauge(
+    "adaptive_concurrency_inflight",
+    "Calls/tasks currently holding an AIMD slot",
+    ["limiter"],
+    multiprocess_mode="livesum"
+)
+
+# Worker-side pipeline stages (stage = pdf_download | pdf_extract | ocr_engine | llm_<prompt> | icd_mapping | evidence | rules | callback_*)
+pipeline_stage_duration_seconds = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Duration of each pipeline stage inside the workers",
+    ["stage"],
+    buckets=[0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0]
+)
+
+# In-process tail sampler decisions (decision = keep | drop, reason = error | slow | fast_sample | excluded | ...)
+trace_sampling_decisions_total = Counter(
+    "trace_sampling_decisions_total",
+    "Traces kept or dropped by the tail sampler",
+    ["decision", "reason"]
+)
+
 # Worker Metrics
 worker_status = Gauge(
     "worker_status",
     "Worker status (1 = online, 0 = offline)",
-    ["worker_name"]
+    ["worker_name"],
+    multiprocess_mode="livemax"
 )
 
 # System Metrics
 system_memory_bytes = Gauge(
     "system_memory_bytes",
     "System memory usage in bytes",
-    ["type"]
+    ["type"],
+    multiprocess_mode="livemax"
 )
 
 def normalize_path(path: str) -> str:
@@ -112,7 +318,49 @@ async def metrics_middleware(request: Request, call_next: Callable) -> Response:
         logger.error(f"Request failed: {method} {path} - {str(e)}", exc_info=True)
         raise
 
+def _metric_file_pids():
+    """pid -> files in the multiprocess directory (names are <type>[_<mode>]_<pid>.db)"""
+    pids = {}
+    for name in os.listdir(MULTIPROC_DIR):
+        _, _, pid = name[:-len(".db")].rpartition("_")
+        if name.endswith(".db") and pid.isdigit():
+            pids.setdefault(int(pid), []).append(name)
+    return pids
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_stale_metric_files():
+    """At API startup, before ray.init: wipe the directory (counters restart with the pod).
+
+    Only the API's own files are kept; they are already mmapped by the metrics defined at import time.
+    Anything else, live pid or not, belongs to a previous run (pids are reused across container restarts).
+    """
+    if not MULTIPROC_DIR:
+        return
+    removed = 0
+    for pid, names in _metric_file_pids().items():
+        if pid != os.getpid():
+            for name in names:
+                os.remove(os.path.join(MULTIPROC_DIR, name))
+                removed += 1
+    logger.info(f"[METRICS-MULTIPROC] dir={MULTIPROC_DIR} stale_files_removed={removed}")
+
 def get_metrics():
-    """Get Prometheus metrics"""
-    return generate_latest(REGISTRY)
+    """Get Prometheus metrics (aggregated over API and Ray worker processes in multiprocess mode)"""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    # live gauges of exited Ray workers would otherwise be reported forever; their counters are kept
+    for pid in _metric_file_pids():
+        if not _pid_alive(pid):
+            multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+    return generate_latest(registry)
 
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.ai import DEFAULT_MODEL, complete
+from utils.metrics import (
+    llm_route_calls_total,
+    llm_route_cost_usd_total,
+    llm_route_escalations_total,
+    llm_route_latency_seconds,
+    llm_route_tokens_total,
+)
+from utils.usage_ledger import call_cost
+
+logger = logging.getLogger("model_router")
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+# Cheap/fast deployment tried first and the strong one used on escalation; no strong model = no escalation
+FAST_MODEL = os.getenv("LLM_MODEL_FAST", DEFAULT_MODEL)
+STRONG_MODEL = os.getenv("LLM_MODEL_STRONG", "")
+CHARS_PER_TOKEN = 4
+
+# Per-prompt policy: which checks may escalate and the input size (tokens) that goes straight to the strong model
+DEFAULT_POLICY = {"escalate_on": ["schema"], "size_tokens": 0}
+ROUTING_POLICIES = {
+    "visit": {"escalate_on": ["schema"], "size_tokens": 0},
+    "tab_1": {"escalate_on": ["schema", "borderline", "size"], "size_tokens": 20000},
+    "tab_2": {"escalate_on": ["schema", "borderline", "size"], "size_tokens": 20000},
+    "tab_3": {"escalate_on": ["schema", "borderline", "size"], "size_tokens": 20000},
+    "icd": {"escalate_on": ["schema", "size"], "size_tokens": 20000},
+    "explain": {"escalate_on": [], "size_tokens": 0},
+    "demo": {"escalate_on": ["schema"], "size_tokens": 0},
+}
+for _name, _policy in json.loads(os.getenv("MODEL_ROUTING_POLICIES", "{}")).items():
+    ROUTING_POLICIES[_name] = {**ROUTING_POLICIES.get(_name, DEFAULT_POLICY), **_policy}
+
+# check(raw_output) -> None when acceptable, else the escalation reason ("schema" | "borderline")
+Check = Callable[[str], Optional[str]]
+
+
+def policy_for(prompt_name: str) -> Dict:
+    return ROUTING_POLICIES.get(prompt_name, DEFAULT_POLICY)
+
+
+async def _timed_call(
+    prompt_name: str, model: str, route: str, text: str, prompt: str, max_tokens: Optional[int]
+) -> Tuple[str, Optional[str]]:
+    start = time.perf_counter()
+    response = await complete(text, prompt, model, max_tokens, prompt_name)
+    elapsed = time.perf_counter() - start
+
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    llm_route_calls_total.labels(prompt=prompt_name, model=model, route=route).inc()
+    llm_route_latency_seconds.labels(prompt=prompt_name, model=model).observe(elapsed)
+    # coalesced followers carry no usage, so each route is billed only for the tokens it spent
+    cost = call_cost(model, prompt_tokens, completion_tokens)
+    llm_route_tokens_total.labels(prompt=prompt_name, model=model, route=route, kind="prompt").inc(prompt_tokens)
+    llm_route_tokens_total.labels(prompt=prompt_name, model=model, route=route, kind="completion").inc(completion_tokens)
+    llm_route_cost_usd_total.labels(prompt=prompt_name, model=model, route=route).inc(cost)
+    logger.info(
+        f"[LLM-ROUTE] prompt={prompt_name} model={model} route={route} latency_ms={elapsed * 1000:.0f} "
+        f"prompt_tokens={prompt_tokens} completion_tokens={completion_tokens} cost_usd={cost:.6f}"
+    )
+    choice = response.choices[0]
+    return choice.message.content, getattr(choice, "finish_reason", None)
+
+
+async def _call(prompt_name: str, model: str, route: str, text: str, prompt: str, max_tokens: Optional[int]) -> str:
+    """One routed call; an output cut off at a max_tokens cap is retried once without the cap"""
+    raw, finish_reason = await _timed_call(prompt_name, model, route, text, prompt, max_tokens)
+    if finish_reason != "length" or not max_tokens:
+        return raw
+    logger.warning(f"[LLM-ROUTE-TRUNCATED] prompt={prompt_name} model={model} max_tokens={max_tokens} retrying uncapped")
+    raw, _ = await _timed_call(prompt_name, model, "uncapped", text, prompt, None)
+    return raw
+
+
+async def routed_call(
+    prompt_name: str,
+    text: str,
+    prompt: str,
+    max_tokens: Optional[int] = None,
+    check: Optional[Check] = None,
+) -> str:
+    """
+    Run `prompt` on the fast deployment and escalate to the strong one when the input is above the
+    policy's size threshold or `check` rejects the fast result (schema failure / borderline answer)
+    """
+    if not MODEL_ROUTING or not STRONG_MODEL or STRONG_MODEL == FAST_MODEL:
+        return await _call(prompt_name, FAST_MODEL, "first", text, prompt, max_tokens)
+
+    policy = policy_for(prompt_name)
+    escalate_on = set(policy.get("escalate_on", []))
+    size_tokens = policy.get("size_tokens", 0)
+    if "size" in escalate_on and size_tokens and len(text) // CHARS_PER_TOKEN > size_tokens:
+        llm_route_escalations_total.labels(prompt=prompt_name, reason="size").inc()
+        return await _call(prompt_name, STRONG_MODEL, "escalated", text, prompt, max_tokens)
+
+    raw = await _call(prompt_name, FAST_MODEL, "first", text, prompt, max_tokens)
+    reason = check(raw) if check is not None and escalate_on else None
+    if reason is None or reason not in escalate_on:
+        return raw
+    llm_route_escalations_total.labels(prompt=prompt_name, reason=reason).inc()
+    logger.info(f"[LLM-ROUTE-ESCALATE] prompt={prompt_name} reason={reason} model={STRONG_MODEL}")
+    # a schema failure under a cap is usually a truncated answer; the strong model gets no cap
+    return await _call(prompt_name, STRONG_MODEL, "escalated", text, prompt, None if reason == "schema" else max_tokens)
@@ -0,0 +1,109 @@
+import os
+import re
+import logging
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from utils.metrics import chart_compression_ratio, chart_bytes_removed_total
+from utils.sections import PAGE_BREAK, is_section_header
+
+logger = logging.getLogger("normalize")
+
+CHART_NORMALIZE = os.getenv("CHART_NORMALIZE", "true").lower() == "true"
+# Lines within this many lines of a page's top/bottom are candidates for header/footer removal
+EDGE_LINES = int(os.getenv("CHART_NORMALIZE_EDGE_LINES", "6"))
+# A candidate line is boilerplate when it repeats on at least this share of pages
+REPEAT_RATIO = float(os.getenv("CHART_NORMALIZE_REPEAT_RATIO", "0.5"))
+
+_INVISIBLE_RE = re.compile("[\u200b-\u200d\u2060\ufeff\u00ad]")
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+_SPACES_RE = re.compile("[ \t\u00a0\u2000-\u200a\u3000]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+# separator rules, box drawing and scanner speckle: no letters or digits at all
+_NOISE_LINE_RE = re.compile(r"^[^A-Za-z0-9]+$")
+_DIGITS_RE = re.compile(r"\d+")
+_VOLATILE_RE = re.compile(r"(?i)\bpage\b|\b\d{1,2}/\d{1,2}/\d{2,4}\b|\b\d{1,2}:\d{2}\b")
+
+
+def _line_key(line: str) -> str:
+    line = line.lower()
+    # page numbers and print timestamps change per page; mask them so "Page 2 of 9" == "Page 3 of 9"
+    return _DIGITS_RE.sub("#", line) if _VOLATILE_RE.search(line) else line
+
+
+def _clean_page(page: str) -> List[str]:
+    page = page.replace("\r\n", "\n").replace("\r", "\n")
+    page = _INVISIBLE_RE.sub("", page)
+    page = _CONTROL_RE.sub("", page)
+    lines = []
+    for line in page.split("\n"):
+        line = _SPACES_RE.sub(" ", line).strip()
+        if line and _NOISE_LINE_RE.match(line):
+            continue
+        lines.append(line)
+    return lines
+
+
+def _edge_keys(lines: List[str]) -> Dict[int, Tuple[str, int, str]]:
+    """Line index -> (zone, offset from the page edge, masked text) for the top/bottom EDGE_LINES lines"""
+    content = [i for i, l in enumerate(lines) if l]
+    keys = {}
+    for offset, i in enumerate(content[:EDGE_LINES]):
+        keys[i] = ("head", offset, _line_key(lines[i]))
+    for offset, i in enumerate(reversed(content[-EDGE_LINES:])):
+        keys.setdefault(i, ("foot", offset, _line_key(lines[i])))
+    return keys
+
+
+def normalize_chart(text: str) -> Tuple[str, Dict]:
+    """
+    Collapse whitespace/OCR noise and drop header/footer lines repeated across pages.
+    The first copy of each repeated line and every page break are kept.
+    """
+    original_len = len(text)
+    pages = [_clean_page(p) for p in text.split(PAGE_BREAK)]
+
+    edges = [_edge_keys(lines) for lines in pages]
+    repeated = set()
+    if len(pages) > 1:
+        counts = Counter(key for page_edges in edges for key in set(page_edges.values()))
+        min_pages = max(2, int(len(pages) * REPEAT_RATIO + 0.999))
+        # multi-visit bundles repeat section headers per page; those must survive for segmentation
+        repeated = {key for key, n in counts.items() if n >= min_pages and not is_section_header(key[2])}
+
+    removed = 0
+    out_pages = []
+    for page_no, (lines, page_edges) in enumerate(zip(pages, edges)):
+        kept = []
+        for i, line in enumerate(lines):
+            # the first page keeps its copy of every header/footer line
+            if page_no > 0 and page_edges.get(i) in repeated:
+                removed += 1
+                continue
+            kept.append(line)
+        out_pages.append(_BLANK_LINES_RE.sub("\n\n", "\n".join(kept)).strip())
+
+    normalized = PAGE_BREAK.join(out_pages)
+    stats = {
+        "pages": len(pages),
+        "originalChars": original_len,
+        "normalizedChars": len(normalized),
+        "repeatedLinesRemoved": removed,
+        "compressionRatio": round(len(normalized) / original_len, 4) if original_len else 1.0,
+    }
+    return normalized, stats
+
+
+def normalize_for_enqueue(text: str, patient_id: str = "") -> str:
+    """normalize_chart with metrics/logging; returns the text unchanged when disabled or on error"""
+    if not CHART_NORMALIZE or not text:
+        return text
+    try:
+        normalized, stats = normalize_chart(text)
+    except Exception as e:
+        logger.error(f"[CHART-NORMALIZE-ERROR] patient={patient_id} error={e}")
+        return text
+    chart_compression_ratio.observe(stats["compressionRatio"])
+    chart_bytes_removed_total.inc(max(stats["originalChars"] - stats["normalizedChars"], 0))
+    logger.info(f"[CHART-NORMALIZE] patient={patient_id} {stats}")
+    return normalized
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import redis
+
+from utils.metrics import (
+    queue_size,
+    queue_operations_total,
+    queue_wait_seconds,
+    queue_oldest_age_seconds,
+    pipeline_stage_duration_seconds,
+    worker_status,
+)
+from utils import timeline
+from utils.tracing import traced_span
+from utils.usage_ledger import current_patient_id, current_trace_id
+
+logger = logging.getLogger("pipeline_metrics")
+
+QUEUE_SAMPLE_SECONDS = float(os.getenv("QUEUE_SAMPLE_SECONDS", "5"))
+# Epoch seconds written into every task when it is (re-)enqueued
+ENQUEUED_AT = "enqueuedAt"
+
+_workers: Dict[str, threading.Thread] = {}
+
+
+def stamp_enqueue(queue_name: str, task: dict, operation: str = "enqueue") -> str:
+    """Mark the task with its enqueue time and return the payload to push"""
+    task[ENQUEUED_AT] = time.time()
+    queue_operations_total.labels(queue_name=queue_name, operation=operation).inc()
+    timeline.record(task.get("patientId"), f"{operation}:{queue_name}", trace=_task_trace(task))
+    return json.dumps(task)
+
+
+def observe_dequeue(queue_name: str, task: dict) -> None:
+    queue_operations_total.labels(queue_name=queue_name, operation="dequeue").inc()
+    enqueued_at = task.get(ENQUEUED_AT)
+    if enqueued_at:
+        wait = max(time.time() - float(enqueued_at), 0.0)
+        queue_wait_seconds.labels(queue_name=queue_name).observe(wait)
+        # the wait is a span on the timeline: it starts at the enqueue and ends at this dequeue
+        timeline.record(task.get("patientId"), f"queue_wait:{queue_name}", wait, trace=_task_trace(task))
+
+
+def _task_trace(task: dict) -> Optional[str]:
+    trace_dto = task.get("traceDto")
+    return trace_dto.get("traceId") if isinstance(trace_dto, dict) else None
+
+
+def observe_stage(stage: str, seconds: float, patient_id: Optional[str] = None, status: str = "ok") -> None:
+    """Stage histogram + the patient's timeline (patient defaults to the usage context of the running chart)"""
+    pipeline_stage_duration_seconds.labels(stage=stage).observe(seconds)
+    timeline.record(patient_id or current_patient_id(), stage, seconds, status, trace=current_trace_id())
+
+
+@contextmanager
+def stage_timer(stage: str, patient_id: Optional[str] = None):
+    """Time a pipeline stage (observed on success and on error) inside a span of the same name"""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        with traced_span(f"stage {stage}", **{"pipeline.stage": stage, "patient.id": patient_id or current_patient_id() or None}):
+            yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, patient_id, status)
+
+
+def register_worker(name: str, thread: threading.Thread) -> None:
+    """worker_status{worker_name} follows the thread's liveness at every sample"""
+    _workers[name] = thread
+    worker_status.labels(worker_name=name).set(1 if thread.is_alive() else 0)
+
+
+def _oldest_age(head: str, now: float) -> float:
+    try:
+        enqueued_at = json.loads(head).get(ENQUEUED_AT)
+    except (ValueError, AttributeError):
+        return 0.0
+    return max(now - float(enqueued_at), 0.0) if enqueued_at else 0.0
+
+
+def sample_queues(client: redis.Redis, queues: List[str]) -> None:
+    """Depth and head-of-line age of each queue (tasks are RPUSHed and BLPOPed, so index 0 is the oldest)"""
+    pipe = client.pipeline(transaction=False)
+    for name in queues:
+        pipe.llen(name)
+        pipe.lindex(name, 0)
+    values = pipe.execute()
+    now = time.time()
+    for i, name in enumerate(queues):
+        depth, head = values[2 * i], values[2 * i + 1]
+        queue_size.labels(queue_name=name).set(depth)
+        queue_oldest_age_seconds.labels(queue_name=name).set(_oldest_age(head, now) if head else 0.0)
+    for name, thread in _workers.items():
+        worker_status.labels(worker_name=name).set(1 if thread.is_alive() else 0)
+
+
+def start_queue_sampler(client: redis.Redis, queues: List[str]) -> threading.Thread:
+    def loop():
+        logger.info(f"[QUEUE-SAMPLER-START] queues={queues} interval={QUEUE_SAMPLE_SECONDS}s")
+        while True:
+            try:
+                sample_queues(client, queues)
+            except Exception as e:
+                logger.warning(f"[QUEUE-SAMPLER-ERROR] error={e}")
+            time.sleep(QUEUE_SAMPLE_SECONDS)
+
+    thread = threading.Thread(target=loop, name="queue-sampler", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,134 @@
+import os
+import re
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from utils.metrics import section_bytes_total
+
+logger = logging.getLogger("sections")
+
+SECTION_SELECT = os.getenv("SECTION_SELECT", "true").lower() == "true"
+# Charts with fewer recognised headers than this are sent whole
+SECTION_MIN_HEADERS = int(os.getenv("SECTION_MIN_HEADERS", "3"))
+# A selection shorter than this is treated as a segmentation miss and the full chart is sent
+SECTION_MIN_CHARS = int(os.getenv("SECTION_MIN_CHARS", "200"))
+
+# Page separator used when joining extracted PDF pages
+PAGE_BREAK = "\f"
+
+# Canonical section -> header spellings seen in our charts
+SECTION_HEADERS = {
+    "demographics": ["patient information", "patient demographics", "demographics", "patient info", "insurance information", "insurance"],
+    "cc": ["chief complaint", "chief complaints", "reason for visit", "reason for appointment", "cc"],
+    "hpi": ["history of present illness", "hpi", "subjective", "interval history"],
+    "ros": ["review of systems", "ros"],
+    "history": [
+        "past medical history", "pmh", "past surgical history", "psh", "family history", "social history",
+        "medical history", "surgical history", "problem list", "active problems",
+    ],
+    "medications": [
+        "medications", "current medications", "medication list", "meds", "active medications",
+        "prescriptions", "medications prescribed", "medication changes",
+    ],
+    "allergies": ["allergies", "drug allergies"],
+    "vitals": ["vitals", "vital signs"],
+    "exam": ["physical exam", "physical examination", "exam", "examination", "objective"],
+    "results": [
+        "results", "lab results", "labs", "laboratory", "imaging", "radiology", "diagnostics",
+        "diagnostic results", "data reviewed", "test results", "studies",
+    ],
+    "assessment": [
+        "assessment and plan", "assessment & plan", "assessment/plan", "a/p", "assessment", "impression",
+        "diagnoses", "diagnosis", "visit diagnoses", "encounter diagnoses",
+    ],
+    "plan": ["plan", "treatment plan", "plan of care", "follow up", "follow-up", "disposition"],
+    "orders": ["orders", "orders placed", "lab orders", "imaging orders", "referrals", "referral"],
+    "procedures": ["procedures", "procedure codes", "cpt", "cpt codes", "billing", "charges", "coding", "services performed"],
+}
+
+# Sections each prompt reads; "preamble" is the text before the first header (title, demographics)
+PROMPT_SECTIONS = {
+    "visit": ["preamble", "demographics", "assessment", "procedures"],
+    # patientType is read from the CPT / procedure lines (new vs established E/M codes)
+    "tab_1": ["cc", "hpi", "assessment", "procedures"],
+    "tab_2": ["results", "orders", "plan", "procedures"],
+    "tab_3": ["medications", "orders", "plan", "procedures", "assessment"],
+    "icd": ["cc", "hpi", "ros", "exam", "assessment", "plan"],
+    "demo": ["preamble", "demographics", "hpi", "procedures"],
+}
+
+_HEADER_TO_SECTION = {h: name for name, headers in SECTION_HEADERS.items() for h in headers}
+_HEADER_RE = re.compile(
+    r"(?im)^[\f \t]*[*#\-=]*[ \t]*("
+    + "|".join(re.escape(h).replace(r"\ ", r"[ \t]+") for h in sorted(_HEADER_TO_SECTION, key=len, reverse=True))
+    + r")[ \t]*[*#\-=]*[ \t]*(?::|$)"
+)
+
+
+def is_section_header(line: str) -> bool:
+    return bool(_HEADER_RE.match(line))
+
+
+def segment(text: str) -> List[Dict]:
+    """
+    Split a chart into sections at recognised header lines.
+    Returns [{"name", "start", "end", "page"}] in document order, page numbers counted from PAGE_BREAK.
+    """
+    sections: List[Dict] = []
+    starts = []
+    for m in _HEADER_RE.finditer(text):
+        start = m.start()
+        # a header at the top of a page belongs to that page
+        while text.startswith(PAGE_BREAK, start):
+            start += 1
+        starts.append((start, _HEADER_TO_SECTION[re.sub(r"\s+", " ", m.group(1).lower())]))
+    if not starts or starts[0][0] > 0:
+        starts.insert(0, (0, "preamble"))
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+        sections.append({"name": name, "start": start, "end": end, "page": text.count(PAGE_BREAK, 0, start) + 1})
+    return sections
+
+
+def _render(text: str, section: Dict) -> str:
+    chunk = text[section["start"]:section["end"]].strip()
+    if PAGE_BREAK not in text:
+        return chunk
+    page = section["page"]
+    parts = chunk.split(PAGE_BREAK)
+    rendered = [f"[Page {page}]\n{parts[0].strip()}"]
+    for offset, part in enumerate(parts[1:], start=1):
+        rendered.append(f"[Page {page + offset}]\n{part.strip()}")
+    return "\n".join(rendered)
+
+
+def select_sections(
+    text: str,
+    prompt_name: str,
+    sections: Optional[List[Dict]] = None,
+    names: Optional[Iterable[str]] = None,
+) -> str:
+    """Text of the sections `prompt_name` needs, or the full chart when segmentation is not trustworthy"""
+    if not SECTION_SELECT or not text:
+        return text
+    sections = sections if sections is not None else segment(text)
+    wanted = set(names if names is not None else PROMPT_SECTIONS.get(prompt_name, []))
+
+    headers = sum(1 for s in sections if s["name"] != "preamble")
+    selected = "\n\n".join(_render(text, s) for s in sections if s["name"] in wanted)
+    if not wanted or headers < SECTION_MIN_HEADERS or len(selected) < SECTION_MIN_CHARS:
+        selected = text
+
+    full_bytes = len(text.encode("utf-8"))
+    sent_bytes = len(selected.encode("utf-8")) if selected is not text else full_bytes
+    record_section_bytes(prompt_name, full_bytes, sent_bytes)
+    logger.info(
+        f"[SECTION-SELECT] prompt={prompt_name} headers={headers} full_bytes={full_bytes} "
+        f"sent_bytes={sent_bytes} saved_bytes={max(full_bytes - sent_bytes, 0)}"
+    )
+    return selected
+
+
+def record_section_bytes(prompt_name: str, full_bytes: int, sent_bytes: int) -> None:
+    section_bytes_total.labels(prompt=prompt_name, kind="sent").inc(sent_bytes)
+    section_bytes_total.labels(prompt=prompt_name, kind="saved").inc(max(full_bytes - sent_bytes, 0))
@@ -0,0 +1,153 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import redis
+
+from utils.metrics import llm_coalesced_total
+
+logger = logging.getLogger("singleflight")
+
+LLM_SINGLEFLIGHT = os.getenv("LLM_SINGLEFLIGHT", "true").lower() == "true"
+# Cross-worker coalescing through Redis; in-process coalescing works without it
+LLM_SINGLEFLIGHT_REDIS = os.getenv("LLM_SINGLEFLIGHT_REDIS", "true").lower() == "true"
+# The leader's lock must outlive its LLM call; followers stop waiting once it expires
+LOCK_SECONDS = int(os.getenv("LLM_SINGLEFLIGHT_LOCK_SECONDS", "300"))
+# Finished results stay readable this long for followers that are still polling
+RESULT_SECONDS = int(os.getenv("LLM_SINGLEFLIGHT_RESULT_SECONDS", "60"))
+POLL_SECONDS = 0.25
+
+LOCK_PREFIX = "llm_sf_lock:"
+RESULT_PREFIX = "llm_sf_result:"
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_redis: Optional[redis.Redis] = None
+
+
+def _make_redis_client() -> redis.Redis:
+    raw_port = os.getenv("REDIS_PORT", "6379")
+    if "://" in raw_port:
+        raw_port = raw_port.split(":")[-1]
+
+    return redis.Redis(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(raw_port),
+        password=os.getenv("REDIS_PASSWORD"),
+        ssl=os.getenv("REDIS_SSL", "false").lower() == "true",
+        decode_responses=True,
+        socket_timeout=2,
+    )
+
+
+def _redis_client() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = _make_redis_client()
+    return _redis
+
+
+def request_key(*parts: Any) -> str:
+    """Hash of everything that determines the completion (model, prompt, text, generation params)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+async def _redis_coalesced(
+    key: str,
+    prompt_name: str,
+    compute: Callable[[], Awaitable[Any]],
+    dumps: Callable[[Any], str],
+    loads: Callable[[str], Any],
+    shared: Callable[[Any], Any],
+) -> Any:
+    """Leader holds a short Redis lock and publishes the result; followers in other workers poll for it"""
+    try:
+        client = _redis_client()
+        leader = client.set(LOCK_PREFIX + key, os.getpid(), nx=True, ex=LOCK_SECONDS)
+    except redis.RedisError as e:
+        logger.warning(f"[LLM-SINGLEFLIGHT-REDIS-ERROR] prompt={prompt_name} error={e}")
+        return await compute()
+
+    if leader:
+        try:
+            result = await compute()
+            try:
+                client.set(RESULT_PREFIX + key, dumps(result), ex=RESULT_SECONDS)
+            except redis.RedisError as e:
+                logger.warning(f"[LLM-SINGLEFLIGHT-REDIS-ERROR] prompt={prompt_name} error={e}")
+            return result
+        finally:
+            try:
+                client.delete(LOCK_PREFIX + key)
+            except redis.RedisError:
+                pass
+
+    deadline = time.monotonic() + LOCK_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            cached = client.get(RESULT_PREFIX + key)
+            if cached is not None:
+                llm_coalesced_total.labels(prompt=prompt_name, scope="redis").inc()
+                logger.info(f"[LLM-SINGLEFLIGHT] prompt={prompt_name} scope=redis key={key[:12]}")
+                return shared(loads(cached))
+            if not client.exists(LOCK_PREFIX + key):
+                # the leader failed (or its result expired): do the work ourselves
+                break
+            await asyncio.sleep(POLL_SECONDS)
+    except redis.RedisError as e:
+        logger.warning(f"[LLM-SINGLEFLIGHT-REDIS-ERROR] prompt={prompt_name} error={e}")
+    return await compute()
+
+
+async def coalesced(
+    key: str,
+    prompt_name: str,
+    compute: Callable[[], Awaitable[Any]],
+    dumps: Callable[[Any], str],
+    loads: Callable[[str], Any],
+    shared: Callable[[Any], Any] = lambda result: result,
+) -> Any:
+    """
+    Run compute() once per key across concurrent callers: followers in this process await the
+    leader's future, followers in other workers read the leader's Redis result.
+    `shared` turns a leader's result into the copy handed to followers.
+    """
+    if not LLM_SINGLEFLIGHT:
+        return await compute()
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        llm_coalesced_total.labels(prompt=prompt_name, scope="process").inc()
+        logger.info(f"[LLM-SINGLEFLIGHT] prompt={prompt_name} scope=process key={key[:12]}")
+        # concurrent.futures.Future so callers on other threads/event loops can wait on it
+        return shared(await asyncio.wrap_future(future))
+
+    try:
+        if LLM_SINGLEFLIGHT_REDIS:
+            result = await _redis_coalesced(key, prompt_name, compute, dumps, loads, shared)
+        else:
+            result = await compute()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        # followers get the error; nobody is left to retrieve it otherwise
+        future.exception()
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text" (the previous "time | level | message" lines)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", "4000"))
+# per-logger message caps, e.g. {"em-worker": 8000, "uvicorn.access": 500}; children inherit their parent's cap
+LOG_MAX_CHARS_BY_LOGGER: Dict[str, int] = json.loads(os.getenv("LOG_MAX_CHARS_BY_LOGGER", "{}"))
+# strings inside logged payloads are clipped to this many characters
+PAYLOAD_STRING_CHARS = int(os.getenv("LOG_PAYLOAD_STRING_CHARS", "200"))
+PAYLOAD_MAX_ITEMS = 50
+
+# PHI (chart text, demographics) and credentials (SAS tokens, auth headers) never reach the log sink
+REDACT_KEYS = {
+    "text", "name", "dateOfBirth", "dateOfService", "age", "gender", "insuranceName",
+    "email", "accountNumber", "mrn", "ssn",
+    "sasToken", "blobSasToken", "afterOcrSasUrl", "blobUlr", "connectionString", "connection_string",
+    "returnHeaders", "Authorization", "headers",
+} | {k.strip() for k in os.getenv("LOG_REDACT_KEYS", "").split(",") if k.strip()}
+
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _clip(value: Any, depth: int = 0) -> Any:
+    """Bounded copy of a payload: redacted keys, clipped strings, capped collection sizes and depth"""
+    if isinstance(value, str):
+        return value if len(value) <= PAYLOAD_STRING_CHARS else f"{value[:PAYLOAD_STRING_CHARS]}...<{len(value)} chars>"
+    if depth >= 6:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        out = {}
+        for i, (k, v) in enumerate(value.items()):
+            if i >= PAYLOAD_MAX_ITEMS:
+                out["..."] = f"<{len(value) - i} more keys>"
+                break
+            if k in REDACT_KEYS and v:
+                out[k] = f"<redacted {len(v) if isinstance(v, (str, dict, list)) else 1}>"
+            else:
+                out[k] = _clip(v, depth + 1)
+        return out
+    if isinstance(value, (list, tuple)):
+        out = [_clip(v, depth + 1) for v in value[:PAYLOAD_MAX_ITEMS]]
+        if len(value) > PAYLOAD_MAX_ITEMS:
+            out.append(f"<{len(value) - PAYLOAD_MAX_ITEMS} more items>")
+        return out
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return _clip(str(value), depth)
+
+
+class Payload:
+    """
+    Log argument for dicts/lists: rendered as compact JSON only if the record is emitted, after redaction
+    and clipping, so its cost is bounded by the caps rather than by the size of the chart.
+
+        logger.info("[EM-PROCESS-RESULT] patient=%s result=%s", pid, Payload(final_payload))
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(_clip(self.value), default=str, ensure_ascii=False)
+
+
+def max_chars_for(logger_name: str) -> int:
+    name = logger_name
+    while name:
+        if name in LOG_MAX_CHARS_BY_LOGGER:
+            return int(LOG_MAX_CHARS_BY_LOGGER[name])
+        name = name.rpartition(".")[0]
+    return LOG_MAX_CHARS
+
+
+def _truncate(message: str, limit: int) -> str:
+    return message if len(message) <= limit else f"{message[:limit]}...<truncated {len(message) - limit} chars>"
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Renders the message in the calling thread (the arguments may change once the call returns), capped at
+    the logger's size; JSON encoding and the actual write happen on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = _truncate(record.getMessage(), max_chars_for(record.name))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.message = message, None, message
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = _clip(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging() -> None:
+    """
+    Route every logger through one queue to a background writer (idempotent per process). Replaces the
+    handlers installed by earlier basicConfig calls, so it can run after any import order.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(TruncatingQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    # uvicorn installs its own stream handlers; let its records go through the queue as well
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
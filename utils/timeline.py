@@ -0,0 +1,147 @@
+import os
+import time
+import queue
+import atexit
+import socket
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger("timeline")
+
+PATIENT_TIMELINE = os.getenv("PATIENT_TIMELINE", "true").lower() == "true"
+# Entries kept per patient (approximate trim) and how long an idle timeline lives
+TIMELINE_MAXLEN = int(os.getenv("PATIENT_TIMELINE_MAXLEN", "500"))
+TIMELINE_TTL = int(os.getenv("PATIENT_TIMELINE_TTL", str(7 * 86400)))
+BATCH_SIZE = 200
+KEY_PREFIX = "patient_timeline:"
+
+_SOURCE = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _make_redis_client() -> redis.Redis:
+    raw_port = os.getenv("REDIS_PORT", "6379")
+    if "://" in raw_port:
+        raw_port = raw_port.split(":")[-1]
+
+    return redis.Redis(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(raw_port),
+        password=os.getenv("REDIS_PASSWORD"),
+        ssl=os.getenv("REDIS_SSL", "false").lower() == "true",
+        decode_responses=True,
+        socket_timeout=2,
+    )
+
+
+class TimelineWriter:
+    """Background writer: callers enqueue entries, one thread XADDs them in pipelined batches"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._redis: Optional[redis.Redis] = None
+
+    def put(self, patient_id: str, fields: Dict[str, str]) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="patient-timeline", daemon=True)
+                self._thread.start()
+        self._queue.put((patient_id, fields))
+
+    def _run(self) -> None:
+        while True:
+            # block for the first entry, then take whatever else is already waiting
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            self._write([entry for entry in batch if entry is not None])
+            if closing:
+                return
+
+    def _write(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+        try:
+            if self._redis is None:
+                self._redis = _make_redis_client()
+            pipe = self._redis.pipeline(transaction=False)
+            for patient_id, fields in batch:
+                key = KEY_PREFIX + patient_id
+                pipe.xadd(key, fields, maxlen=TIMELINE_MAXLEN, approximate=True)
+                pipe.expire(key, TIMELINE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"[TIMELINE-WRITE-ERROR] entries={len(batch)} error={e}")
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+writer = TimelineWriter()
+atexit.register(writer.close)
+
+
+def record(patient_id: Optional[str], stage: str, duration_s: Optional[float] = None, status: str = "ok", **extra: Any) -> None:
+    """
+    Append one entry to the patient's timeline. Spans carry their start time and a duration measured with
+    a monotonic clock in the recording process; the Redis stream id orders entries across pods.
+    """
+    if not PATIENT_TIMELINE or not patient_id:
+        return
+    now = time.time()
+    fields = {
+        "stage": stage,
+        "start": f"{now - (duration_s or 0.0):.6f}",
+        "status": status,
+        "source": _SOURCE,
+    }
+    if duration_s is not None:
+        fields["durationMs"] = f"{duration_s * 1000:.1f}"
+    fields.update({k: str(v) for k, v in extra.items() if v not in (None, "")})
+    writer.put(patient_id, fields)
+
+
+def patient_timeline(client: redis.Redis, patient_id: str) -> Dict[str, Any]:
+    """Waterfall of a patient's stages: offsets from the first entry, durations, and per-stage totals"""
+    entries = client.xrange(KEY_PREFIX + patient_id)
+    if not entries:
+        return {"patientId": patient_id, "events": [], "stages": {}, "totalMs": 0.0}
+
+    events = []
+    for entry_id, fields in entries:
+        event = {"id": entry_id, **fields}
+        event["start"] = float(fields["start"])
+        if "durationMs" in fields:
+            event["durationMs"] = float(fields["durationMs"])
+        events.append(event)
+    events.sort(key=lambda e: (e["start"], e["id"]))
+
+    origin = events[0]["start"]
+    end = origin
+    stages: Dict[str, Dict[str, float]] = {}
+    for event in events:
+        event["offsetMs"] = round((event["start"] - origin) * 1000, 1)
+        duration = event.get("durationMs", 0.0)
+        end = max(end, event["start"] + duration / 1000)
+        if "durationMs" in event:
+            totals = stages.setdefault(event["stage"], {"count": 0, "totalMs": 0.0, "maxMs": 0.0})
+            totals["count"] += 1
+            totals["totalMs"] = round(totals["totalMs"] + duration, 1)
+            totals["maxMs"] = max(totals["maxMs"], duration)
+
+    return {
+        "patientId": patient_id,
+        "events": events,
+        "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["totalMs"])),
+        "totalMs": round((end - origin) * 1000, 1),
+    }
@@ -1,11 +1,19 @@
+import asyncio
+import json
 import logging
 import os
-from typing import Optional, Dict, Any
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
 
 from opentelemetry import trace
 from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan, SpanProcessor
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, ALWAYS_ON
+from opentelemetry.trace import SpanKind, Status, StatusCode
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.requests import RequestsInstrumentor
 from opentelemetry.instrumentation.redis import RedisInstrumentor
@@ -21,9 +29,25 @@ except ImportError:
     except ImportError:
         OTLPSpanExporter = None
 
+from utils.metrics import trace_sampling_decisions_total
+
 _logger = logging.getLogger("tracing")
 _tracing_initialized: bool = False
 
+# Tail sampling: every span is recorded, and the keep/drop decision is made when the trace's local root ends
+TRACE_TAIL_SAMPLING = os.getenv("TRACE_TAIL_SAMPLING", "true").lower() == "true"
+TRACE_SLOW_THRESHOLD_MS = float(os.getenv("TRACE_SLOW_THRESHOLD_MS", "5000"))
+# per local-root span name prefix, e.g. {"em.process_one_em": 120000, "POST /miner_process_task": 500}
+TRACE_SLOW_THRESHOLDS_MS: Dict[str, float] = json.loads(os.getenv("TRACE_SLOW_THRESHOLDS_MS", "{}"))
+TRACE_FAST_SAMPLE_RATIO = float(os.getenv("TRACE_FAST_SAMPLE_RATIO", "0.05"))
+TRACE_TAIL_MAX_TRACES = int(os.getenv("TRACE_TAIL_MAX_TRACES", "2000"))
+TRACE_TAIL_MAX_SPANS = int(os.getenv("TRACE_TAIL_MAX_SPANS", "500"))
+# health/metrics probes are never traced
+TRACE_EXCLUDED_URLS = os.getenv("TRACE_EXCLUDED_URLS", "/health,/metrics")
+_EXCLUDED_ROOT = re.compile(
+    "|".join(re.escape(u.strip()) for u in TRACE_EXCLUDED_URLS.split(",") if u.strip()) or "(?!)"
+)
+
 
 def _parse_resource_attributes(attrs_str: str) -> Dict[str, Any]:
     """
@@ -66,6 +90,114 @@ def _get_sampling_probability() -> float:
     return 1.0  # Default: sample everything
 
 
+def _slow_threshold_ms(root_name: str) -> float:
+    for prefix, threshold in TRACE_SLOW_THRESHOLDS_MS.items():
+        if root_name.startswith(prefix):
+            return float(threshold)
+    return TRACE_SLOW_THRESHOLD_MS
+
+
+def _fast_sampled(trace_id: int, ratio: float) -> bool:
+    """Same bound as TraceIdRatioBased, so every process keeps the same fast traces"""
+    return (trace_id & 0xFFFFFFFFFFFFFFFF) < int(ratio * (2 ** 64))
+
+
+class TailSamplingProcessor(SpanProcessor):
+    """
+    Buffers finished spans per trace and forwards them to `delegate` only when the trace is worth keeping.
+
+    The decision is made when the local root (a span with no parent in this process) ends:
+    - errors anywhere in the trace and roots slower than the threshold are always kept;
+    - other traces are kept for TRACE_FAST_SAMPLE_RATIO of trace ids, except standalone client spans
+      (background Redis polling) which are only kept when slow or failed;
+    - health/metrics requests are dropped.
+    Ray workers decide on their own local roots; the trace-id bound keeps fast samples consistent across them.
+    """
+
+    def __init__(
+        self,
+        delegate: SpanProcessor,
+        fast_ratio: float = TRACE_FAST_SAMPLE_RATIO,
+        max_traces: int = TRACE_TAIL_MAX_TRACES,
+        max_spans: int = TRACE_TAIL_MAX_SPANS,
+    ):
+        self._delegate = delegate
+        self._fast_ratio = fast_ratio
+        self._max_traces = max_traces
+        self._max_spans = max_spans
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[int, List[ReadableSpan]]" = OrderedDict()
+        # kept traces: spans that end after their root (or under a later local root) go straight through
+        self._kept: "OrderedDict[int, None]" = OrderedDict()
+
+    def on_start(self, span, parent_context=None) -> None:
+        self._delegate.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        is_local_root = span.parent is None or span.parent.is_remote
+        with self._lock:
+            if trace_id in self._kept:
+                keep, batch = True, [span]
+            else:
+                spans = self._pending.setdefault(trace_id, [])
+                if len(spans) < self._max_spans or is_local_root:
+                    spans.append(span)
+                if not is_local_root:
+                    self._evict_overflow()
+                    return
+                batch = self._pending.pop(trace_id)
+                keep, reason = self._decide(span, batch)
+                trace_sampling_decisions_total.labels(decision="keep" if keep else "drop", reason=reason).inc()
+                if keep:
+                    self._remember(trace_id)
+        if keep:
+            for finished in batch:
+                self._delegate.on_end(finished)
+
+    def _decide(self, root: ReadableSpan, spans: List[ReadableSpan]):
+        if _EXCLUDED_ROOT.search(root.name):
+            return False, "excluded"
+        if any(s.status.status_code == StatusCode.ERROR for s in spans):
+            return True, "error"
+        duration_ms = ((root.end_time or 0) - (root.start_time or 0)) / 1e6
+        if duration_ms >= _slow_threshold_ms(root.name):
+            return True, "slow"
+        if root.kind != SpanKind.CLIENT and _fast_sampled(root.context.trace_id, self._fast_ratio):
+            return True, "fast_sample"
+        return False, "fast"
+
+    def _remember(self, trace_id: int) -> None:
+        self._kept[trace_id] = None
+        while len(self._kept) > self._max_traces:
+            self._kept.popitem(last=False)
+
+    def _evict_overflow(self) -> None:
+        # traces whose root never ends in this process (or is very long-lived) must not grow without bound
+        while len(self._pending) > self._max_traces:
+            self._pending.popitem(last=False)
+            trace_sampling_decisions_total.labels(decision="drop", reason="evicted").inc()
+
+    def shutdown(self) -> None:
+        self._delegate.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self._delegate.force_flush(timeout_millis)
+
+
+def _requests_request_hook(span, request) -> None:
+    if span and span.is_recording():
+        body = request.body
+        span.set_attribute("http.request.body.size", len(body) if body else 0)
+
+
+def _requests_response_hook(span, request, response) -> None:
+    if span and span.is_recording():
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit():
+            span.set_attribute("http.response.body.size", int(length))
+
+
 def init_tracer(service_name: Optional[str] = None) -> None:
     """
     Initialize OpenTelemetry tracer with OTLP exporter (gRPC).
@@ -77,6 +209,9 @@ def init_tracer(service_name: Optional[str] = None) -> None:
     - OTEL_SERVICE_NAME: Service name (overrides function parameter)
     - OTEL_RESOURCE_ATTRIBUTES: Resource attributes as "key=value,key2=value2"
     - OTEL_TRACES_SAMPLER_ARG or MANAGEMENT_TRACING_SAMPLING_PROBABILITY: Sampling probability
+      (head sampling; only used with TRACE_TAIL_SAMPLING=false)
+    - TRACE_TAIL_SAMPLING, TRACE_SLOW_THRESHOLD_MS, TRACE_SLOW_THRESHOLDS_MS, TRACE_FAST_SAMPLE_RATIO:
+      in-process tail sampling (see TailSamplingProcessor)
     - OTEL_PROPAGATORS: Comma-separated list of propagators (tracecontext is default)
 
     This function is safe to call multiple times; initialization will
@@ -119,7 +254,16 @@ def init_tracer(service_name: Optional[str] = None) -> None:
     
     # Configure sampling
     sampling_prob = _get_sampling_probability()
-    if sampling_prob < 1.0:
+    if TRACE_TAIL_SAMPLING:
+        # record everything (unless the caller's context says unsampled); the tail processor decides
+        provider = TracerProvider(resource=resource, sampler=ParentBased(ALWAYS_ON))
+        sampling_prob = TRACE_FAST_SAMPLE_RATIO
+        _logger.info(
+            "Using tail sampling: slow >= %.0fms and errors kept, fast traces kept at %.2f",
+            TRACE_SLOW_THRESHOLD_MS,
+            TRACE_FAST_SAMPLE_RATIO,
+        )
+    elif sampling_prob < 1.0:
         from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
         sampler = TraceIdRatioBased(sampling_prob)
         provider = TracerProvider(resource=resource, sampler=sampler)
@@ -143,6 +287,8 @@ def init_tracer(service_name: Optional[str] = None) -> None:
     try:
         otlp_exporter = OTLPSpanExporter(endpoint=otlp_endpoint)
         span_processor = BatchSpanProcessor(otlp_exporter)
+        if TRACE_TAIL_SAMPLING:
+            span_processor = TailSamplingProcessor(span_processor)
         provider.add_span_processor(span_processor)
     except Exception as exc:
         _logger.error("Failed to create OTLP exporter: %s", exc, exc_info=True)
@@ -177,7 +323,10 @@ def init_tracer(service_name: Optional[str] = None) -> None:
 
     # Auto-instrument common libraries
     try:
-        RequestsInstrumentor().instrument()
+        RequestsInstrumentor().instrument(
+            request_hook=_requests_request_hook,
+            response_hook=_requests_response_hook,
+        )
     except Exception as exc:
         _logger.warning("Failed to instrument requests: %s", exc)
 
@@ -212,12 +361,57 @@ def instrument_fastapi(app) -> None:
     Attach OpenTelemetry instrumentation to a FastAPI app.
     """
     try:
-        FastAPIInstrumentor.instrument_app(app)
+        FastAPIInstrumentor.instrument_app(app, excluded_urls=TRACE_EXCLUDED_URLS)
         _logger.info("FastAPI instrumentation enabled for tracing")
     except Exception as exc:  # pragma: no cover - defensive logging
         _logger.warning("Failed to instrument FastAPI app: %s", exc)
 
 
+@contextmanager
+def traced_span(name: str, **attributes: Any):
+    """
+    Start a span as the current span (no-op when tracing is disabled). Exceptions are recorded and mark
+    the span as errored, which makes the tail sampler keep the trace; cancellation (a hedged attempt
+    that lost the race) is not an error.
+
+    Usage:
+        with traced_span("duckdb icd_main", **{"db.system": "duckdb"}) as span:
+            ...
+    """
+    with get_tracer("em").start_as_current_span(
+        name,
+        attributes={k: v for k, v in attributes.items() if v is not None},
+        record_exception=False,
+        set_status_on_exception=False,
+    ) as span:
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.set_attribute("cancelled", True)
+            raise
+        except Exception as exc:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR, str(exc)))
+            raise
+
+
+def set_llm_response_attributes(span: trace.Span, response: Any) -> None:
+    """Token counts and response size of a chat completion (usage is None for coalesced followers)"""
+    if not span.is_recording():
+        return
+    usage = getattr(response, "usage", None)
+    span.set_attribute("llm.coalesced", usage is None)
+    if usage is not None:
+        span.set_attribute("gen_ai.usage.input_tokens", usage.prompt_tokens or 0)
+        span.set_attribute("gen_ai.usage.output_tokens", usage.completion_tokens or 0)
+    model = getattr(response, "model", None)
+    if model:
+        span.set_attribute("gen_ai.response.model", model)
+    choices = getattr(response, "choices", None) or []
+    if choices:
+        span.set_attribute("llm.response.chars", len(choices[0].message.content or ""))
+
+
 def extract_trace_context_from_trace_dto(trace_dto: Dict[str, Any]) -> Optional[trace.SpanContext]:
     """
     Extract OpenTelemetry trace context from traceDto dictionary.
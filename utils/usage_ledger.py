@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from utils.metrics import llm_usage_calls_total, llm_usage_tokens_total, llm_usage_cost_usd_total
+
+logger = logging.getLogger("usage_ledger")
+
+LLM_USAGE_LEDGER = os.getenv("LLM_USAGE_LEDGER", "true").lower() == "true"
+# One Parquet file per flushed batch, partitioned by day: <dir>/day=YYYY-MM-DD/<file>.parquet
+USAGE_DIR = os.getenv("LLM_USAGE_DIR", "data/llm_usage")
+FLUSH_RECORDS = int(os.getenv("LLM_USAGE_FLUSH_RECORDS", "200"))
+FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "10"))
+
+# USD per 1K (prompt, completion) tokens; override with MODEL_PRICES='{"model": [in, out]}'
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+    "gpt-4.1": (0.002, 0.008),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("MODEL_PRICES", "{}")).items()})
+
+COLUMNS = (
+    "ts DOUBLE, patient_id VARCHAR, trace_id VARCHAR, prompt VARCHAR, model VARCHAR, "
+    "prompt_tokens INTEGER, completion_tokens INTEGER, latency_ms DOUBLE, cost_usd DOUBLE, coalesced BOOLEAN"
+)
+
+# patientId/traceId of the chart being processed; set at the task entry points (Ray remotes, endpoints)
+_patient_id: contextvars.ContextVar[str] = contextvars.ContextVar("usage_patient_id", default="")
+_trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("usage_trace_id", default="")
+
+
+def set_usage_context(patient_id: Optional[str] = "", trace_id: Optional[str] = "") -> None:
+    _patient_id.set(patient_id or "")
+    _trace_id.set(trace_id or "")
+
+
+def current_patient_id() -> str:
+    return _patient_id.get()
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+@contextmanager
+def usage_context(patient_id: Optional[str] = "", trace_id: Optional[str] = ""):
+    tokens = (_patient_id.set(patient_id or ""), _trace_id.set(trace_id or ""))
+    try:
+        yield
+    finally:
+        _patient_id.reset(tokens[0])
+        _trace_id.reset(tokens[1])
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1000
+
+
+class UsageWriter:
+    """Background writer: callers enqueue records, one thread flushes batches to Parquet"""
+
+    def __init__(self, directory: str = USAGE_DIR, flush_records: int = FLUSH_RECORDS, flush_seconds: float = FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+                self._thread.start()
+
+    def put(self, row: tuple) -> None:
+        self._ensure_started()
+        self._queue.put(row)
+
+    def _run(self) -> None:
+        batch: List[tuple] = []
+        deadline = time.monotonic() + self.flush_seconds
+        while True:
+            try:
+                row = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                row = ...
+            if row is None:
+                self._write(batch)
+                return
+            if row is not ...:
+                batch.append(row)
+            if len(batch) >= self.flush_records or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_seconds
+
+    def _write(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+        try:
+            day = time.strftime("%Y-%m-%d", time.gmtime(batch[0][0]))
+            part_dir = os.path.join(self.directory, f"day={day}")
+            os.makedirs(part_dir, exist_ok=True)
+            path = os.path.join(part_dir, f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:12]}.parquet")
+            with duckdb.connect() as conn:
+                conn.execute(f"CREATE TEMP TABLE usage ({COLUMNS})")
+                conn.executemany(f"INSERT INTO usage VALUES ({', '.join('?' * 10)})", batch)
+                conn.execute(f"COPY usage TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+            logger.info(f"[LLM-USAGE-FLUSH] records={len(batch)} path={path}")
+        except Exception as e:
+            logger.error(f"[LLM-USAGE-FLUSH-ERROR] records={len(batch)} error={e}")
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+
+writer = UsageWriter()
+atexit.register(writer.close)
+
+
+def record_usage(prompt_name: str, model: str, response: Any, latency_s: float, coalesced: bool = False) -> None:
+    """
+    Metrics + ledger row for one completion. Single-flight followers pass coalesced=True and carry no usage
+    (0 tokens); a provider response without a usage block is an ordinary call with 0 tokens.
+    """
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cost = call_cost(model, prompt_tokens, completion_tokens)
+
+    llm_usage_calls_total.labels(prompt=prompt_name, model=model).inc()
+    llm_usage_tokens_total.labels(prompt=prompt_name, model=model, kind="prompt").inc(prompt_tokens)
+    llm_usage_tokens_total.labels(prompt=prompt_name, model=model, kind="completion").inc(completion_tokens)
+    llm_usage_cost_usd_total.labels(prompt=prompt_name, model=model).inc(cost)
+    if not LLM_USAGE_LEDGER:
+        return
+    writer.put((
+        time.time(), _patient_id.get(), _trace_id.get(), prompt_name, model,
+        prompt_tokens, completion_tokens, latency_s * 1000, cost, coalesced,
+    ))
+
+
+def usage_summary(since: Optional[float] = None, patient_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Per-prompt/model call counts, token and cost totals and latency percentiles from the ledger"""
+    query = (
+        "SELECT prompt, model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost_usd), "
+        "quantile_cont(latency_ms, 0.5), quantile_cont(latency_ms, 0.95), quantile_cont(latency_ms, 0.99), "
+        "SUM(CASE WHEN coalesced THEN 1 ELSE 0 END), COUNT(DISTINCT trace_id) "
+        f"FROM read_parquet('{os.path.join(USAGE_DIR, '*', '*.parquet')}', hive_partitioning = true)"
+    )
+    where, params = [], []
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(since)
+    if patient_id:
+        where.append("patient_id = ?")
+        params.append(patient_id)
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " GROUP BY prompt, model ORDER BY SUM(cost_usd) DESC"
+    try:
+        with duckdb.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+    except duckdb.IOException:
+        # nothing flushed yet
+        return []
+    return [
+        {
+            "prompt": r[0],
+            "model": r[1],
+            "calls": r[2],
+            "promptTokens": int(r[3] or 0),
+            "completionTokens": int(r[4] or 0),
+            "costUsd": round(r[5] or 0.0, 6),
+            "latencyMs": {"p50": round(r[6] or 0, 1), "p95": round(r[7] or 0, 1), "p99": round(r[8] or 0, 1)},
+            "coalesced": int(r[9] or 0),
+            "traces": r[10],
+        }
+        for r in rows
+    ]
@@ -0,0 +1,10 @@
+import os
+
+from utils.structured_logging import configure_logging
+from utils.tracing import init_tracer
+
+
+def setup_ray_worker() -> None:
+    """Ray worker_process_setup_hook: remotes are pickled by value, so workers never import api/* and its setup"""
+    configure_logging()
+    init_tracer(service_name=os.getenv("OTEL_SERVICE_NAME", "em-worker"))